@@ -1,62 +1,77 @@
 import os
 import sys
-import threading
-import json
+import time
+# Referencia para el desglose del arranque (ver TiemposArranque)
+INICIO_PROCESO = time.perf_counter()
+import queue
+import importlib
 from datetime import datetime
+from functools import partial
 from PyQt6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, 
                             QHBoxLayout, QTextEdit, QPushButton, QLabel, 
-                            QScrollArea, QFrame, QTabWidget, QMenuBar, QDialog, 
+                            QTabWidget, QDialog, 
                             QComboBox, QLineEdit, QDialogButtonBox, QMessageBox,
-                            QFileDialog, QInputDialog, QCheckBox)
-from PyQt6.QtCore import Qt, QThread, pyqtSignal, QTimer
-from PyQt6.QtGui import QFont, QClipboard
+                            QFileDialog, QInputDialog, QCheckBox, QListView,
+                            QAbstractItemView, QStyledItemDelegate, QStyle,
+                            QDockWidget, QListWidget, QListWidgetItem, QTableWidget,
+                            QTableWidgetItem, QHeaderView)
+from PyQt6.QtCore import (Qt, QThread, QObject, pyqtSignal, QTimer, QAbstractListModel,
+                          QModelIndex, QRect, QRectF, QSize, QEvent, QFileSystemWatcher)
+from PyQt6.QtGui import QFont, QFontMetrics, QColor, QPainter, QCursor
 
-SETTINGS_PATH = os.path.join(os.path.dirname(__file__), "settings.json")
+from deepseek_core.ajustes import AJUSTES, get_settings, save_settings, check_dependencias
+from deepseek_core.almacen import AlmacenJSONL, crear_almacen
+from deepseek_core.busqueda import IndiceBusqueda
+from deepseek_core.cache import cerrar_cache
+from deepseek_core.chat import ChunkBuffer, crear_bot
+from deepseek_core.metricas import REGISTRO_METRICAS, describir_metricas
+from deepseek_core.proveedores import PROVEEDORES, AUTORES_IA, Proveedor
+from deepseek_core.red import CONTADORES_RED, obtener_planificador, cerrar_clientes
 
-# Instalación automática de dependencias
-def instalar_dependencias():
-    try:
-        import openai
-        import fpdf
-    except ImportError:
-        import subprocess
-        pkgs = ["openai", "fpdf"]
-        for pkg in pkgs:
-            subprocess.check_call([sys.executable, "-m", "pip", "install", pkg])
-        # Confirmación en settings
-        settings = {}
-        if os.path.exists(SETTINGS_PATH):
-            with open(SETTINGS_PATH, "r", encoding="utf-8") as f:
-                settings = json.load(f)
-        settings["dependencias_instaladas"] = True
-        with open(SETTINGS_PATH, "w", encoding="utf-8") as f:
-            json.dump(settings, f, ensure_ascii=False, indent=2)
+class TiemposArranque:
+    """Desglose del arranque en ms por etapa, para la barra de estado y los benchmarks."""
+    def __init__(self, inicio=None):
+        self.inicio = self.ultimo = inicio if inicio is not None else time.perf_counter()
+        self.etapas = {}
+        self.primer_pintado = None
+        self.terminado = False
+    
+    def marcar(self, etapa):
+        ahora = time.perf_counter()
+        self.etapas[etapa] = round((ahora - self.ultimo) * 1000, 1)
+        self.ultimo = ahora
+    
+    def marcar_primer_pintado(self):
+        self.marcar("primer_pintado")
+        self.primer_pintado = round((self.ultimo - self.inicio) * 1000, 1)
+    
+    def describir(self):
+        total = round((self.ultimo - self.inicio) * 1000)
+        etapas = " · ".join(f"{etapa.replace('_', ' ')} {ms:.0f}" for etapa, ms in self.etapas.items())
+        return f"Arranque: primer pintado en {self.primer_pintado:.0f} ms, listo en {total} ms ({etapas})"
 
-# Llama a instalar_dependencias solo la primera vez
-def check_dependencias():
-    if os.path.exists(SETTINGS_PATH):
-        try:
-            with open(SETTINGS_PATH, "r", encoding="utf-8") as f:
-                settings = json.load(f)
-            if settings.get("dependencias_instaladas"):
-                return
-        except Exception:
-            pass
-    instalar_dependencias()
+class PrecargaDependencias(QThread):
+    """Comprueba las dependencias (instalando las que falten) e importa openai en segundo plano.
 
-check_dependencias()
+    Así ni la ventana espera a pip ni el primer mensaje paga la importación
+    del SDK; la interfaz ya está visible mientras tanto.
+    """
+    terminada = pyqtSignal(str)
+    
+    def run(self):
+        try:
+            instaladas = check_dependencias()
+            importlib.import_module("openai")
+            mensaje = f"Dependencias instaladas: {', '.join(instaladas)}" if instaladas else ""
+        except Exception as e:
+            mensaje = f"No se pudieron preparar las dependencias: {e}"
+        self.terminada.emit(mensaje)
 
 def get_conversaciones_dir():
     """Obtiene la ruta de la carpeta conversaciones desde settings.json o pregunta al usuario."""
-    if os.path.exists(SETTINGS_PATH):
-        try:
-            with open(SETTINGS_PATH, "r", encoding="utf-8") as f:
-                settings = json.load(f)
-            conversaciones_dir = settings.get("conversaciones_dir")
-            if conversaciones_dir and os.path.exists(conversaciones_dir):
-                return conversaciones_dir
-        except Exception:
-            pass
+    conversaciones_dir = AJUSTES.obtener_texto("conversaciones_dir")
+    if conversaciones_dir and os.path.exists(conversaciones_dir):
+        return conversaciones_dir
     # Pregunta al usuario y guarda en settings.json
     app = QApplication.instance()
     if app is None:
@@ -74,43 +89,37 @@ def get_conversaciones_dir():
         except Exception as e:
             QMessageBox.critical(None, "Error", f"No se pudo crear la carpeta: {e}")
             return None
-    # Guarda la ruta en settings.json
-    try:
-        with open(SETTINGS_PATH, "w", encoding="utf-8") as f:
-            json.dump({"conversaciones_dir": conversaciones_dir}, f, ensure_ascii=False, indent=2)
-    except Exception:
-        pass
+    # Guarda la ruta en settings.json (sin tocar el resto de ajustes)
+    AJUSTES.establecer("conversaciones_dir", conversaciones_dir)
     return conversaciones_dir
 
 def seleccionar_historial(conversaciones_dir):
     """Permite al usuario seleccionar el historial a cargar."""
-    archivos = [f for f in os.listdir(conversaciones_dir) if f.endswith(".json")]
-    if not archivos:
-        # Si no hay archivos, crea uno por defecto
+    almacen = AlmacenJSONL(conversaciones_dir)
+    nombres = almacen.listar()
+    if not nombres:
+        # Si no hay conversaciones, crea una por defecto
         nombre, ok = QInputDialog.getText(None, "Nuevo chat", "Nombre para la conversación:")
         if not ok or not nombre:
             nombre = "Historial_conversaciones"
-        historial_path = os.path.join(conversaciones_dir, f"{nombre}.json")
-        with open(historial_path, "w", encoding="utf-8") as f:
-            json.dump([], f, ensure_ascii=False, indent=2)
-        return historial_path
-    # Si hay archivos, permite seleccionar uno
-    opciones = "\n".join(f"{i+1}. {archivos[i]}" for i in range(len(archivos)))
+        almacen.crear(nombre)
+        return almacen.ruta(nombre)
+    # Si hay conversaciones, permite seleccionar una
+    opciones = "\n".join(f"{i+1}. {nombres[i]}" for i in range(len(nombres)))
     seleccion, ok = QInputDialog.getText(
         None, "Seleccionar conversación",
         f"Conversaciones disponibles:\n{opciones}\n\nIngrese el número de la conversación a abrir, o escriba un nombre nuevo:"
     )
     if not ok or not seleccion:
-        historial_path = os.path.join(conversaciones_dir, archivos[0])
-    elif seleccion.isdigit() and 1 <= int(seleccion) <= len(archivos):
-        historial_path = os.path.join(conversaciones_dir, archivos[int(seleccion)-1])
+        nombre = nombres[0]
+    elif seleccion.isdigit() and 1 <= int(seleccion) <= len(nombres):
+        nombre = nombres[int(seleccion)-1]
     else:
         # Nuevo nombre
-        historial_path = os.path.join(conversaciones_dir, f"{seleccion}.json")
-        if not os.path.exists(historial_path):
-            with open(historial_path, "w", encoding="utf-8") as f:
-                json.dump([], f, ensure_ascii=False, indent=2)
-    return historial_path
+        nombre = seleccion
+        if not almacen.existe(nombre):
+            almacen.crear(nombre)
+    return almacen.ruta(nombre)
 
 class IASelectionDialog(QDialog):
     def __init__(self, parent=None):
@@ -123,7 +132,7 @@ class IASelectionDialog(QDialog):
         layout.addWidget(QLabel("Elija una IA:"))
         
         self.ia_combo = QComboBox()
-        self.ia_combo.addItems(["Deepseek", "ChatGPT"])
+        self.ia_combo.addItems(list(PROVEEDORES))
         layout.addWidget(self.ia_combo)
         
         layout.addWidget(QLabel("API Key:"))
@@ -152,181 +161,598 @@ def seleccionar_ia_y_key():
         return dialog.get_values()
     return None, None
 
-def get_settings():
-    settings = {}
-    if os.path.exists(SETTINGS_PATH):
-        try:
-            with open(SETTINGS_PATH, "r", encoding="utf-8") as f:
-                settings = json.load(f)
-        except Exception:
-            pass
-    return settings
-
-def save_settings(settings):
-    try:
-        with open(SETTINGS_PATH, "w", encoding="utf-8") as f:
-            json.dump(settings, f, ensure_ascii=False, indent=2)
-    except Exception:
-        pass
-
 def get_api_key_and_ia():
     settings = get_settings()
     ia = settings.get("ia_seleccionada")
     api_keys = settings.get("api_keys", {})
     key = api_keys.get(ia)
-    if not ia or not key:
+    if not ia or (not key and PROVEEDORES.get(ia, Proveedor).requiere_key):
         ia, key = seleccionar_ia_y_key()
         if "api_keys" not in settings:
             settings["api_keys"] = {}
         settings["api_keys"][ia] = key
         settings["ia_seleccionada"] = ia
         save_settings(settings)
-    return ia, settings["api_keys"]
+    return ia, settings.get("api_keys", {})
 
 # === Configuración ===
-BASE_URL = "https://api.deepseek.com"
-DEFAULT_MODEL = "deepseek-chat"
+# Frecuencia máxima (Hz) con la que se vuelcan los fragmentos del stream a la interfaz
+RENDER_FPS = 30
+
+# === Temas ===
+# Colores de cada tema: los usan la hoja de estilos de la aplicación y el delegado de mensajes
+TEMA_OSCURO = {
+    "main_bg": "#1e1e1e",
+    "chat_bg": "#1e1e1e", 
+    "input_bg": "#2d2d2d",
+    "input_border": "#555555",
+    "text_color": "white",
+    "bot_msg_bg": "#2d2d2d",
+    "bot_msg_color": "#e6e6e6",
+    "bot_msg_border": "#c7254e",
+    "user_msg_bg": "#0d47a1",
+    "user_msg_color": "white",
+    "button_bg": "#0d7377",
+    "button_hover": "#14a085",
+    "copy_button_bg": "#555555",
+    "copy_button_hover": "#777777",
+    "date_bg": "#404040",
+    "date_color": "#cccccc",
+    "status_color": "#cccccc"
+}
+
+TEMA_CLARO = {
+    "main_bg": "#ffffff",
+    "chat_bg": "#ffffff",
+    "input_bg": "#ffffff", 
+    "input_border": "#cccccc",
+    "text_color": "#333333",
+    "bot_msg_bg": "#f8f9fa",
+    "bot_msg_color": "#333333",
+    "bot_msg_border": "#dc3545",
+    "user_msg_bg": "#007bff",
+    "user_msg_color": "white",
+    "button_bg": "#28a745",
+    "button_hover": "#218838",
+    "copy_button_bg": "#6c757d",
+    "copy_button_hover": "#545b62",
+    "date_bg": "#e9ecef",
+    "date_color": "#6c757d",
+    "status_color": "#6c757d"
+}
+
+# Tema activo. Los delegados de todas las pestañas pintan con este mismo
+# diccionario, así que cambiar de tema es actualizarlo y repintar lo visible
+ESTILOS_TEMA = dict(TEMA_OSCURO)
+
+def hoja_de_estilos(styles):
+    """Hoja de estilos de toda la aplicación para un tema.
+
+    Los widgets de cada chat se identifican por objectName (y los botones por
+    la propiedad dinámica "rol"), así que un único setStyleSheet en la
+    aplicación los restyla todos sin tocarlos uno a uno.
+    """
+    return f"""
+        QMainWindow {{ background-color: {styles['main_bg']}; color: {styles['text_color']}; }}
+        QWidget#chatWidget, QWidget#chatWidget QWidget {{
+            background-color: {styles['main_bg']}; color: {styles['text_color']};
+        }}
+        QWidget#chatWidget QListView#chatView {{ background-color: {styles['chat_bg']}; border: none; }}
+        QWidget#chatWidget QTextEdit#chatInput {{
+            background-color: {styles['input_bg']};
+            color: {styles['text_color']};
+            border: 2px solid {styles['input_border']};
+            border-radius: 5px;
+            padding: 5px;
+        }}
+        QWidget#chatWidget QPushButton[rol="accion"] {{
+            background-color: {styles['button_bg']};
+            color: white;
+            border: none;
+            border-radius: 5px;
+            padding: 8px;
+            font-weight: bold;
+        }}
+        QWidget#chatWidget QPushButton[rol="accion"]:hover {{ background-color: {styles['button_hover']}; }}
+        QWidget#chatWidget QPushButton[rol="accion"]:disabled {{ background-color: {styles['copy_button_bg']}; }}
+        QWidget#chatWidget QLabel#chatStatus {{ color: {styles['status_color']}; padding: 5px; }}
+    """
+
+def aplicar_tema(oscuro):
+    """Aplica el tema a toda la aplicación con una sola hoja de estilos, sin recorrer los widgets."""
+    ESTILOS_TEMA.update(TEMA_OSCURO if oscuro else TEMA_CLARO)
+    app = QApplication.instance()
+    if app is not None:
+        app.setStyleSheet(hoja_de_estilos(ESTILOS_TEMA))
 
 def get_api_key():
     """Obtiene la API Key desde settings.json o pidiéndola al usuario y la guarda."""
-    api_key = None
-    # Leer settings.json si existe
-    if os.path.exists(SETTINGS_PATH):
-        try:
-            with open(SETTINGS_PATH, "r", encoding="utf-8") as f:
-                settings = json.load(f)
-            api_key = settings.get("deepseek_api_key")
-            if api_key:
-                return api_key
-        except Exception:
-            pass
+    api_key = AJUSTES.obtener_texto("deepseek_api_key")
+    if api_key:
+        return api_key
     # Si no existe, pedir al usuario y guardar en settings.json
     api_key, ok = QInputDialog.getText(None, "API Key", "Ingrese su DeepSeek API Key:", QLineEdit.EchoMode.Password)
     if not ok or not api_key:
         return None
-    # Guardar en settings.json junto con la carpeta de conversaciones si existe
-    try:
-        settings = {}
-        if os.path.exists(SETTINGS_PATH):
-            with open(SETTINGS_PATH, "r", encoding="utf-8") as f:
-                settings = json.load(f)
-        settings["deepseek_api_key"] = api_key
-        with open(SETTINGS_PATH, "w", encoding="utf-8") as f:
-            json.dump(settings, f, ensure_ascii=False, indent=2)
-    except Exception:
-        pass
+    AJUSTES.establecer("deepseek_api_key", api_key)
     return api_key
 
-class DeepSeekChat:
-    def __init__(self, api_key, base_url, model):
-        from openai import OpenAI
-        self.client = OpenAI(api_key=api_key, base_url=base_url)
-        self.model = model
-        self.messages = [{"role": "system", "content": "Eres un asistente útil y expresivo."}]
-
-    def stream_chat(self, user_text, callback):
-        """Envía mensaje y recibe respuesta en streaming, llamando a callback con cada chunk."""
-        self.messages.append({"role": "user", "content": user_text})
+class PeticionChat(QObject):
+    """Petición de chat que se ejecuta como corrutina en el núcleo asíncrono.
 
-        stream = self.client.chat.completions.create(
-            model=self.model,
-            messages=self.messages,
-            stream=True
-        )
-
-        reply_accum = ""
-        for chunk in stream:
-            delta = chunk.choices[0].delta
-            if delta and delta.content:
-                reply_accum += delta.content
-                callback(delta.content)
-        self.messages.append({"role": "assistant", "content": reply_accum})
-        return reply_accum
-
-class ChatStreamThread(QThread):
-    chunk_received = pyqtSignal(str)
+    No ocupa un hilo propio: pasa por la cola del planificador, el stream
+    corre en el bucle compartido y avisa a
+    la interfaz con señales, que Qt entrega en el hilo principal. Los
+    fragmentos se acumulan en un ChunkBuffer que la interfaz vacía a su ritmo.
+    """
     finished_streaming = pyqtSignal(str)
     error_occurred = pyqtSignal(str)
     
-    def __init__(self, bot, user_text, ia_tipo, api_keys):
-        super().__init__()
+    def __init__(self, bot, user_text, parent=None):
+        super().__init__(parent)
         self.bot = bot
         self.user_text = user_text
-        self.ia_tipo = ia_tipo
-        self.api_keys = api_keys
         self.full_reply = ""
+        self.buffer = ChunkBuffer()
+        self.futuro = None
+        self.cancelada = False
     
-    def run(self):
+    def start(self):
+        self.futuro = obtener_planificador().enviar(self.bot.proveedor, self._ejecutar())
+    
+    def cancelar(self):
+        """Cancela la petición, esté en cola o recibiendo; no emite más señales."""
+        self.cancelada = True
+        if self.futuro is not None:
+            self.futuro.cancel()
+    
+    async def _ejecutar(self):
         try:
             max_length = 4096
-            if self.ia_tipo == "Deepseek":
-                self.full_reply = self.bot.stream_chat(self.user_text, self.emit_chunk)
-                self.full_reply = self.full_reply[:max_length] + ("..." if len(self.full_reply) > max_length else "")
-            elif self.ia_tipo == "ChatGPT":
-                from openai import OpenAI
-                api_key = self.api_keys.get("ChatGPT")
-                client = OpenAI(api_key=api_key)
-                response = client.chat.completions.create(
-                    model="gpt-4",
-                    messages=[
-                        {"role": "user", "content": self.user_text},
-                    ]
-                )
-                reply = response.choices[0].message.content
-                reply = reply[:max_length] + ("..." if len(reply) > max_length else "")
-                self.full_reply = reply
-                self.emit_chunk(reply)
-            
+            self.full_reply = await self.bot.stream_chat(self.user_text, self.emit_chunk)
+            self.full_reply = self.full_reply[:max_length] + ("..." if len(self.full_reply) > max_length else "")
             self.finished_streaming.emit(self.full_reply)
         except Exception as e:
             self.error_occurred.emit(str(e))
     
     def emit_chunk(self, chunk):
-        self.chunk_received.emit(chunk)
+        # No se emite una señal por fragmento: la interfaz vacía el buffer periódicamente
+        self.buffer.push(chunk)
+
+class IndexadorBusqueda(QThread):
+    """Hilo que mantiene al día un IndiceBusqueda a partir del almacén.
+
+    Al arrancar recorre todas las conversaciones y solo reindexa las que han
+    cambiado desde la última vez; después procesa los eventos que el almacén
+    notifica al escribir (mensajes nuevos, títulos, renombrados, borrados).
+    """
+    indice_actualizado = pyqtSignal()
+    
+    def __init__(self, almacen, indice, parent=None):
+        super().__init__(parent)
+        self.almacen = almacen
+        self.indice = indice
+        self._cola = queue.Queue()
+        almacen.observadores.append(self.on_evento_almacen)
+    
+    def on_evento_almacen(self, evento, nombre, dato=None):
+        # Se llama desde el hilo que escribe: solo se encola
+        self._cola.put((evento, nombre, dato))
+    
+    def escanear(self):
+        self._cola.put(("escanear", None, None))
+    
+    def detener(self):
+        self._cola.put(None)
+        self.wait(2000)
+    
+    def run(self):
+        self._escanear()
+        while True:
+            tarea = self._cola.get()
+            if tarea is None:
+                break
+            evento, nombre, dato = tarea
+            try:
+                if evento == "escanear":
+                    self._escanear()
+                elif evento == "mensaje":
+                    self.indice.agregar_mensaje(nombre, dato)
+                elif evento == "titulo":
+                    self.indice.actualizar_titulo(nombre, dato)
+                elif evento == "renombrar":
+                    self.indice.eliminar(nombre)
+                    self._indexar(dato)
+                elif evento == "eliminar":
+                    self.indice.eliminar(nombre)
+            except Exception as e:
+                print(f"Error indexando {nombre}: {e}")
+            if self._cola.empty():
+                self.indice_actualizado.emit()
+    
+    def _indexar(self, nombre):
+        version = self.almacen.version(nombre)
+        titulo, mensajes = self.almacen.leer(nombre)
+        self.indice.indexar_conversacion(nombre, titulo, mensajes, version)
+    
+    def _escanear(self):
+        nombres = self.almacen.listar()
+        for nombre in set(self.indice.nombres()) - set(nombres):
+            self.indice.eliminar(nombre)
+        for nombre in nombres:
+            version = self.almacen.version(nombre)
+            if version is not None and version == self.indice.version(nombre):
+                continue
+            try:
+                self._indexar(nombre)
+            except Exception as e:
+                print(f"Error indexando {nombre}: {e}")
+        self.indice_actualizado.emit()
+
+class CargadorHistorial(QThread):
+    """Hilo que lee del almacén una página del historial de una conversación.
+
+    Sin `antes_de` lee los últimos `cantidad` mensajes, lo que se muestra al
+    abrir la pestaña; con él, los `cantidad` anteriores a esa posición, al
+    subir con el scroll. El almacén solo lee esa página (ver
+    AlmacenJSONL.cargar_ultimos), así que abrir una conversación de 100.000
+    mensajes cuesta lo mismo que una de 50 y no bloquea la interfaz.
+    """
+    # (titulo, posición del primer mensaje, mensajes, primer mensaje del
+    # usuario o None); object para que la lista no se convierta al cruzar de hilo
+    historial_leido = pyqtSignal(object, int, object, object)
+    error_lectura = pyqtSignal(str)
+    
+    def __init__(self, almacen, nombre, cantidad, antes_de=None, parent=None):
+        super().__init__(parent)
+        self.almacen = almacen
+        self.nombre = nombre
+        self.cantidad = cantidad
+        self.antes_de = antes_de
+    
+    def run(self):
+        primero = None
+        try:
+            if self.antes_de is None:
+                titulo, inicio, mensajes = self.almacen.cargar_ultimos(self.nombre, self.cantidad)
+                # Solo los chats sin nombre aún se renombran con su primer mensaje
+                if self.nombre.startswith("Chat_nuevo_"):
+                    primero = self._primer_mensaje_usuario(inicio, mensajes)
+            else:
+                titulo, inicio = None, max(0, self.antes_de - self.cantidad)
+                mensajes = self.almacen.leer_mensajes(self.nombre, inicio, self.antes_de)
+        except Exception as e:
+            if not self.isInterruptionRequested():
+                self.error_lectura.emit(str(e))
+            return
+        if not self.isInterruptionRequested():
+            self.historial_leido.emit(titulo, inicio, mensajes, primero)
+    
+    def _primer_mensaje_usuario(self, inicio, mensajes):
+        """Texto del primer mensaje del usuario de toda la conversación, no solo de la página."""
+        posicion = 0
+        while posicion < inicio and not self.isInterruptionRequested():
+            fin = min(posicion + self.cantidad, inicio)
+            for m in self.almacen.leer_mensajes(self.nombre, posicion, fin):
+                if m["author"] == "Tú":
+                    return m["text"]
+            posicion = fin
+        return next((m["text"] for m in mensajes if m["author"] == "Tú"), None)
+
+class ChatMessageModel(QAbstractListModel):
+    """Modelo con los mensajes de un chat.
+
+    Solo guarda los diccionarios de cada mensaje; la vista los pinta con
+    ChatMessageDelegate y únicamente materializa las filas visibles, así que
+    abrir o desplazar un chat no depende de la longitud del historial.
+    """
+    MessageRole = Qt.ItemDataRole.UserRole + 1
+    
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._rows = []
+    
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self._rows)
+    
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid() or not 0 <= index.row() < len(self._rows):
+            return None
+        msg = self._rows[index.row()]
+        if role == Qt.ItemDataRole.DisplayRole:
+            return msg.get("text", "")
+        if role == self.MessageRole:
+            return msg
+        if role == Qt.ItemDataRole.ToolTipRole and msg.get("metricas"):
+            return describir_metricas(msg["metricas"])
+        return None
+    
+    def set_messages(self, messages):
+        """Sustituye todas las filas de una vez (un único reset de la vista)."""
+        self.beginResetModel()
+        self._rows = list(messages)
+        self.endResetModel()
+    
+    def prepend_messages(self, messages):
+        """Antepone mensajes más antiguos a los ya mostrados."""
+        if not messages:
+            return
+        self.beginInsertRows(QModelIndex(), 0, len(messages) - 1)
+        self._rows[0:0] = messages
+        self.endInsertRows()
+    
+    def append_message(self, msg):
+        """Añade un mensaje al final y devuelve su fila."""
+        row = len(self._rows)
+        self.beginInsertRows(QModelIndex(), row, row)
+        self._rows.append(msg)
+        self.endInsertRows()
+        return row
+    
+    def remove_row(self, row):
+        if 0 <= row < len(self._rows):
+            self.beginRemoveRows(QModelIndex(), row, row)
+            del self._rows[row]
+            self.endRemoveRows()
+    
+    def message(self, row):
+        return self._rows[row] if 0 <= row < len(self._rows) else None
+    
+    def refresh_row(self, row):
+        idx = self.index(row, 0)
+        self.dataChanged.emit(idx, idx)
+
+class ChatMessageDelegate(QStyledItemDelegate):
+    """Pinta cada mensaje (cabecera con autor, fecha y botón copiar, y el texto)
+    directamente con QPainter, sin crear widgets por fila."""
+    copy_requested = pyqtSignal(str)
+    
+    MAX_LENGTH = 4096
+    MARGIN = 6
+    PADDING = 10
+    SPACING = 6
+    BORDER = 4
+    COPY_LABEL = "📋 Copiar"
+    TEXT_FLAGS = Qt.AlignmentFlag.AlignLeft.value | Qt.AlignmentFlag.AlignTop.value | Qt.TextFlag.TextWordWrap.value
+    CENTER_FLAGS = Qt.AlignmentFlag.AlignCenter.value
+    
+    def __init__(self, styles, view):
+        super().__init__(view)
+        self.view = view
+        self.styles = styles
+        self.author_font = QFont("Segoe UI", 10, QFont.Weight.Bold)
+        self.date_font = QFont("Segoe UI", 8)
+        self.text_font = QFont("Segoe UI", 10)
+        self._author_fm = QFontMetrics(self.author_font)
+        self._date_fm = QFontMetrics(self.date_font)
+        self._text_fm = QFontMetrics(self.text_font)
+        self._header_h = max(self._author_fm.height(), self._text_fm.height()) + 8
+        # Alturas de texto ya calculadas, por (texto, ancho)
+        self._height_cache = {}
+    
+    @staticmethod
+    def is_bot(msg):
+        return msg.get("author") in AUTORES_IA
+    
+    def display_text(self, msg):
+        text = msg.get("text", "")
+        if msg.get("streaming"):
+            if not text:
+                return msg.get("indicador", "● ● ● escribiendo...")
+            return text + ("▌..." if msg.get("recortado") else "▌")
+        text = text[:self.MAX_LENGTH] + ("..." if len(text) > self.MAX_LENGTH else "")
+        if msg.get("truncado"):
+            text += "\n⏹ Respuesta interrumpida"
+        return text
+    
+    def _text_width(self, total_width, msg):
+        border = self.BORDER if self.is_bot(msg) else 0
+        return max(50, total_width - 2 * self.MARGIN - 2 * self.PADDING - border)
+    
+    def _text_height(self, text, width):
+        key = (text, width)
+        height = self._height_cache.get(key)
+        if height is None:
+            if len(self._height_cache) > 20000:
+                self._height_cache.clear()
+            height = self._text_fm.boundingRect(QRect(0, 0, width, 1000000), self.TEXT_FLAGS, text).height()
+            self._height_cache[key] = height
+        return height
+    
+    def row_height(self, msg, width=None):
+        """Altura total que ocupa un mensaje para el ancho actual de la vista."""
+        if width is None:
+            width = self.view.viewport().width()
+        text_h = self._text_height(self.display_text(msg), self._text_width(width, msg))
+        return 2 * self.MARGIN + self._header_h + self.SPACING + text_h + 2 * self.PADDING
+    
+    def _header_rects(self, rect, msg):
+        x = rect.left() + self.MARGIN
+        y = rect.top() + self.MARGIN
+        author_rect = QRect(x, y, self._author_fm.horizontalAdvance(msg.get("author", "")) + 16, self._header_h)
+        date_h = self._date_fm.height() + 4
+        fecha = msg.get("fecha_hora") or ""
+        date_rect = QRect(author_rect.right() + 1 + self.SPACING, y + (self._header_h - date_h) // 2,
+                          self._date_fm.horizontalAdvance(fecha) + 12, date_h)
+        copy_rect = QRect(date_rect.right() + 1 + self.SPACING, y,
+                          self._text_fm.horizontalAdvance(self.COPY_LABEL) + 16, self._header_h)
+        return author_rect, date_rect, copy_rect
+    
+    def sizeHint(self, option, index):
+        msg = index.data(ChatMessageModel.MessageRole)
+        width = self.view.viewport().width()
+        if msg is None:
+            return QSize(width, 0)
+        return QSize(width, self.row_height(msg, width))
+    
+    def _badge(self, painter, rect, bg, fg, font, text, radius=3):
+        painter.setPen(Qt.PenStyle.NoPen)
+        painter.setBrush(QColor(bg))
+        painter.drawRoundedRect(QRectF(rect), radius, radius)
+        painter.setPen(QColor(fg))
+        painter.setFont(font)
+        painter.drawText(rect, self.CENTER_FLAGS, text)
+    
+    def paint(self, painter, option, index):
+        msg = index.data(ChatMessageModel.MessageRole)
+        if msg is None:
+            return
+        styles = self.styles
+        rect = option.rect
+        author = msg.get("author", "")
+        
+        painter.save()
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+        
+        # Cabecera: autor, fecha y botón copiar
+        author_rect, date_rect, copy_rect = self._header_rects(rect, msg)
+        if author == "Tú":
+            author_bg = "#2c5aa0"
+        elif self.is_bot(msg):
+            author_bg = "#c7254e"
+        else:
+            author_bg = "#666666"
+        self._badge(painter, author_rect, author_bg, "white", self.author_font, author)
+        self._badge(painter, date_rect, styles["date_bg"], styles["date_color"], self.date_font, msg.get("fecha_hora") or "")
+        hover = bool(option.state & QStyle.StateFlag.State_MouseOver) and \
+            copy_rect.contains(self.view.viewport().mapFromGlobal(QCursor.pos()))
+        copy_bg = styles["copy_button_hover"] if hover else styles["copy_button_bg"]
+        self._badge(painter, copy_rect, copy_bg, "white", self.text_font, self.COPY_LABEL)
+        
+        # Contenido del mensaje
+        text = self.display_text(msg)
+        is_bot = self.is_bot(msg)
+        text_w = self._text_width(rect.width(), msg)
+        text_h = self._text_height(text, text_w)
+        body_rect = QRect(rect.left() + self.MARGIN, author_rect.bottom() + 1 + self.SPACING,
+                          rect.width() - 2 * self.MARGIN, text_h + 2 * self.PADDING)
+        if is_bot:
+            bg, fg = styles["bot_msg_bg"], styles["bot_msg_color"]
+        else:
+            bg, fg = styles["user_msg_bg"], styles["user_msg_color"]
+        painter.setPen(Qt.PenStyle.NoPen)
+        painter.setBrush(QColor(bg))
+        painter.drawRoundedRect(QRectF(body_rect), 8, 8)
+        border = 0
+        if is_bot:
+            border = self.BORDER
+            painter.setBrush(QColor(styles["bot_msg_border"]))
+            painter.drawRect(QRect(body_rect.left(), body_rect.top(), border, body_rect.height()))
+        text_rect = QRect(body_rect.left() + border + self.PADDING, body_rect.top() + self.PADDING, text_w, text_h)
+        painter.setPen(QColor(fg))
+        painter.setFont(self.text_font)
+        painter.drawText(text_rect, self.TEXT_FLAGS, text)
+        
+        painter.restore()
+    
+    def editorEvent(self, event, model, option, index):
+        """Detecta el clic sobre el botón copiar pintado en la cabecera."""
+        if event.type() == QEvent.Type.MouseButtonRelease and event.button() == Qt.MouseButton.LeftButton:
+            msg = index.data(ChatMessageModel.MessageRole)
+            if msg is not None:
+                copy_rect = self._header_rects(option.rect, msg)[2]
+                if copy_rect.contains(event.position().toPoint()):
+                    self.copy_requested.emit(msg.get("text", ""))
+                    return True
+        return super().editorEvent(event, model, option, index)
+
+class ChatPlaceholder(QWidget):
+    """Pestaña ligera que solo conoce el nombre y el título de una conversación.
+
+    MainWindow la sustituye por un ChatWidget completo la primera vez que se
+    activa, y vuelve a usarla al descargar pestañas inactivas.
+    """
+    def __init__(self, almacen, nombre, titulo=None, ia_tipo="Deepseek", api_keys=None, parent=None):
+        super().__init__(parent)
+        self.almacen = almacen
+        self.nombre = nombre
+        self.titulo = titulo
+        self.ia_tipo = ia_tipo
+        self.api_keys = api_keys
+        
+        layout = QVBoxLayout(self)
+        aviso = QLabel("Cargando conversación...")
+        aviso.setAlignment(Qt.AlignmentFlag.AlignCenter)
+        layout.addWidget(aviso)
+    
+    def save_history(self):
+        """No hay nada que guardar: el historial no se ha cargado."""
+        pass
+    
+    def detener_respuesta(self):
+        """No hay ninguna respuesta en curso."""
+        pass
+    
+    def detener_carga(self):
+        """No hay ninguna lectura en curso."""
+        pass
 
 class ChatWidget(QWidget):
-    def __init__(self, bot, historial_path, parent_tabs=None, ia_tipo="Deepseek", api_keys=None, parent=None):
+    # Mensajes que se leen al abrir y en cada página anterior al subir con el scroll
+    LOTE_HISTORIAL = 200
+    
+    def __init__(self, bot, almacen, nombre, parent_tabs=None, ia_tipo="Deepseek", api_keys=None, parent=None):
         super().__init__(parent)
         self.bot = bot
-        self.historial_path = historial_path
+        self.almacen = almacen
+        self.nombre = nombre
         self.parent_tabs = parent_tabs
         self.history = []
         self._in_streaming = False
         self.last_reply = ""
         self.replies = []
-        self.reply_widget = None
+        self.reply_row = None
         self.renombrado = False
         self.titulo = None
+        self._titulo_guardado = None
         self.ia_tipo = ia_tipo
         self.api_keys = api_keys
         self.stream_thread = None
+        self._reply_author = None
+        self._reply_len = 0
+        self._scroll_pendiente = False
+        self.ultima_actividad = time.monotonic()
+        # Envío y primer texto pintado de la petición en curso (sobrecarga de la interfaz)
+        self._enviado = None
+        self._primer_render = None
+        # Carga del historial en segundo plano (ver load_history)
+        self.cargador = None
+        self.historial_cargado = False
+        # Posición en la conversación del primer mensaje de self.history (0 = está entera)
+        self._primer_indice = 0
+        self._mensaje_pendiente = None
+        
+        # Timer de volcado: recoge lo acumulado por el hilo como máximo RENDER_FPS veces por segundo
+        self.render_timer = QTimer(self)
+        self.render_timer.setInterval(max(1, int(1000 / RENDER_FPS)))
+        self.render_timer.timeout.connect(self.flush_reply)
         
         self.init_ui()
         self.load_history()
-        
-        if self.parent_tabs is not None and self.titulo:
-            # Encuentra el índice de esta pestaña y actualiza el título
-            for i in range(self.parent_tabs.count()):
-                if self.parent_tabs.widget(i) == self:
-                    self.parent_tabs.setTabText(i, self.titulo)
-                    break
     
     def init_ui(self):
         layout = QVBoxLayout()
         
-        # Área de chat con scroll
-        self.scroll_area = QScrollArea()
-        self.scroll_area.setWidgetResizable(True)
-        self.scroll_area.setVerticalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAsNeeded)
-        self.scroll_area.setStyleSheet("QScrollArea { background-color: #1e1e1e; border: none; }")
-        
-        self.chat_widget = QWidget()
-        self.chat_widget.setStyleSheet("QWidget { background-color: #1e1e1e; }")
-        self.chat_layout = QVBoxLayout(self.chat_widget)
-        self.chat_layout.setAlignment(Qt.AlignmentFlag.AlignTop)
-        
-        self.scroll_area.setWidget(self.chat_widget)
-        layout.addWidget(self.scroll_area)
+        # Área de chat: vista de lista virtualizada sobre el modelo de mensajes
+        self.model = ChatMessageModel(self)
+        self.chat_view = QListView()
+        self.chat_view.setModel(self.model)
+        self.delegate = ChatMessageDelegate(ESTILOS_TEMA, self.chat_view)
+        self.delegate.copy_requested.connect(self.copy_message)
+        self.chat_view.setItemDelegate(self.delegate)
+        self.chat_view.setUniformItemSizes(False)
+        self.chat_view.setVerticalScrollMode(QAbstractItemView.ScrollMode.ScrollPerPixel)
+        self.chat_view.setHorizontalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
+        self.chat_view.setVerticalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAsNeeded)
+        self.chat_view.setResizeMode(QListView.ResizeMode.Adjust)
+        self.chat_view.setLayoutMode(QListView.LayoutMode.Batched)
+        self.chat_view.setBatchSize(200)
+        self.chat_view.setSelectionMode(QAbstractItemView.SelectionMode.NoSelection)
+        self.chat_view.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.chat_view.setMouseTracking(True)
+        self.chat_view.setObjectName("chatView")
+        self.chat_view.verticalScrollBar().valueChanged.connect(self.on_scroll_historial)
+        layout.addWidget(self.chat_view)
         
         # Entrada de texto y botón de envío
         input_layout = QHBoxLayout()
@@ -334,7 +760,7 @@ class ChatWidget(QWidget):
         self.input_text = QTextEdit()
         self.input_text.setMaximumHeight(100)
         self.input_text.setFont(QFont("Segoe UI", 10))
-        self.input_text.setStyleSheet("QTextEdit { background-color: #2d2d2d; color: white; border: 2px solid #555555; border-radius: 5px; padding: 5px; }")
+        self.input_text.setObjectName("chatInput")
         # Conectar eventos para auto-scroll durante escritura
         self.input_text.textChanged.connect(self.on_text_changed)
         self.input_text.cursorPositionChanged.connect(self.on_cursor_moved)
@@ -342,207 +768,177 @@ class ChatWidget(QWidget):
         
         self.send_button = QPushButton("Enviar")
         self.send_button.setFixedWidth(100)
-        self.send_button.setStyleSheet("QPushButton { background-color: #0d7377; color: white; border: none; border-radius: 5px; padding: 8px; font-weight: bold; } QPushButton:hover { background-color: #14a085; }")
+        self.send_button.setProperty("rol", "accion")
         self.send_button.clicked.connect(self.on_send)
         input_layout.addWidget(self.send_button)
         
+        self.stop_button = QPushButton("⏹ Detener")
+        self.stop_button.setFixedWidth(100)
+        self.stop_button.setProperty("rol", "accion")
+        self.stop_button.setEnabled(False)
+        self.stop_button.clicked.connect(self.detener_respuesta)
+        input_layout.addWidget(self.stop_button)
+        
         layout.addLayout(input_layout)
         
         # Estado
         self.status_label = QLabel("Listo.")
-        self.status_label.setStyleSheet("QLabel { color: #cccccc; padding: 5px; }")
+        self.status_label.setObjectName("chatStatus")
         layout.addWidget(self.status_label)
         
         self.setLayout(layout)
         
-        # Aplicar tema oscuro al widget principal
-        self.setStyleSheet("QWidget { background-color: #1e1e1e; color: white; }")
+        # El aspecto lo da la hoja de estilos de la aplicación (ver hoja_de_estilos)
+        self.setObjectName("chatWidget")
     
     def load_history(self):
-        """Carga historial desde archivo y lo muestra en el chat."""
+        """Lee en un hilo aparte los últimos mensajes; los anteriores se leen al subir con el scroll."""
+        self.detener_carga()
         self.history = []
+        self.replies = []
         self.titulo = None
-        if os.path.exists(self.historial_path):
-            try:
-                with open(self.historial_path, "r", encoding="utf-8") as f:
-                    loaded = json.load(f)
-                    if isinstance(loaded, dict):
-                        self.titulo = loaded.get("titulo")
-                        mensajes = loaded.get("mensajes", [])
-                    elif isinstance(loaded, list):
-                        mensajes = loaded
-                    else:
-                        mensajes = []
-                    for msg in mensajes:
-                        if isinstance(msg, dict) and "author" in msg and "text" in msg:
-                            fecha_hora = msg.get("fecha_hora")
-                            self.history.append(msg)
-                            self.append_chat(msg["author"], msg["text"], add_to_history=False, fecha_hora=fecha_hora)
-            except Exception as e:
-                QMessageBox.warning(self, "Historial", f"No se pudo cargar el historial: {e}")
-                self.history = []
+        self.historial_cargado = False
+        self._primer_indice = 0
+        self.model.set_messages([])
+        self.send_button.setEnabled(False)
+        self.status_label.setText("Cargando historial...")
+        self._leer_pagina(None, self.LOTE_HISTORIAL)
+    
+    def _leer_pagina(self, antes_de, cantidad):
+        self.cargador = CargadorHistorial(self.almacen, self.nombre, cantidad, antes_de, self)
+        self.cargador.historial_leido.connect(self.on_historial_leido)
+        self.cargador.error_lectura.connect(self.on_error_historial)
+        self.cargador.finished.connect(self.cargador.deleteLater)
+        self.cargador.start()
+    
+    def detener_carga(self):
+        """Espera a que termine una lectura en curso y descarta su resultado."""
+        if self.cargador is not None:
+            self.cargador.requestInterruption()
+            self.cargador.wait()
+            self.cargador = None
+    
+    def on_error_historial(self, error):
+        if self.sender() is not self.cargador:
+            return
+        self.cargador = None
+        if self.historial_cargado:
+            self.status_label.setText(f"No se pudieron leer los mensajes anteriores: {error}")
+            return
+        QMessageBox.warning(self, "Historial", f"No se pudo cargar el historial: {error}")
+        self.mostrar_historial(None, 0, [], None)
+    
+    def on_historial_leido(self, titulo, inicio, mensajes, primero):
+        # Descarta la lectura de una carga anterior que se haya sustituido
+        if self.sender() is not self.cargador:
+            return
+        self.cargador = None
+        if self.historial_cargado:
+            self.anteponer_pagina(inicio, mensajes)
         else:
-            # Si no existe, crea el archivo vacío con estructura nueva
-            try:
-                with open(self.historial_path, "w", encoding="utf-8") as f:
-                    json.dump({"titulo": None, "mensajes": []}, f, ensure_ascii=False, indent=2)
-            except Exception as e:
-                QMessageBox.warning(self, "Historial", f"No se pudo crear el historial: {e}")
-            self.history = []
-    
-    def apply_theme(self, styles):
-        """Aplica un tema específico a este widget de chat"""
-        # Aplicar estilo al widget principal
-        self.setStyleSheet(f"QWidget {{ background-color: {styles['main_bg']}; color: {styles['text_color']}; }}")
-        
-        # Aplicar estilo al área de scroll
-        self.scroll_area.setStyleSheet(f"QScrollArea {{ background-color: {styles['chat_bg']}; border: none; }}")
-        self.chat_widget.setStyleSheet(f"QWidget {{ background-color: {styles['chat_bg']}; }}")
-        
-        # Aplicar estilo al área de entrada
-        self.input_text.setStyleSheet(f"""
-            QTextEdit {{ 
-                background-color: {styles['input_bg']}; 
-                color: {styles['text_color']}; 
-                border: 2px solid {styles['input_border']}; 
-                border-radius: 5px; 
-                padding: 5px; 
-            }}
-        """)
-        
-        # Aplicar estilo al botón de enviar
-        self.send_button.setStyleSheet(f"""
-            QPushButton {{ 
-                background-color: {styles['button_bg']}; 
-                color: white; 
-                border: none; 
-                border-radius: 5px; 
-                padding: 8px; 
-                font-weight: bold; 
-            }} 
-            QPushButton:hover {{ 
-                background-color: {styles['button_hover']}; 
-            }}
-        """)
+            self.mostrar_historial(titulo, inicio, mensajes, primero)
+    
+    def mostrar_historial(self, titulo, inicio, mensajes, primero):
+        """Muestra los últimos mensajes de la conversación al abrirla.
+
+        `primero` es el primer mensaje del usuario de toda la conversación (lo
+        busca CargadorHistorial), aunque no esté en la página mostrada.
+        """
+        self.titulo = self._titulo_guardado = titulo
+        self.history = mensajes
+        self.replies = [m["text"] for m in mensajes if m["author"] in AUTORES_IA]
+        self._primer_indice = inicio
+        self.historial_cargado = True
+        self.model.set_messages(mensajes)
+        QTimer.singleShot(0, self._scroll_inicial)
         
-        # Aplicar estilo a la etiqueta de estado
-        self.status_label.setStyleSheet(f"QLabel {{ color: {styles['status_color']}; padding: 5px; }}")
+        if self.parent_tabs is not None and self.titulo:
+            # Encuentra el índice de esta pestaña y actualiza el título
+            for i in range(self.parent_tabs.count()):
+                if self.parent_tabs.widget(i) == self:
+                    self.parent_tabs.setTabText(i, self.titulo)
+                    break
+        if primero is not None and self.parent_tabs is not None:
+            self.rename_chat_from_message(primero)
         
-        # Recargar todos los mensajes con el nuevo tema
-        self.reload_messages_with_theme(styles)
+        if self.stream_thread is None:
+            self.send_button.setEnabled(True)
+        self.status_label.setText("Listo.")
+        if self._mensaje_pendiente is not None:
+            indice, self._mensaje_pendiente = self._mensaje_pendiente, None
+            QTimer.singleShot(0, lambda: self.scroll_to_message(indice))
     
-    def reload_messages_with_theme(self, styles):
-        """Recarga todos los mensajes aplicando el nuevo tema"""
-        # Limpiar el chat actual
-        for i in reversed(range(self.chat_layout.count())):
-            child = self.chat_layout.itemAt(i).widget()
-            if child:
-                child.setParent(None)
-        
-        # Recargar todos los mensajes del historial
-        for msg in self.history:
-            self.append_chat_with_theme(msg["author"], msg["text"], styles, 
-                                      add_to_history=False, fecha_hora=msg.get("fecha_hora"))
+    def _scroll_inicial(self):
+        self.chat_view.scrollToBottom()
+        # Si los últimos mensajes no llenan la vista no habrá scroll que pida más
+        self.on_scroll_historial()
     
-    def append_chat_with_theme(self, author, text, styles, add_to_history=True, fecha_hora=None):
-        """Versión de append_chat que usa estilos específicos"""
-        max_length = 4096
-        display_text = text[:max_length] + ("..." if len(text) > max_length else "")
-        
+    def on_scroll_historial(self, *_):
+        """Pide la página anterior del historial al acercarse al principio con el scroll."""
+        if not self.historial_cargado or self._primer_indice <= 0 or self.cargador is not None:
+            return
+        if self.chat_view.verticalScrollBar().value() <= self.chat_view.viewport().height():
+            self._leer_pagina(self._primer_indice, self.LOTE_HISTORIAL)
+    
+    def anteponer_pagina(self, inicio, mensajes):
+        """Antepone a la vista una página de mensajes más antiguos."""
+        barra = self.chat_view.verticalScrollBar()
+        desde_el_final = barra.maximum() - barra.value()
+        self.history[0:0] = mensajes
+        self.replies[0:0] = [m["text"] for m in mensajes if m["author"] in AUTORES_IA]
+        self.model.prepend_messages(mensajes)
+        if self.reply_row is not None:
+            self.reply_row += len(mensajes)
+        self._primer_indice = inicio
+        # Mantiene a la vista los mismos mensajes aunque se hayan añadido filas encima
+        QTimer.singleShot(0, lambda: barra.setValue(barra.maximum() - desde_el_final))
+        if self._mensaje_pendiente is not None:
+            indice, self._mensaje_pendiente = self._mensaje_pendiente, None
+            QTimer.singleShot(0, lambda: self.scroll_to_message(indice))
+    
+    def save_history(self):
+        """Persiste lo que no se haya escrito aún (los mensajes ya se añaden al enviarse)."""
+        if self.titulo == self._titulo_guardado:
+            return
+        try:
+            self.almacen.actualizar_titulo(self.nombre, self.titulo)
+            self._titulo_guardado = self.titulo
+        except Exception as e:
+            QMessageBox.warning(self, "Historial", f"No se pudo guardar el historial: {e}")
+    
+    def _registrar_mensaje(self, msg):
+        """Añade un mensaje al historial y lo escribe al final del archivo."""
+        self.history.append(msg)
+        try:
+            self.almacen.agregar_mensaje(self.nombre, msg)
+        except Exception as e:
+            self.status_label.setText(f"No se pudo guardar el mensaje: {e}")
+    
+    def append_chat(self, author, text, add_to_history=True, fecha_hora=None):
+        """Añade un mensaje al chat."""
         if fecha_hora is None:
             fecha_hora = datetime.now().strftime("%d/%m/%y %H:%M:%S")
         
-        # Widget del mensaje
-        message_widget = QWidget()
-        message_layout = QVBoxLayout(message_widget)
-        
-        # Header con autor, fecha y botón copiar
-        header_layout = QHBoxLayout()
-        
-        author_label = QLabel(author)
-        author_label.setFont(QFont("Segoe UI", 10, QFont.Weight.Bold))
-        if author == "Tú":
-            author_label.setStyleSheet("background-color: #2c5aa0; color: white; padding: 4px 8px; border-radius: 3px; font-weight: bold;")
-        elif author in ["DeepSeek", "ChatGPT"]:
-            author_label.setStyleSheet("background-color: #c7254e; color: white; padding: 4px 8px; border-radius: 3px; font-weight: bold;")
-        else:
-            author_label.setStyleSheet("background-color: #666666; color: white; padding: 4px 8px; border-radius: 3px; font-weight: bold;")
-        header_layout.addWidget(author_label)
-        
-        fecha_label = QLabel(fecha_hora)
-        fecha_label.setFont(QFont("Segoe UI", 8))
-        fecha_label.setStyleSheet(f"background-color: {styles['date_bg']}; color: {styles['date_color']}; padding: 2px 6px; border-radius: 3px;")
-        header_layout.addWidget(fecha_label)
+        msg = {"author": author, "text": text, "fecha_hora": fecha_hora}
+        self.model.append_message(msg)
         
-        # Agregar botón de copiar para todos los mensajes
-        copy_button = QPushButton("📋 Copiar")
-        copy_button.setStyleSheet(f"QPushButton {{ background-color: {styles['copy_button_bg']}; color: white; border: none; border-radius: 3px; padding: 4px 8px; }} QPushButton:hover {{ background-color: {styles['copy_button_hover']}; }}")
-        copy_button.clicked.connect(lambda: self.copy_message(text))
-        header_layout.addWidget(copy_button)
-        
-        if author in ["DeepSeek", "ChatGPT"]:
+        if author in AUTORES_IA:
             self.replies.append(text)
         
-        header_layout.addStretch()
-        message_layout.addLayout(header_layout)
-        
-        # Contenido del mensaje
-        text_label = QLabel(display_text)
-        text_label.setWordWrap(True)
-        text_label.setFont(QFont("Segoe UI", 10))
-        if author in ["DeepSeek", "ChatGPT"]:
-            text_label.setStyleSheet(f"background-color: {styles['bot_msg_bg']}; color: {styles['bot_msg_color']}; padding: 10px; border-radius: 8px; border-left: 4px solid {styles['bot_msg_border']};")
-        else:
-            text_label.setStyleSheet(f"background-color: {styles['user_msg_bg']}; color: {styles['user_msg_color']}; padding: 10px; border-radius: 8px;")
-        text_label.setAlignment(Qt.AlignmentFlag.AlignLeft | Qt.AlignmentFlag.AlignTop)
-        message_layout.addWidget(text_label)
-        
-        self.chat_layout.addWidget(message_widget)
-        
         # Scroll automático al final
-        QTimer.singleShot(10, self.scroll_to_bottom)
+        self.request_scroll()
         
         if add_to_history:
-            self.history.append({"author": author, "text": text, "fecha_hora": fecha_hora})
+            self._registrar_mensaje(msg)
         
         # Renombrar archivo y pestaña cuando el usuario hace una pregunta
         if author == "Tú" and self.parent_tabs is not None:
             self.rename_chat_from_message(text)
     
-    def append_chat(self, author, text, add_to_history=True, fecha_hora=None):
-            self.history = []
-    
-    def save_history(self):
-        """Guarda historial en archivo JSON."""
-        try:
-            with open(self.historial_path, "w", encoding="utf-8") as f:
-                json.dump({"titulo": self.titulo, "mensajes": self.history}, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            QMessageBox.warning(self, "Historial", f"No se pudo guardar el historial: {e}")
-    
-    def append_chat(self, author, text, add_to_history=True, fecha_hora=None):
-        """Añade un mensaje al chat usando el tema actual."""
-        # Obtener estilos del tema actual desde la ventana principal
-        if hasattr(self.parent(), 'is_dark_mode'):
-            is_dark = self.parent().is_dark_mode
-            styles = self.parent().get_dark_theme_styles() if is_dark else self.parent().get_light_theme_styles()
-        else:
-            # Fallback a tema oscuro si no se puede determinar
-            styles = {
-                "main_bg": "#1e1e1e", "chat_bg": "#1e1e1e", "input_bg": "#2d2d2d",
-                "input_border": "#555555", "text_color": "white", "bot_msg_bg": "#2d2d2d",
-                "bot_msg_color": "#e6e6e6", "bot_msg_border": "#c7254e", "user_msg_bg": "#0d47a1",
-                "user_msg_color": "white", "button_bg": "#0d7377", "button_hover": "#14a085",
-                "copy_button_bg": "#555555", "copy_button_hover": "#777777", "date_bg": "#404040",
-                "date_color": "#cccccc", "status_color": "#cccccc"
-            }
-        
-        self.append_chat_with_theme(author, text, styles, add_to_history, fecha_hora)
-    
     def rename_chat_from_message(self, text):
         """Renombra el chat basado en el primer mensaje del usuario."""
         # Solo renombrar si aún no se ha renombrado y si es un archivo "Chat_nuevo_"
-        if self.renombrado or not os.path.basename(self.historial_path).startswith("Chat_nuevo_"):
+        if self.renombrado or not self.nombre.startswith("Chat_nuevo_"):
             return
             
         texto_original = text.strip()[:40]
@@ -552,147 +948,165 @@ class ChatWidget(QWidget):
             nombre = "Chat"
             texto_original = "Chat"
         
-        nuevo_json = os.path.join(os.path.dirname(self.historial_path), f"{nombre}.json")
         base_nombre = nombre
         base_texto = texto_original
         sufijo = 1
-        while os.path.exists(nuevo_json):
+        while self.almacen.existe(nombre):
             nombre = f"{base_nombre}_{sufijo}"
             texto_original = f"{base_texto} {sufijo}"
-            nuevo_json = os.path.join(os.path.dirname(self.historial_path), f"{nombre}.json")
             sufijo += 1
         
-        # Guardar el historial actual antes de renombrar
-        self.save_history()
-        
         try:
-            # Usar shutil.move en lugar de os.rename para mejor compatibilidad
-            import shutil
-            shutil.move(self.historial_path, nuevo_json)
-            self.historial_path = nuevo_json
+            self.almacen.renombrar(self.nombre, nombre)
+            self.nombre = nombre
             self.renombrado = True
         except Exception as e:
             # Si falla el renombrado, no es crítico - el chat sigue funcionando
             print(f"No se pudo renombrar el historial: {e}")
             self.renombrado = True  # Marcar como renombrado para evitar intentos futuros
         
-        # Actualiza el título y la pestaña
+        # Actualiza el título (en la cabecera del archivo) y la pestaña
         self.titulo = texto_original
+        self.save_history()
         for i in range(self.parent_tabs.count()):
             if self.parent_tabs.widget(i) == self:
                 self.parent_tabs.setTabText(i, texto_original)
                 break
-                break
     
     def start_reply(self, author):
         """Inicia una respuesta en streaming."""
         self._in_streaming = True
+        self._reply_author = author
         self.last_reply = ""
+        self._reply_len = 0
         
         fecha_hora = datetime.now().strftime("%d/%m/%y %H:%M:%S")
         
-        # Widget para la respuesta
-        self.reply_widget = QWidget()
-        reply_layout = QVBoxLayout(self.reply_widget)
-        
-        # Header
-        header_layout = QHBoxLayout()
-        
-        author_label = QLabel(author)
-        author_label.setFont(QFont("Segoe UI", 10, QFont.Weight.Bold))
-        if author == "Tú":
-            author_label.setStyleSheet("background-color: #2c5aa0; color: white; padding: 4px 8px; border-radius: 3px; font-weight: bold;")
-        elif author in ["DeepSeek", "ChatGPT"]:
-            author_label.setStyleSheet("background-color: #c7254e; color: white; padding: 4px 8px; border-radius: 3px; font-weight: bold;")
-        else:
-            author_label.setStyleSheet("background-color: #666666; color: white; padding: 4px 8px; border-radius: 3px; font-weight: bold;")
-        header_layout.addWidget(author_label)
-        
-        fecha_label = QLabel(fecha_hora)
-        fecha_label.setFont(QFont("Segoe UI", 8))
-        fecha_label.setStyleSheet("background-color: #404040; color: #cccccc; padding: 2px 6px; border-radius: 3px;")
-        header_layout.addWidget(fecha_label)
-        
-        self.reply_copy_button = QPushButton("📋 Copiar")
-        self.reply_copy_button.setStyleSheet("QPushButton { background-color: #555555; color: white; border: none; border-radius: 3px; padding: 4px 8px; } QPushButton:hover { background-color: #777777; }")
-        self.reply_copy_button.clicked.connect(lambda: self.copy_message(self.last_reply))
-        header_layout.addWidget(self.reply_copy_button)
-        
-        header_layout.addStretch()
-        reply_layout.addLayout(header_layout)
-        
-        # Contenido de la respuesta
-        self.reply_label = QLabel("● ● ● escribiendo...")
-        self.reply_label.setWordWrap(True)
-        self.reply_label.setFont(QFont("Segoe UI", 10))
-        self.reply_label.setStyleSheet("background-color: #2d2d2d; color: #e6e6e6; padding: 10px; border-radius: 8px; border-left: 4px solid #c7254e;")
-        self.reply_label.setAlignment(Qt.AlignmentFlag.AlignLeft | Qt.AlignmentFlag.AlignTop)
-        reply_layout.addWidget(self.reply_label)
-        
-        self.chat_layout.addWidget(self.reply_widget)
-        QTimer.singleShot(10, self.scroll_to_bottom)
+        # Fila provisional para la respuesta; el delegado muestra el indicador
+        # de escritura mientras no haya texto y el cursor parpadeante después
+        self.reply_row = self.model.append_message({
+            "author": author, "text": "", "fecha_hora": fecha_hora,
+            "streaming": True, "indicador": "● ● ● escribiendo..."
+        })
+        self.request_scroll()
         
         # Crear timer para animar el indicador de escritura
         self.typing_timer = QTimer()
         self.typing_timer.timeout.connect(self.animate_typing_indicator)
         self.typing_dots = 0
         self.typing_timer.start(500)  # Cambiar cada 500ms
+        
+        self.render_timer.start()
+    
+    def flush_reply(self):
+        """Vuelca a la interfaz los fragmentos acumulados por el hilo desde el último volcado."""
+        if self.stream_thread is None:
+            return
+        text = self.stream_thread.buffer.drain()
+        if text:
+            self.update_reply(text)
+    
+    def _refresh_reply_row(self, old_height):
+        """Repinta la fila en curso; solo pide recalcular el layout si cambió su altura."""
+        msg = self.model.message(self.reply_row)
+        index = self.model.index(self.reply_row, 0)
+        if self.delegate.row_height(msg) != old_height:
+            self.delegate.sizeHintChanged.emit(index)
+        else:
+            self.chat_view.update(index)
     
     def update_reply(self, text):
-        """Actualiza el texto de la respuesta en streaming con efectos visuales."""
+        """Añade texto a la respuesta en streaming sin reconstruir lo ya mostrado."""
         max_length = 4096
-        if self._in_streaming and self.reply_label:
-            # Detener la animación de typing cuando llega el primer texto
-            if hasattr(self, 'typing_timer') and self.typing_timer.isActive():
-                self.typing_timer.stop()
-            
-            current = self.reply_label.text()
-            # Si es el primer texto y aún muestra el indicador, limpiar
-            if "escribiendo..." in current:
-                current = ""
-                
-            new_text = (current + text)[:max_length]
-            
-            # Agregar cursor parpadeante al final para simular escritura
-            display_text = new_text + "▌"
-            if len(current + text) > max_length:
-                display_text += "..."
-                
-            self.reply_label.setText(display_text)
-            self.last_reply = new_text
-            
-            # Auto-scroll más frecuente durante streaming para seguir el texto
-            QTimer.singleShot(5, self.scroll_to_bottom)
-            
-            # Actualizar el widget para forzar repintado
-            self.reply_label.update()
+        if not self._in_streaming or self.reply_row is None:
+            return
+        # Detener la animación de typing cuando llega el primer texto
+        if hasattr(self, 'typing_timer') and self.typing_timer.isActive():
+            self.typing_timer.stop()
+        
+        restante = max_length - self._reply_len
+        if restante <= 0:
+            # Ya se alcanzó el límite visible: no hace falta repintar
+            return
+        fragmento = text[:restante]
+        if self._primer_render is None:
+            self._primer_render = time.monotonic()
+        
+        msg = self.model.message(self.reply_row)
+        old_height = self.delegate.row_height(msg)
+        msg["text"] += fragmento
+        if len(text) > restante:
+            msg["recortado"] = True
+        self._reply_len += len(fragmento)
+        self._refresh_reply_row(old_height)
+        
+        # Un único scroll por volcado, después de que el layout se haya recalculado
+        self.request_scroll()
+    
+    def request_scroll(self):
+        """Programa un scroll al final si no hay ya uno pendiente."""
+        if not self._scroll_pendiente:
+            self._scroll_pendiente = True
+            QTimer.singleShot(0, self._scroll_programado)
+    
+    def _scroll_programado(self):
+        self._scroll_pendiente = False
+        self.chat_view.scrollToBottom()
     
     def animate_typing_indicator(self):
         """Anima el indicador de escritura antes de que llegue el primer texto."""
-        if self._in_streaming and self.reply_label and self.last_reply == "":
+        if self._in_streaming and self.reply_row is not None and self._reply_len == 0:
             dots = ["●", "● ●", "● ● ●"]
             self.typing_dots = (self.typing_dots + 1) % len(dots)
-            self.reply_label.setText(f"{dots[self.typing_dots]} escribiendo...")
+            self.model.message(self.reply_row)["indicador"] = f"{dots[self.typing_dots]} escribiendo..."
+            self.chat_view.update(self.model.index(self.reply_row, 0))
     
-    def end_reply(self):
-        """Finaliza la respuesta en streaming."""
+    def end_reply(self, truncado=False, metricas=None):
+        """Finaliza la respuesta en streaming (truncado si el usuario la detuvo)."""
         if self._in_streaming:
             self._in_streaming = False
+            self.render_timer.stop()
             # Detener timer de animación si está activo
             if hasattr(self, 'typing_timer') and self.typing_timer.isActive():
                 self.typing_timer.stop()
             # Quitar el cursor parpadeante y mostrar texto final
-            if self.reply_label:
-                self.reply_label.setText(self.last_reply)
+            if self.reply_row is not None:
+                msg = self.model.message(self.reply_row)
+                old_height = self.delegate.row_height(msg)
+                msg["text"] = self.last_reply
+                for clave in ("streaming", "indicador", "recortado"):
+                    msg.pop(clave, None)
+                if truncado:
+                    msg["truncado"] = True
+                self._refresh_reply_row(old_height)
+                self.reply_row = None
             self.replies.append(self.last_reply)
             fecha_hora = datetime.now().strftime("%d/%m/%y %H:%M:%S")
-            self.history.append({"author": self.ia_tipo, "text": self.last_reply, "fecha_hora": fecha_hora})
+            mensaje = {"author": self._reply_author, "text": self.last_reply, "fecha_hora": fecha_hora}
+            if truncado:
+                mensaje["truncado"] = True
+            if metricas:
+                mensaje["metricas"] = metricas
+            self._registrar_mensaje(mensaje)
             # Scroll final
             QTimer.singleShot(100, self.scroll_to_bottom)
     
+    def scroll_to_message(self, indice):
+        """Desplaza la vista hasta el mensaje indicado del historial."""
+        if not self.historial_cargado or indice < self._primer_indice:
+            # Se muestra cuando llegue la página que lo contiene
+            self._mensaje_pendiente = indice
+            if self.historial_cargado and self.cargador is None:
+                antes_de = self._primer_indice
+                self._leer_pagina(antes_de, antes_de - max(0, indice - self.LOTE_HISTORIAL // 2))
+            return
+        fila = indice - self._primer_indice
+        if 0 <= fila < self.model.rowCount():
+            self.chat_view.scrollTo(self.model.index(fila, 0), QAbstractItemView.ScrollHint.PositionAtCenter)
+    
     def scroll_to_bottom(self):
         """Hace scroll hasta abajo del chat de forma suave."""
-        scrollbar = self.scroll_area.verticalScrollBar()
+        scrollbar = self.chat_view.verticalScrollBar()
         current_value = scrollbar.value()
         max_value = scrollbar.maximum()
         
@@ -709,7 +1123,7 @@ class ChatWidget(QWidget):
     
     def smooth_scroll_to_bottom(self, start_value, end_value):
         """Realiza un scroll suave al final."""
-        scrollbar = self.scroll_area.verticalScrollBar()
+        scrollbar = self.chat_view.verticalScrollBar()
         steps = 5
         step_size = (end_value - start_value) // steps
         
@@ -727,33 +1141,132 @@ class ChatWidget(QWidget):
     def on_send(self):
         """Envía el mensaje del usuario y inicia el hilo para obtener la respuesta."""
         user_text = self.input_text.toPlainText().strip()
-        if not user_text:
+        if not user_text or self.stream_thread is not None or not self.historial_cargado:
+            # Una sola petición en curso por conversación, y solo con el historial ya leído
             return
         
         self.input_text.clear()
+        self.ultima_actividad = self._enviado = time.monotonic()
+        self._primer_render = None
+        # El contexto se rehidrata antes de añadir el mensaje nuevo al historial
+        bot = self.obtener_bot()
         self.append_chat("Tú", user_text)
         
         # Inicia el hilo de streaming
         self.status_label.setText("Respondiendo...")
-        self.start_reply("DeepSeek" if self.ia_tipo == "Deepseek" else self.ia_tipo)
+        self.start_reply(bot.proveedor.autor)
+        self.send_button.setEnabled(False)
+        self.stop_button.setEnabled(True)
         
-        self.stream_thread = ChatStreamThread(self.bot, user_text, self.ia_tipo, self.api_keys)
-        self.stream_thread.chunk_received.connect(self.update_reply)
+        self.stream_thread = PeticionChat(bot, user_text)
         self.stream_thread.finished_streaming.connect(self.on_reply_finished)
         self.stream_thread.error_occurred.connect(self.on_reply_error)
         self.stream_thread.start()
     
+    def obtener_bot(self):
+        """Devuelve el contexto de modelo propio de esta conversación.
+
+        Se crea la primera vez que se envía un mensaje (o tras cambiar de IA o
+        de key) y se rehidrata con el historial guardado de este chat, de modo
+        que cada pestaña envía solo sus propios turnos. La rehidratación se
+        hace al empezar la petición, fuera del hilo de la interfaz.
+        """
+        if self.bot is None:
+            self.bot = crear_bot(self.ia_tipo, self.api_keys or {})
+            if self.bot is not None:
+                # Lo que no se ha leído aún se pide al almacén solo si cabe en el contexto
+                self.bot.programar_historial(self.history,
+                                             partial(self.almacen.iterar_hacia_atras, self.nombre, self._primer_indice))
+        return self.bot
+    
+    def _es_peticion_actual(self):
+        """Descarta señales que lleguen de una petición ya detenida."""
+        return self.stream_thread is not None and self.sender() is self.stream_thread
+    
     def on_reply_finished(self, full_reply):
         """Maneja la finalización de la respuesta."""
+        if not self._es_peticion_actual():
+            return
         self.last_reply = full_reply
-        self.end_reply()
-        self.status_label.setText("Listo.")
+        self.ultima_actividad = time.monotonic()
+        metricas = self._metricas_respuesta()
+        self.end_reply(metricas=metricas)
+        self._liberar_peticion()
+        estadisticas = self.bot.describir_estadisticas() if self.bot is not None else ""
+        tiempos = describir_metricas(metricas)
+        texto = " · ".join(t for t in (estadisticas, tiempos) if t)
+        self.status_label.setText(f"Listo. {texto}" if texto else "Listo.")
+    
+    def _metricas_respuesta(self):
+        """Métricas del núcleo para la respuesta terminada, más lo que tardó la interfaz en pintarla.
+
+        La sobrecarga de la interfaz es el tiempo desde el envío hasta el
+        primer texto pintado menos lo que el núcleo esperó en la cola y al
+        proveedor, así se distingue de la latencia del proveedor.
+        """
+        if self.bot is None:
+            return {}
+        metricas = dict(self.bot.ultimas_metricas)
+        if not metricas or self._enviado is None or self._primer_render is None:
+            return metricas
+        primer_render = round((self._primer_render - self._enviado) * 1000, 1)
+        anotaciones = {"primer_render_ms": primer_render}
+        if "ttft_ms" in metricas:
+            anotaciones["sobrecarga_ui_ms"] = round(max(0.0, primer_render - metricas.get("cola_ms", 0)
+                                                        - metricas["ttft_ms"]), 1)
+        metricas.update(anotaciones)
+        REGISTRO_METRICAS.anotar(self.bot.id_metricas, **anotaciones)
+        return metricas
     
     def on_reply_error(self, error_msg):
         """Maneja errores en la respuesta."""
+        if not self._es_peticion_actual():
+            return
+        self.render_timer.stop()
+        if hasattr(self, 'typing_timer') and self.typing_timer.isActive():
+            self.typing_timer.stop()
+        # Quitar la fila provisional de la respuesta
+        if self.reply_row is not None:
+            self.model.remove_row(self.reply_row)
+            self.reply_row = None
         self.append_chat("Error", error_msg)
         self.status_label.setText("Error en la petición.")
         self._in_streaming = False
+        self._liberar_peticion()
+    
+    def _liberar_peticion(self):
+        """Suelta la petición terminada y permite enviar de nuevo."""
+        if self.stream_thread is not None:
+            self.stream_thread.deleteLater()
+            self.stream_thread = None
+        self.send_button.setEnabled(True)
+        self.stop_button.setEnabled(False)
+    
+    def detener_respuesta(self):
+        """Cancela la respuesta en curso y guarda lo recibido como respuesta truncada."""
+        peticion = self.stream_thread
+        if peticion is None:
+            return
+        peticion.cancelar()
+        self.flush_reply()
+        msg = self.model.message(self.reply_row) if self.reply_row is not None else None
+        if msg is not None and msg.get("text"):
+            self.last_reply = msg["text"]
+            self.end_reply(truncado=True)
+        else:
+            # No llegó nada: se quita la fila provisional sin guardar una respuesta vacía
+            self.render_timer.stop()
+            if hasattr(self, 'typing_timer') and self.typing_timer.isActive():
+                self.typing_timer.stop()
+            if self.reply_row is not None:
+                self.model.remove_row(self.reply_row)
+                self.reply_row = None
+            self._in_streaming = False
+        # El contexto del modelo se reconstruye desde el historial al volver a
+        # enviar, así incluye la respuesta parcial aunque la petición no llegara a empezar
+        self.bot = None
+        self._liberar_peticion()
+        self.status_label.setText("Respuesta detenida.")
     
     def on_text_changed(self):
         """Se ejecuta cuando el usuario cambia el texto en el área de entrada."""
@@ -776,9 +1289,167 @@ class ChatWidget(QWidget):
     
     def closeEvent(self, event):
         """Guarda el historial al cerrar."""
+        self.detener_carga()
         self.save_history()
         event.accept()
 
+class SearchPanel(QDockWidget):
+    """Panel lateral de búsqueda global en todas las conversaciones guardadas."""
+    resultado_activado = pyqtSignal(str, int)
+    
+    def __init__(self, buscar, parent=None):
+        super().__init__("Buscar", parent)
+        self.buscar = buscar
+        self.setObjectName("searchPanel")
+        
+        contenido = QWidget()
+        layout = QVBoxLayout(contenido)
+        self.consulta = QLineEdit()
+        self.consulta.setPlaceholderText("Buscar en todas las conversaciones...")
+        layout.addWidget(self.consulta)
+        self.resultados = QListWidget()
+        self.resultados.setWordWrap(True)
+        layout.addWidget(self.resultados)
+        self.estado = QLabel("")
+        layout.addWidget(self.estado)
+        self.setWidget(contenido)
+        
+        # Espera a que el usuario deje de teclear antes de buscar
+        self.debounce = QTimer(self)
+        self.debounce.setSingleShot(True)
+        self.debounce.setInterval(200)
+        self.debounce.timeout.connect(self.ejecutar_busqueda)
+        self.consulta.textChanged.connect(lambda _: self.debounce.start())
+        self.consulta.returnPressed.connect(self.ejecutar_busqueda)
+        self.resultados.itemActivated.connect(self.on_item_activado)
+    
+    def ejecutar_busqueda(self):
+        consulta = self.consulta.text().strip()
+        self.resultados.clear()
+        if not consulta:
+            self.estado.setText("")
+            return
+        inicio = time.perf_counter()
+        try:
+            hits = self.buscar(consulta)
+        except Exception as e:
+            self.estado.setText(f"Error en la búsqueda: {e}")
+            return
+        for hit in hits:
+            titulo = hit.get("titulo") or hit["nombre"]
+            item = QListWidgetItem(f"{titulo}\n{hit['author']}: {hit['fragmento']}")
+            item.setData(Qt.ItemDataRole.UserRole, (hit["nombre"], hit["indice"]))
+            self.resultados.addItem(item)
+        ms = (time.perf_counter() - inicio) * 1000
+        self.estado.setText(f"{len(hits)} resultados en {ms:.1f} ms")
+    
+    def on_item_activado(self, item):
+        nombre, indice = item.data(Qt.ItemDataRole.UserRole)
+        self.resultado_activado.emit(nombre, indice)
+
+class PanelEstadisticas(QDockWidget):
+    """Panel lateral con los tiempos de las últimas peticiones y su exportación."""
+    COLUMNAS = (
+        ("Hora", None), ("IA", "proveedor"), ("Cola", "cola_ms"), ("Conexión", "conexion_ms"),
+        ("1er token", "ttft_ms"), ("Total", "total_ms"), ("tok/s", "tokens_por_segundo"),
+        ("Interfaz", "sobrecarga_ui_ms"), ("Tokens", None), ("Estado", None),
+    )
+    MAX_FILAS = 200
+    
+    def __init__(self, parent=None):
+        super().__init__("Estadísticas", parent)
+        self.setObjectName("statsPanel")
+        self._filas = {}
+        
+        contenido = QWidget()
+        layout = QVBoxLayout(contenido)
+        self.resumen = QLabel("Sin peticiones todavía.")
+        self.resumen.setWordWrap(True)
+        layout.addWidget(self.resumen)
+        self.tabla = QTableWidget(0, len(self.COLUMNAS))
+        self.tabla.setHorizontalHeaderLabels([titulo for titulo, _ in self.COLUMNAS])
+        self.tabla.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeMode.ResizeToContents)
+        self.tabla.verticalHeader().setVisible(False)
+        self.tabla.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        layout.addWidget(self.tabla)
+        
+        botones = QHBoxLayout()
+        exportar_jsonl = QPushButton("Exportar JSONL...")
+        exportar_jsonl.clicked.connect(self.exportar_jsonl)
+        exportar_prometheus = QPushButton("Exportar Prometheus...")
+        exportar_prometheus.clicked.connect(self.exportar_prometheus)
+        botones.addWidget(exportar_jsonl)
+        botones.addWidget(exportar_prometheus)
+        layout.addLayout(botones)
+        self.setWidget(contenido)
+    
+    def agregar(self, registro):
+        """Añade (o actualiza, si la interfaz completó sus datos) la fila de una petición."""
+        fila = self._filas.get(registro["id"])
+        if fila is None:
+            self.tabla.insertRow(0)
+            self._filas = {id_: f + 1 for id_, f in self._filas.items()}
+            self._filas[registro["id"]] = fila = 0
+            if self.tabla.rowCount() > self.MAX_FILAS:
+                self.tabla.removeRow(self.tabla.rowCount() - 1)
+                self._filas = {id_: f for id_, f in self._filas.items() if f < self.MAX_FILAS}
+        for columna, (titulo, clave) in enumerate(self.COLUMNAS):
+            self.tabla.setItem(fila, columna, QTableWidgetItem(self._celda(titulo, clave, registro)))
+        self.actualizar_resumen()
+    
+    @staticmethod
+    def _celda(titulo, clave, registro):
+        if titulo == "Hora":
+            return registro.get("fecha", "")[11:]
+        if titulo == "Tokens":
+            if "completion_tokens" in registro:
+                return f"{registro['prompt_tokens']} + {registro['completion_tokens']}"
+            return f"~{registro['completion_tokens_estimados']}" if "completion_tokens_estimados" in registro else ""
+        if titulo == "Estado":
+            if "error" in registro:
+                return f"Error: {registro['error']}"
+            if registro.get("cancelada"):
+                return "Detenida"
+            return "Caché" if registro.get("cache") else "OK"
+        valor = registro.get(clave)
+        if valor is None:
+            return ""
+        return str(valor) if clave == "proveedor" else f"{valor:.0f}"
+    
+    def actualizar_resumen(self):
+        lineas = []
+        for proveedor, datos in sorted(REGISTRO_METRICAS.resumen().items()):
+            partes = [f"<b>{proveedor}</b>: {datos['peticiones']} peticiones"]
+            if datos["errores"]:
+                partes.append(f"{datos['errores']} errores")
+            if datos["canceladas"]:
+                partes.append(f"{datos['canceladas']} detenidas")
+            for clave, nombre, unidad in (("ttft_ms", "1er token", " ms"), ("total_ms", "total", " ms"),
+                                          ("tokens_por_segundo", "tok/s", ""), ("sobrecarga_ui_ms", "interfaz", " ms")):
+                if clave in datos:
+                    partes.append(f"{nombre} p50 {datos[clave]['p50']:.0f}{unidad} / p95 {datos[clave]['p95']:.0f}{unidad}")
+            lineas.append(" · ".join(partes))
+        self.resumen.setText("<br>".join(lineas) if lineas else "Sin peticiones todavía.")
+    
+    def exportar_jsonl(self):
+        ruta, _ = QFileDialog.getSaveFileName(self, "Exportar métricas", "metricas.jsonl", "JSON Lines (*.jsonl)")
+        if not ruta:
+            return
+        try:
+            REGISTRO_METRICAS.exportar_jsonl(ruta)
+        except Exception as e:
+            QMessageBox.warning(self, "Estadísticas", f"No se pudieron exportar las métricas: {e}")
+    
+    def exportar_prometheus(self):
+        ruta, _ = QFileDialog.getSaveFileName(self, "Exportar métricas", "deepseek_chat.prom",
+                                              "Prometheus (*.prom)")
+        if not ruta:
+            return
+        try:
+            REGISTRO_METRICAS.exportar_prometheus(ruta)
+        except Exception as e:
+            QMessageBox.warning(self, "Estadísticas", f"No se pudieron exportar las métricas: {e}")
+
 class UpdateKeyDialog(QDialog):
     def __init__(self, parent=None):
         super().__init__(parent)
@@ -790,7 +1461,7 @@ class UpdateKeyDialog(QDialog):
         layout.addWidget(QLabel("Seleccione la IA:"))
         
         self.ia_combo = QComboBox()
-        self.ia_combo.addItems(["Deepseek", "ChatGPT"])
+        self.ia_combo.addItems(list(PROVEEDORES))
         layout.addWidget(self.ia_combo)
         
         layout.addWidget(QLabel("Nueva API Key:"))
@@ -810,13 +1481,23 @@ class UpdateKeyDialog(QDialog):
         return self.ia_combo.currentText(), self.key_input.text()
 
 class MainWindow(QMainWindow):
-    def __init__(self):
+    # (en_cola, activas) del planificador; se emite desde el hilo del núcleo
+    cola_cambiada = pyqtSignal(int, int)
+    # Registro de métricas de cada petición (ver RegistroMetricas); también desde el núcleo
+    metricas_registradas = pyqtSignal(dict)
+    
+    def __init__(self, arranque=None):
         super().__init__()
+        self.arranque = arranque if arranque is not None else TiemposArranque()
+        self._datos_iniciados = False
         self.chat_widgets = []
         self.conversaciones_dir = None
+        self.almacen = None
+        self.indice_busqueda = None
+        self.indexador = None
+        self.search_panel = None
         self.ia_tipo = None
         self.api_keys = None
-        self.bot = None
         
         self.setWindowTitle("DeepSeek Chat (Streaming) - PyQt")
         self.setGeometry(100, 100, 1000, 700)
@@ -824,63 +1505,47 @@ class MainWindow(QMainWindow):
         # Cargar tema desde configuración
         self.is_dark_mode = self.load_theme_preference()
         
+        # Minutos de inactividad tras los que se descarga una pestaña (0 = nunca)
+        self.descargar_tras_minutos = AJUSTES.obtener_int("descargar_pestanas_minutos", 0)
+        
         self.init_ui()
+        self.arranque.marcar("ventana")
+        # Los datos (keys, conversaciones, índice) se cargan tras el primer pintado
+        
+        if self.descargar_tras_minutos:
+            self.descarga_timer = QTimer(self)
+            self.descarga_timer.timeout.connect(self.descargar_pestanas_inactivas)
+            self.descarga_timer.start(60 * 1000)
+    
+    def paintEvent(self, event):
+        super().paintEvent(event)
+        self._tras_primer_pintado()
+    
+    def showEvent(self, event):
+        super().showEvent(event)
+        # Por si los hijos cubren toda la ventana y su propio paintEvent no llega
+        QTimer.singleShot(200, self._tras_primer_pintado)
+    
+    def _tras_primer_pintado(self):
+        if self._datos_iniciados:
+            return
+        self._datos_iniciados = True
+        self.arranque.marcar_primer_pintado()
+        # Fuera del pintado: los diálogos de key o carpeta pueden abrirse aquí
+        QTimer.singleShot(0, self._completar_arranque)
+    
+    def _completar_arranque(self):
         self.init_data()
+        self.arranque.terminado = True
+        self.statusBar().showMessage(self.arranque.describir(), 10000)
     
     def load_theme_preference(self):
         """Carga la preferencia de tema desde settings.json"""
-        settings = get_settings()
-        return settings.get("dark_mode", True)  # Modo oscuro por defecto
+        return AJUSTES.obtener_bool("dark_mode", True)  # Modo oscuro por defecto
     
     def save_theme_preference(self, is_dark):
         """Guarda la preferencia de tema en settings.json"""
-        settings = get_settings()
-        settings["dark_mode"] = is_dark
-        save_settings(settings)
-    
-    def get_dark_theme_styles(self):
-        """Retorna los estilos para el tema oscuro"""
-        return {
-            "main_bg": "#1e1e1e",
-            "chat_bg": "#1e1e1e", 
-            "input_bg": "#2d2d2d",
-            "input_border": "#555555",
-            "text_color": "white",
-            "bot_msg_bg": "#2d2d2d",
-            "bot_msg_color": "#e6e6e6",
-            "bot_msg_border": "#c7254e",
-            "user_msg_bg": "#0d47a1",
-            "user_msg_color": "white",
-            "button_bg": "#0d7377",
-            "button_hover": "#14a085",
-            "copy_button_bg": "#555555",
-            "copy_button_hover": "#777777",
-            "date_bg": "#404040",
-            "date_color": "#cccccc",
-            "status_color": "#cccccc"
-        }
-    
-    def get_light_theme_styles(self):
-        """Retorna los estilos para el tema claro"""
-        return {
-            "main_bg": "#ffffff",
-            "chat_bg": "#ffffff",
-            "input_bg": "#ffffff", 
-            "input_border": "#cccccc",
-            "text_color": "#333333",
-            "bot_msg_bg": "#f8f9fa",
-            "bot_msg_color": "#333333",
-            "bot_msg_border": "#dc3545",
-            "user_msg_bg": "#007bff",
-            "user_msg_color": "white",
-            "button_bg": "#28a745",
-            "button_hover": "#218838",
-            "copy_button_bg": "#6c757d",
-            "copy_button_hover": "#545b62",
-            "date_bg": "#e9ecef",
-            "date_color": "#6c757d",
-            "status_color": "#6c757d"
-        }
+        AJUSTES.establecer("dark_mode", is_dark)
     
     def toggle_theme(self, checked):
         """Cambia entre tema oscuro y claro"""
@@ -897,21 +1562,22 @@ class MainWindow(QMainWindow):
         self.apply_theme_to_all()
     
     def apply_theme_to_all(self):
-        """Aplica el tema actual a toda la interfaz"""
-        styles = self.get_dark_theme_styles() if self.is_dark_mode else self.get_light_theme_styles()
-        
-        # Aplicar estilo a la ventana principal
-        self.setStyleSheet(f"QMainWindow {{ background-color: {styles['main_bg']}; color: {styles['text_color']}; }}")
-        
-        # Aplicar tema a todas las pestañas de chat
-        for i in range(self.tabs.count()):
-            chat_widget = self.tabs.widget(i)
-            if hasattr(chat_widget, 'apply_theme'):
-                chat_widget.apply_theme(styles)
+        """Aplica el tema actual a toda la interfaz.
+
+        Una sola hoja de estilos para toda la aplicación y el diccionario de
+        colores compartido por los delegados: no se recorre ninguna pestaña.
+        Solo hace falta repintar los mensajes de la visible; las demás se
+        pintan con el tema nuevo al mostrarse.
+        """
+        aplicar_tema(self.is_dark_mode)
+        actual = self.tabs.currentWidget()
+        if isinstance(actual, ChatWidget):
+            actual.chat_view.viewport().update()
     
     def init_ui(self):
         # Widget central con pestañas
         self.tabs = QTabWidget()
+        self.tabs.currentChanged.connect(self.on_tab_changed)
         self.setCentralWidget(self.tabs)
         
         # Menú
@@ -920,9 +1586,58 @@ class MainWindow(QMainWindow):
         # Botones para nuevas pestañas
         self.create_tab_buttons()
         
+        # Estado de la cola de peticiones en la barra de estado
+        self.cola_label = QLabel("")
+        self.statusBar().addPermanentWidget(self.cola_label)
+        self.cola_cambiada.connect(self.actualizar_cola)
+        obtener_planificador().observadores.append(self.cola_cambiada.emit)
+        
+        # Panel de estadísticas, alimentado por el registro de métricas
+        self.stats_panel = PanelEstadisticas(self)
+        self.addDockWidget(Qt.DockWidgetArea.RightDockWidgetArea, self.stats_panel)
+        self.stats_panel.hide()
+        self.metricas_registradas.connect(self.stats_panel.agregar)
+        REGISTRO_METRICAS.observadores.append(self.metricas_registradas.emit)
+        
+        # Recarga settings.json si se modifica desde fuera (otro proceso, el CLI o a mano)
+        self.vigilante_ajustes = QFileSystemWatcher(self)
+        if os.path.exists(AJUSTES.ruta):
+            self.vigilante_ajustes.addPath(AJUSTES.ruta)
+        self.vigilante_ajustes.fileChanged.connect(self.on_ajustes_modificados)
+        AJUSTES.observadores.append(self.aplicar_ajustes_externos)
+        
         # Aplicar tema inicial
         self.apply_theme_to_all()
     
+    def on_ajustes_modificados(self, ruta):
+        # Un guardado atómico sustituye el archivo vigilado: hay que volver a añadirlo
+        if ruta not in self.vigilante_ajustes.files() and os.path.exists(ruta):
+            self.vigilante_ajustes.addPath(ruta)
+        AJUSTES.comprobar_cambios()
+    
+    def aplicar_ajustes_externos(self, settings):
+        """Aplica los ajustes que se pueden cambiar en caliente tras una edición externa."""
+        oscuro = settings.get("dark_mode", True)
+        if oscuro != self.is_dark_mode:
+            self.theme_toggle.setChecked(oscuro)
+    
+    def actualizar_cola(self, en_cola, activas):
+        """Muestra cuántas peticiones hay en curso y cuántas esperando."""
+        contadores = CONTADORES_RED.instantanea()
+        self.cola_label.setToolTip(
+            f"Peticiones: {contadores.get('peticiones', 0)} · Reintentos: {contadores.get('reintentos', 0)} · "
+            f"429: {contadores.get('limitadas', 0)} · Reanudadas: {contadores.get('reanudadas', 0)} · "
+            f"Esperas por límite: {contadores.get('esperas_limite', 0)} · Errores: {contadores.get('errores', 0)} · "
+            f"Caché: {contadores.get('cache_aciertos', 0)} aciertos / {contadores.get('cache_fallos', 0)} fallos"
+        )
+        if not en_cola and not activas:
+            self.cola_label.setText("")
+            return
+        texto = f"Peticiones: {activas} en curso"
+        if en_cola:
+            texto += f", {en_cola} en cola"
+        self.cola_label.setText(texto)
+    
     def create_menu(self):
         menubar = self.menuBar()
         
@@ -932,12 +1647,15 @@ class MainWindow(QMainWindow):
         
         # Menú IA
         ia_menu = menubar.addMenu("IA Prompt")
-        ia_menu.addAction("Deepseek", lambda: self.seleccionar_ia_desde_menu("Deepseek"))
-        ia_menu.addAction("ChatGPT", lambda: self.seleccionar_ia_desde_menu("ChatGPT"))
+        for nombre in PROVEEDORES:
+            ia_menu.addAction(nombre, lambda checked=False, n=nombre: self.seleccionar_ia_desde_menu(n))
         
         # Menú Ajustes
         ajustes_menu = menubar.addMenu("Ajustes")
         ajustes_menu.addAction("Actualizar Key", self.actualizar_key)
+        if AJUSTES.obtener_texto("almacenamiento") == "sqlite":
+            ajustes_menu.addAction("Importar conversaciones JSON...", self.importar_conversaciones)
+            ajustes_menu.addAction("Exportar conversaciones a JSON...", self.exportar_conversaciones)
         ajustes_menu.addAction("Configuración", lambda: QMessageBox.information(self, "Ajustes", "Función de configuración"))
     
     def create_tab_buttons(self):
@@ -945,6 +1663,9 @@ class MainWindow(QMainWindow):
         toolbar = self.addToolBar("Tabs")
         toolbar.addAction("➕ Nuevo chat", self.crear_nuevo_chat)
         toolbar.addAction("✖ Cerrar pestaña", self.cerrar_pestana_actual)
+        buscar_action = toolbar.addAction("🔍 Buscar", self.mostrar_busqueda)
+        buscar_action.setShortcut("Ctrl+Shift+F")
+        toolbar.addAction("📊 Estadísticas", lambda: self.stats_panel.setVisible(not self.stats_panel.isVisible()))
         
         # Separador
         toolbar.addSeparator()
@@ -980,80 +1701,156 @@ class MainWindow(QMainWindow):
         """Inicializa los datos necesarios para la aplicación."""
         self.ia_tipo, self.api_keys = get_api_key_and_ia()
         api_key = self.api_keys.get(self.ia_tipo)
-        if not api_key:
+        if not api_key and PROVEEDORES.get(self.ia_tipo, Proveedor).requiere_key:
             QMessageBox.critical(self, "Error", "No se ingresó una API Key.")
             return
         
-        self.bot = self.crear_bot(self.ia_tipo, self.api_keys)
-        
         self.conversaciones_dir = get_conversaciones_dir()
         if not self.conversaciones_dir:
             QMessageBox.critical(self, "Error", "No se seleccionó ninguna carpeta para conversaciones.")
             return
         
+        self.almacen = crear_almacen(self.conversaciones_dir)
         self.load_existing_chats()
+        self.arranque.marcar("conversaciones")
+        self.init_busqueda()
+        self.arranque.marcar("busqueda")
     
     def crear_bot(self, ia, api_keys):
         """Crea un bot según el tipo de IA."""
-        if ia == "Deepseek":
-            base_url = "https://api.deepseek.com"
-            model = "deepseek-chat"
-            return DeepSeekChat(api_keys["Deepseek"], base_url, model)
-        elif ia == "ChatGPT":
-            # No se usa DeepSeekChat, solo se pasa la key
-            return None
-        else:
-            base_url = "https://api.deepseek.com"
-            model = "deepseek-chat"
-            return DeepSeekChat(api_keys["Deepseek"], base_url, model)
+        return crear_bot(ia, api_keys)
     
     def load_existing_chats(self):
         """Carga los chats existentes como pestañas."""
-        archivos = [f for f in os.listdir(self.conversaciones_dir) if f.endswith(".json")]
-        if not archivos:
-            # Si no hay archivos, crea uno por defecto
+        conversaciones = self.almacen.listar_titulos()
+        if not conversaciones:
+            # Si no hay conversaciones, crea una por defecto
             self.crear_archivo_chat_por_defecto()
-            archivos = [f for f in os.listdir(self.conversaciones_dir) if f.endswith(".json")]
+            conversaciones = self.almacen.listar_titulos()
         
-        for archivo in archivos:
-            historial_path = os.path.join(self.conversaciones_dir, archivo)
-            chat_widget = ChatWidget(self.bot, historial_path, self.tabs, self.ia_tipo, self.api_keys, self)
+        # Solo se lee el título de cada conversación; el historial se carga al activar la pestaña
+        for nombre, titulo in conversaciones:
+            placeholder = ChatPlaceholder(self.almacen, nombre, titulo, self.ia_tipo, self.api_keys)
             
-            tab_text = chat_widget.titulo if chat_widget.titulo else archivo.replace(".json", "")
-            self.tabs.addTab(chat_widget, tab_text)
-            self.chat_widgets.append(chat_widget)
+            tab_text = titulo if titulo else nombre
+            self.chat_widgets.append(placeholder)
+            self.tabs.addTab(placeholder, tab_text)
+    
+    def init_busqueda(self):
+        """Prepara el panel de búsqueda global.
+
+        El almacén SQLite ya tiene su índice FTS5; con archivos se construye un
+        IndiceBusqueda en segundo plano y se mantiene al día con los eventos
+        del almacén.
+        """
+        if hasattr(self.almacen, "buscar"):
+            buscar = self.almacen.buscar
+        else:
+            self.indice_busqueda = IndiceBusqueda()
+            self.indexador = IndexadorBusqueda(self.almacen, self.indice_busqueda, self)
+            self.indexador.start()
+            buscar = self.indice_busqueda.buscar
+        self.search_panel = SearchPanel(buscar, self)
+        self.search_panel.resultado_activado.connect(self.abrir_resultado_busqueda)
+        self.addDockWidget(Qt.DockWidgetArea.RightDockWidgetArea, self.search_panel)
+        self.search_panel.hide()
+    
+    def mostrar_busqueda(self):
+        if self.search_panel is None:
+            return
+        self.search_panel.show()
+        self.search_panel.consulta.setFocus()
+        self.search_panel.consulta.selectAll()
+    
+    def abrir_resultado_busqueda(self, nombre, indice):
+        """Abre (cargándola si hace falta) la conversación y muestra el mensaje."""
+        widget = next((w for w in self.chat_widgets if w.nombre == nombre), None)
+        if widget is None:
+            placeholder = ChatPlaceholder(self.almacen, nombre, self.almacen.leer_titulo(nombre),
+                                          self.ia_tipo, self.api_keys)
+            self.chat_widgets.append(placeholder)
+            self.tabs.addTab(placeholder, placeholder.titulo or nombre)
+            widget = placeholder
+        if isinstance(widget, ChatPlaceholder):
+            self.cargar_pestana(widget)
+            widget = next(w for w in self.chat_widgets if w.nombre == nombre)
+        self.tabs.setCurrentWidget(widget)
+        QTimer.singleShot(0, lambda: widget.scroll_to_message(indice))
+    
+    def on_tab_changed(self, index):
+        """Carga bajo demanda la pestaña activada si aún es un marcador."""
+        widget = self.tabs.widget(index)
+        if isinstance(widget, ChatPlaceholder):
+            # Diferido para no modificar las pestañas dentro de la propia señal
+            QTimer.singleShot(0, lambda: self.cargar_pestana(widget))
+        elif widget is not None:
+            widget.ultima_actividad = time.monotonic()
+    
+    def _reemplazar_pestana(self, viejo, nuevo, tab_text):
+        """Sustituye un widget de pestaña por otro en la misma posición."""
+        index = self.tabs.indexOf(viejo)
+        if index < 0:
+            return False
+        era_actual = self.tabs.currentIndex() == index
+        self.tabs.blockSignals(True)
+        self.tabs.removeTab(index)
+        self.tabs.insertTab(index, nuevo, tab_text)
+        if era_actual:
+            self.tabs.setCurrentIndex(index)
+        self.tabs.blockSignals(False)
+        self.chat_widgets[self.chat_widgets.index(viejo)] = nuevo
+        viejo.deleteLater()
+        return True
+    
+    def cargar_pestana(self, placeholder):
+        """Convierte un marcador en un ChatWidget completo."""
+        if self.tabs.indexOf(placeholder) < 0:
+            return
+        chat_widget = ChatWidget(None, placeholder.almacen, placeholder.nombre, self.tabs,
+                                 placeholder.ia_tipo, placeholder.api_keys, self)
+        tab_text = chat_widget.titulo or placeholder.titulo or chat_widget.nombre
+        self._reemplazar_pestana(placeholder, chat_widget, tab_text)
+    
+    def descargar_pestanas_inactivas(self):
+        """Vuelve a convertir en marcadores las pestañas inactivas para liberar memoria."""
+        limite = self.descargar_tras_minutos * 60
+        ahora = time.monotonic()
+        actual = self.tabs.currentWidget()
+        for chat_widget in list(self.chat_widgets):
+            if not isinstance(chat_widget, ChatWidget) or chat_widget is actual:
+                continue
+            if chat_widget._in_streaming or not chat_widget.historial_cargado \
+                    or ahora - chat_widget.ultima_actividad < limite:
+                continue
+            chat_widget.detener_carga()
+            chat_widget.save_history()
+            titulo = chat_widget.titulo
+            placeholder = ChatPlaceholder(chat_widget.almacen, chat_widget.nombre, titulo,
+                                          chat_widget.ia_tipo, chat_widget.api_keys)
+            tab_text = titulo or chat_widget.nombre
+            self._reemplazar_pestana(chat_widget, placeholder, tab_text)
     
     def crear_archivo_chat_por_defecto(self):
         """Crea un archivo de chat por defecto."""
+        self.almacen.crear(self._nombre_chat_nuevo())
+    
+    def _nombre_chat_nuevo(self):
+        """Primer nombre Chat_nuevo_N libre en el almacén."""
         idx = 1
-        while True:
-            nuevo_nombre = f"Chat_nuevo_{idx}.json"
-            historial_path = os.path.join(self.conversaciones_dir, nuevo_nombre)
-            if not os.path.exists(historial_path):
-                with open(historial_path, "w", encoding="utf-8") as f:
-                    json.dump([], f, ensure_ascii=False, indent=2)
-                break
+        while self.almacen.existe(f"Chat_nuevo_{idx}"):
             idx += 1
+        return f"Chat_nuevo_{idx}"
     
     def crear_nuevo_chat(self):
         """Crea una nueva pestaña de chat."""
-        idx = 1
-        while True:
-            nuevo_nombre = f"Chat_nuevo_{idx}.json"
-            historial_path = os.path.join(self.conversaciones_dir, nuevo_nombre)
-            if not os.path.exists(historial_path):
-                with open(historial_path, "w", encoding="utf-8") as f:
-                    json.dump([], f, ensure_ascii=False, indent=2)
-                break
-            idx += 1
+        nombre = self._nombre_chat_nuevo()
+        self.almacen.crear(nombre)
         
         # Usa la IA y key actual
-        current_settings = get_settings()
-        ia_actual = current_settings.get("ia_seleccionada", "Deepseek")
-        api_keys_actual = current_settings.get("api_keys", {})
-        bot_actual = self.crear_bot(ia_actual, api_keys_actual)
-        
-        chat_widget = ChatWidget(bot_actual, historial_path, self.tabs, ia_actual, api_keys_actual, self)
+        ia_actual = AJUSTES.obtener_texto("ia_seleccionada", "Deepseek")
+        api_keys_actual = AJUSTES.obtener_dict("api_keys")
+        # El contexto del modelo se crea al enviar el primer mensaje
+        chat_widget = ChatWidget(None, self.almacen, nombre, self.tabs, ia_actual, api_keys_actual, self)
         tab_text = "Chat nuevo"
         
         tab_index = self.tabs.addTab(chat_widget, tab_text)
@@ -1070,24 +1867,63 @@ class MainWindow(QMainWindow):
         """Cierra una pestaña específica."""
         if 0 <= index < len(self.chat_widgets):
             chat_widget = self.chat_widgets[index]
+            # Una lectura pendiente volvería a crear el archivo tras borrarlo
+            chat_widget.detener_carga()
+            chat_widget.detener_respuesta()
             chat_widget.save_history()
             
             try:
-                if os.path.exists(chat_widget.historial_path):
-                    os.remove(chat_widget.historial_path)
+                chat_widget.almacen.eliminar(chat_widget.nombre)
             except Exception as e:
                 QMessageBox.warning(self, "Eliminar historial", f"No se pudo eliminar el historial: {e}")
             
             self.tabs.removeTab(index)
             del self.chat_widgets[index]
     
+    def importar_conversaciones(self):
+        """Importa al almacén SQLite las conversaciones JSON de una carpeta."""
+        if not hasattr(self.almacen, "importar_json"):
+            return
+        directorio = QFileDialog.getExistingDirectory(self, "Carpeta con conversaciones JSON")
+        if not directorio:
+            return
+        try:
+            importadas = self.almacen.importar_json(directorio)
+        except Exception as e:
+            QMessageBox.warning(self, "Importar", f"No se pudieron importar las conversaciones: {e}")
+            return
+        # Añade como pestañas las conversaciones nuevas
+        abiertas = {w.nombre for w in self.chat_widgets}
+        for nombre, titulo in self.almacen.listar_titulos():
+            if nombre not in abiertas:
+                placeholder = ChatPlaceholder(self.almacen, nombre, titulo, self.ia_tipo, self.api_keys)
+                self.chat_widgets.append(placeholder)
+                self.tabs.addTab(placeholder, titulo or nombre)
+        QMessageBox.information(self, "Importar", f"Conversaciones importadas: {importadas}")
+    
+    def exportar_conversaciones(self):
+        """Exporta el almacén SQLite a archivos JSON Lines en una carpeta."""
+        if not hasattr(self.almacen, "exportar_json"):
+            return
+        directorio = QFileDialog.getExistingDirectory(self, "Carpeta de destino")
+        if not directorio:
+            return
+        for chat_widget in self.chat_widgets:
+            chat_widget.save_history()
+        try:
+            exportadas = self.almacen.exportar_json(directorio)
+        except Exception as e:
+            QMessageBox.warning(self, "Exportar", f"No se pudieron exportar las conversaciones: {e}")
+            return
+        QMessageBox.information(self, "Exportar", f"Conversaciones exportadas: {exportadas}")
+    
     def seleccionar_ia_desde_menu(self, ia_seleccionada):
         """Cambia la IA desde el menú."""
         settings = get_settings()
         api_keys = settings.get("api_keys", {})
         key = api_keys.get(ia_seleccionada)
         
-        if not key:
+        if not key and PROVEEDORES[ia_seleccionada].requiere_key:
             key, ok = QInputDialog.getText(self, "API Key", f"Ingrese la API Key para {ia_seleccionada}:", QLineEdit.EchoMode.Password)
             if not ok or not key:
                 return
@@ -1100,13 +1936,11 @@ class MainWindow(QMainWindow):
         settings["ia_seleccionada"] = ia_seleccionada
         save_settings(settings)
         
-        # Actualiza todos los chats
+        # Actualiza todos los chats; cada uno reconstruye su contexto al enviar
         for chat_widget in self.chat_widgets:
             chat_widget.ia_tipo = ia_seleccionada
-            chat_widget.api_keys = settings["api_keys"]
-            if ia_seleccionada == "Deepseek":
-                chat_widget.bot = self.crear_bot("Deepseek", settings["api_keys"])
-            else:
+            chat_widget.api_keys = settings.get("api_keys", {})
+            if isinstance(chat_widget, ChatWidget):
                 chat_widget.bot = None
         
         QMessageBox.information(self, "IA", f"IA seleccionada: {ia_seleccionada}\nKey guardada.")
@@ -1126,27 +1960,47 @@ class MainWindow(QMainWindow):
             # Actualiza todos los chats
             for chat_widget in self.chat_widgets:
                 chat_widget.api_keys = settings["api_keys"]
-                if chat_widget.ia_tipo == ia_sel and ia_sel == "Deepseek":
-                    chat_widget.bot = self.crear_bot("Deepseek", settings["api_keys"])
+                if chat_widget.ia_tipo == ia_sel and isinstance(chat_widget, ChatWidget):
+                    chat_widget.bot = None
             
             QMessageBox.information(self, "Configuración", f"Key de {ia_sel} actualizada.")
     
     def closeEvent(self, event):
         """Guarda todos los historiales al cerrar la aplicación."""
         for chat_widget in self.chat_widgets:
+            chat_widget.detener_carga()
+            chat_widget.detener_respuesta()
             chat_widget.save_history()
+        if self.indexador is not None:
+            self.indexador.detener()
+        if hasattr(self.almacen, "cerrar"):
+            self.almacen.cerrar()
+        cerrar_clientes()
+        cerrar_cache()
+        AJUSTES.guardar_ahora()
         event.accept()
 
 def main():
+    arranque = TiemposArranque(INICIO_PROCESO)
+    arranque.marcar("importaciones")
     app = QApplication(sys.argv)
     
     # Aplica un estilo más moderno
     app.setStyle('Fusion')
+    arranque.marcar("qapplication")
     
-    window = MainWindow()
+    window = MainWindow(arranque)
     window.show()
     
-    sys.exit(app.exec())
+    # Solo la interfaz instala dependencias (importar el núcleo no lo hace), y
+    # lo hace en segundo plano con la ventana ya visible
+    precarga = PrecargaDependencias(window)
+    precarga.terminada.connect(lambda mensaje: mensaje and window.statusBar().showMessage(mensaje, 10000))
+    precarga.start()
+    
+    codigo = app.exec()
+    precarga.wait()
+    sys.exit(codigo)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,378 @@
+"""Benchmarks de la propia aplicación contra el servidor falso.
+
+Mide el núcleo (tiempo hasta el primer token, streams concurrentes), el
+almacén (abrir los últimos mensajes frente a leer la conversación entera) y la
+interfaz (tiempo hasta el primer render, ritmo de update_reply, carga del
+historial, arranque de MainWindow con N conversaciones, coste de guardar y
+memoria por mensaje). Todo corre con un settings.json temporal, así que no
+toca la configuración ni las conversaciones del usuario. Los resultados se
+escriben en JSON para comparar ejecuciones:
+
+    python benchmarks/bench.py --salida antes.json
+    python benchmarks/bench.py --salida despues.json --comparar antes.json
+
+Las partes cuyas dependencias no estén instaladas (openai/httpx o PyQt6) se
+marcan como omitidas.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+import tracemalloc
+from datetime import datetime
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from servidor_falso import ConfigFalsa, ServidorFalso
+
+VERSION_RESULTADOS = 1
+
+def resumir(muestras):
+    """Mediana, mínimo, p95 y media de una lista de tiempos (ms)."""
+    ordenadas = sorted(muestras)
+    p95 = ordenadas[min(len(ordenadas) - 1, int(round(0.95 * (len(ordenadas) - 1))))]
+    return {
+        "mediana": round(statistics.median(ordenadas), 3),
+        "min": round(ordenadas[0], 3),
+        "p95": round(p95, 3),
+        "media": round(statistics.fmean(ordenadas), 3),
+        "n": len(ordenadas),
+    }
+
+def cronometrar(funcion, repeticiones):
+    muestras = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        muestras.append((time.perf_counter() - inicio) * 1000)
+    return resumir(muestras)
+
+def crear_conversacion(almacen, nombre, mensajes):
+    almacen.crear(nombre)
+    for i in range(mensajes):
+        autor = "Tú" if i % 2 == 0 else "DeepSeek"
+        texto = f"Mensaje {i} " + "lorem ipsum dolor sit amet " * (1 + i % 7)
+        almacen.agregar_mensaje(nombre, {"author": autor, "text": texto, "fecha_hora": "01/01/25 00:00:00"})
+
+def hay_modulo(nombre):
+    import importlib.util
+    return importlib.util.find_spec(nombre) is not None
+
+# === Núcleo ===
+def bench_nucleo(args, settings, resultados):
+    """Streams contra el servidor falso.
+
+    Con --tasa-errores o --tasa-cortes algunos streams fallan aunque se
+    reintenten (el proveedor Local no puede reanudar un prefijo): se cuentan
+    en lugar de abortar, junto con los contadores de red, para que las
+    ejecuciones con errores inyectados sigan siendo comparables.
+    """
+    from deepseek_core import (CONTADORES_RED, DeepSeekChat, GestorContexto, obtener_proveedor,
+                               obtener_planificador)
+    
+    def nuevo_bot():
+        return DeepSeekChat(obtener_proveedor("Local", {}, settings), GestorContexto())
+    
+    def un_stream():
+        """(ms hasta el primer token, ms totales, fragmentos), o None si el stream falla."""
+        marcas = []
+        bot = nuevo_bot()
+        inicio = time.perf_counter()
+        futuro = obtener_planificador().enviar(
+            bot.proveedor, bot.stream_chat("hola", lambda _: marcas.append(time.perf_counter()))
+        )
+        try:
+            futuro.result()
+        except Exception:
+            return None
+        return (marcas[0] - inicio) * 1000, (time.perf_counter() - inicio) * 1000, len(marcas)
+    
+    un_stream()  # calentamiento: conexión y cliente
+    contadores_antes = CONTADORES_RED.instantanea()
+    ttft, totales, trozos, fallidos = [], [], 0, 0
+    for _ in range(args.repeticiones):
+        medida = un_stream()
+        if medida is None:
+            fallidos += 1
+            continue
+        primero, total, n = medida
+        ttft.append(primero)
+        totales.append(total)
+        trozos = n
+    if totales:
+        resultados["nucleo.ttft_ms"] = resumir(ttft)
+        resultados["nucleo.stream_total_ms"] = resumir(totales)
+        resultados["nucleo.trozos_por_segundo"] = {"mediana": round(trozos / (statistics.median(totales) / 1000), 1)}
+    
+    inicio = time.perf_counter()
+    futuros = []
+    for _ in range(args.concurrentes):
+        bot = nuevo_bot()
+        futuros.append(obtener_planificador().enviar(bot.proveedor, bot.stream_chat("hola", lambda _: None)))
+    fallidos_concurrentes = 0
+    for futuro in futuros:
+        try:
+            futuro.result()
+        except Exception:
+            fallidos_concurrentes += 1
+    segundos = time.perf_counter() - inicio
+    resultados["nucleo.concurrentes_streams_por_segundo"] = {
+        "mediana": round((args.concurrentes - fallidos_concurrentes) / segundos, 2), "n": args.concurrentes
+    }
+    resultados["nucleo.streams_fallidos"] = {
+        "mediana": fallidos + fallidos_concurrentes, "n": args.repeticiones + args.concurrentes
+    }
+    contadores = CONTADORES_RED.instantanea()
+    for clave in ("peticiones", "reintentos", "reanudadas", "errores", "limitadas"):
+        resultados[f"nucleo.red_{clave}"] = {"mediana": contadores.get(clave, 0) - contadores_antes.get(clave, 0)}
+
+# === Almacén ===
+def bench_almacen(args, directorio):
+    """Abrir los últimos mensajes frente a leer la conversación entera, por tamaño."""
+    from deepseek_core import AlmacenJSONL
+    almacen = AlmacenJSONL(tempfile.mkdtemp(prefix="bench_almacen_", dir=directorio))
+    resultados = {}
+    for mensajes in args.mensajes_almacen:
+        nombre = f"almacen_{mensajes}"
+        # Escritura de una vez: añadir 100.000 mensajes con fsync uno a uno tardaría minutos
+        almacen._escribir_atomico(almacen.ruta(nombre), None, [
+            {"author": "Tú" if i % 2 == 0 else "DeepSeek",
+             "text": f"Mensaje {i} " + "lorem ipsum dolor sit amet " * (1 + i % 7),
+             "fecha_hora": "01/01/25 00:00:00"} for i in range(mensajes)
+        ])
+        # La primera apertura construye el índice de desplazamientos
+        resultados[f"almacen.indexar_{mensajes}_ms"] = cronometrar(lambda: almacen.cargar_ultimos(nombre, 200), 1)
+        resultados[f"almacen.cargar_ultimos_{mensajes}_ms"] = cronometrar(
+            lambda: almacen.cargar_ultimos(nombre, 200), args.repeticiones
+        )
+        resultados[f"almacen.pagina_anterior_{mensajes}_ms"] = cronometrar(
+            lambda: almacen.leer_mensajes(nombre, mensajes // 2, mensajes // 2 + 200), args.repeticiones
+        )
+        resultados[f"almacen.cargar_completo_{mensajes}_ms"] = cronometrar(
+            lambda: almacen.cargar(nombre), args.repeticiones
+        )
+    return resultados
+
+# === Interfaz ===
+def esperar(app, condicion, limite=30.0):
+    fin = time.perf_counter() + limite
+    while not condicion():
+        if time.perf_counter() > fin:
+            raise TimeoutError("la interfaz no respondió a tiempo")
+        app.processEvents()
+        time.sleep(0.0005)
+
+def bench_interfaz(args, settings, resultados, directorio):
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PyQt6.QtWidgets import QApplication
+    import Deepseek_local as gui
+    from deepseek_core import AlmacenJSONL, DeepSeekChat, GestorContexto, obtener_proveedor, save_settings
+    
+    app = QApplication.instance() or QApplication(sys.argv)
+    almacen = AlmacenJSONL(directorio)
+    
+    # Tiempo hasta el primer render: de on_send a texto visible en la fila de respuesta
+    if hay_modulo("openai") and hay_modulo("httpx"):
+        almacen.crear("bench_ttfr")
+        widget = gui.ChatWidget(None, almacen, "bench_ttfr", ia_tipo="Local", api_keys={})
+        esperar(app, lambda: widget.historial_cargado)
+        widget.bot = DeepSeekChat(obtener_proveedor("Local", {}, settings), GestorContexto())
+        muestras = []
+        for _ in range(args.repeticiones + 1):
+            widget.input_text.setPlainText("hola")
+            inicio = time.perf_counter()
+            widget.on_send()
+            fila = widget.reply_row
+            esperar(app, lambda: bool(widget.model.message(fila).get("text")))
+            muestras.append((time.perf_counter() - inicio) * 1000)
+            esperar(app, lambda: widget.stream_thread is None)
+        resultados["interfaz.ttfr_ms"] = resumir(muestras[1:])
+        widget.deleteLater()
+    else:
+        resultados["interfaz.ttfr_ms"] = {"omitido": "faltan openai/httpx"}
+    
+    # Ritmo de update_reply (incluye el repintado que provoca)
+    almacen.crear("bench_render")
+    widget = gui.ChatWidget(None, almacen, "bench_render", ia_tipo="Local", api_keys={})
+    widget.show()
+    esperar(app, lambda: widget.historial_cargado)
+    widget.start_reply("Local")
+    inicio = time.perf_counter()
+    for i in range(args.trozos):
+        widget.update_reply(f"tok{i} ")
+        app.processEvents()
+    segundos = time.perf_counter() - inicio
+    resultados["interfaz.update_reply_trozos_por_segundo"] = {"mediana": round(args.trozos / segundos, 1),
+                                                              "n": args.trozos}
+    widget.last_reply = widget.model.message(widget.reply_row)["text"]
+    widget.end_reply()
+    widget.close()
+    
+    # Carga de historial, guardado y memoria por mensaje
+    for mensajes in args.mensajes:
+        nombre = f"bench_historial_{mensajes}"
+        crear_conversacion(almacen, nombre, mensajes)
+        widget = gui.ChatWidget(None, almacen, nombre, ia_tipo="Local", api_keys={})
+        esperar(app, lambda: widget.historial_cargado)
+        
+        def cargar():
+            # La lectura va en otro hilo: se mide hasta tener los últimos mensajes en la vista
+            widget.load_history()
+            esperar(app, lambda: widget.historial_cargado)
+        
+        resultados[f"interfaz.load_history_{mensajes}_ms"] = cronometrar(cargar, args.repeticiones)
+        muestras = []
+        for _ in range(args.repeticiones):
+            cargar()
+            inicio = time.perf_counter()
+            widget._leer_pagina(widget._primer_indice, widget.LOTE_HISTORIAL)
+            esperar(app, lambda: widget.cargador is None)
+            muestras.append((time.perf_counter() - inicio) * 1000)
+        resultados[f"interfaz.pagina_anterior_{mensajes}_ms"] = resumir(muestras)
+        resultados[f"interfaz.save_history_{mensajes}_ms"] = cronometrar(widget.save_history, args.repeticiones)
+        mensaje = {"author": "Tú", "text": "mensaje de prueba", "fecha_hora": "01/01/25 00:00:00"}
+        resultados[f"interfaz.registrar_mensaje_{mensajes}_ms"] = cronometrar(
+            lambda: widget._registrar_mensaje(dict(mensaje)), args.repeticiones
+        )
+        tracemalloc.start()
+        antes = tracemalloc.take_snapshot()
+        cargar()
+        despues = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        total = sum(stat.size_diff for stat in despues.compare_to(antes, "filename"))
+        # Solo memoria de Python; lo que reserva Qt en C++ no se ve aquí
+        resultados[f"interfaz.memoria_por_mensaje_{mensajes}_bytes"] = {
+            "mediana": round(total / max(1, len(widget.history)), 1)
+        }
+        widget.deleteLater()
+    
+    # Arranque de MainWindow con N conversaciones
+    dir_arranque = tempfile.mkdtemp(prefix="bench_arranque_", dir=directorio)
+    almacen_arranque = AlmacenJSONL(dir_arranque)
+    for i in range(args.conversaciones):
+        crear_conversacion(almacen_arranque, f"chat_{i}", 20)
+    save_settings({"conversaciones_dir": dir_arranque})
+    muestras, pintados, etapas = [], [], {}
+    for _ in range(args.repeticiones):
+        inicio = time.perf_counter()
+        ventana = gui.MainWindow()
+        ventana.show()
+        esperar(app, lambda: ventana.arranque.terminado)
+        muestras.append((time.perf_counter() - inicio) * 1000)
+        pintados.append(ventana.arranque.primer_pintado)
+        for etapa, ms in ventana.arranque.etapas.items():
+            etapas.setdefault(etapa, []).append(ms)
+        ventana.close()
+        ventana.deleteLater()
+        app.processEvents()
+    resultados[f"interfaz.arranque_mainwindow_{args.conversaciones}_ms"] = resumir(muestras)
+    resultados[f"interfaz.arranque_primer_pintado_{args.conversaciones}_ms"] = resumir(pintados)
+    for etapa, valores in etapas.items():
+        resultados[f"interfaz.arranque_etapa_{etapa}_ms"] = resumir(valores)
+
+def commit_actual():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=RAIZ, capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except Exception:
+        return None
+
+def comparar(actual, ruta_anterior):
+    """Imprime la variación de las medianas respecto a una ejecución anterior."""
+    with open(ruta_anterior, "r", encoding="utf-8") as f:
+        anterior = json.load(f)["resultados"]
+    print(f"\n{'métrica':50} {'antes':>12} {'ahora':>12} {'cambio':>8}")
+    for clave, valor in sorted(actual.items()):
+        previo = anterior.get(clave, {})
+        if "mediana" not in valor or "mediana" not in previo:
+            continue
+        cambio = (valor["mediana"] - previo["mediana"]) / previo["mediana"] * 100 if previo["mediana"] else 0.0
+        print(f"{clave:50} {previo['mediana']:>12} {valor['mediana']:>12} {cambio:>+7.1f}%")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks de DeepSeek Chat contra un servidor falso.")
+    parser.add_argument("--salida", help="archivo JSON de resultados (por defecto se imprime)")
+    parser.add_argument("--comparar", help="resultados anteriores con los que comparar")
+    parser.add_argument("--solo", choices=("nucleo", "almacen", "interfaz"), help="ejecuta solo una parte")
+    parser.add_argument("--repeticiones", type=int, default=10)
+    parser.add_argument("--concurrentes", type=int, default=16)
+    parser.add_argument("--trozos", type=int, default=2000, help="fragmentos para update_reply")
+    parser.add_argument("--mensajes", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--mensajes-almacen", type=int, nargs="+", default=[50, 100000])
+    parser.add_argument("--conversaciones", type=int, default=200)
+    parser.add_argument("--tokens", type=int, default=300)
+    parser.add_argument("--tokens-por-segundo", type=float, default=0)
+    parser.add_argument("--tokens-por-trozo", type=int, default=1)
+    parser.add_argument("--latencia", type=float, default=0.0)
+    parser.add_argument("--tasa-errores", type=float, default=0.0)
+    parser.add_argument("--tasa-cortes", type=float, default=0.0)
+    args = parser.parse_args(argv)
+    
+    config = ConfigFalsa(args.tokens, args.tokens_por_segundo, args.tokens_por_trozo, args.latencia,
+                         args.tasa_errores, args.tasa_cortes)
+    servidor = ServidorFalso(config)
+    base_url = servidor.arrancar()
+    
+    directorio = tempfile.mkdtemp(prefix="deepseek_bench_")
+    settings = {
+        "dependencias_instaladas": True,
+        "conversaciones_dir": directorio,
+        "ia_seleccionada": "Local",
+        "api_keys": {},
+        "proveedores": {"Local": {"base_url": base_url, "modelo": "falso", "concurrencia": args.concurrentes}},
+        "reintentos": {"maximo": 4, "base_segundos": 0.01, "max_segundos": 0.1},
+    }
+    ruta_settings = os.path.join(directorio, "settings.json")
+    with open(ruta_settings, "w", encoding="utf-8") as f:
+        json.dump(settings, f)
+    # Antes de importar el núcleo, que fija SETTINGS_PATH al cargarse
+    os.environ["DEEPSEEK_CHAT_SETTINGS"] = ruta_settings
+    
+    resultados = {}
+    try:
+        if args.solo in (None, "nucleo"):
+            if hay_modulo("openai") and hay_modulo("httpx"):
+                bench_nucleo(args, settings, resultados)
+            else:
+                resultados["nucleo"] = {"omitido": "faltan openai/httpx"}
+        if args.solo in (None, "almacen"):
+            resultados.update(bench_almacen(args, directorio))
+        if args.solo in (None, "interfaz"):
+            if hay_modulo("PyQt6"):
+                bench_interfaz(args, settings, resultados, directorio)
+            else:
+                resultados["interfaz"] = {"omitido": "falta PyQt6"}
+    finally:
+        from deepseek_core import cerrar_clientes
+        cerrar_clientes()
+        servidor.parar()
+    
+    informe = {
+        "version": VERSION_RESULTADOS,
+        "fecha": datetime.now().isoformat(timespec="seconds"),
+        "commit": commit_actual(),
+        "python": platform.python_version(),
+        "plataforma": platform.platform(),
+        "parametros": {k: v for k, v in vars(args).items() if k not in ("salida", "comparar")},
+        "peticiones_servidor": config.peticiones,
+        "resultados": resultados,
+    }
+    texto = json.dumps(informe, ensure_ascii=False, indent=2)
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            f.write(texto + "\n")
+    else:
+        print(texto)
+    if args.comparar:
+        comparar(resultados, args.comparar)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,154 @@
+"""Servidor falso compatible con OpenAI para medir la aplicación sin red real.
+
+Responde a /v1/chat/completions con un stream SSE cuyo ritmo se controla:
+tokens por segundo, tokens por fragmento, latencia hasta el primer byte y
+tasas de errores (429/500) y de conexiones cortadas a mitad de respuesta.
+Se puede arrancar dentro de otro proceso (ServidorFalso.arrancar()) o solo:
+
+    python benchmarks/servidor_falso.py --puerto 8001 --tokens-por-segundo 200
+"""
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class ConfigFalsa:
+    def __init__(self, tokens=300, tokens_por_segundo=0, tokens_por_trozo=1, latencia=0.0,
+                 tasa_errores=0.0, tasa_cortes=0.0, semilla=0):
+        self.tokens = tokens
+        # 0 = sin pausa entre fragmentos (lo más rápido posible)
+        self.tokens_por_segundo = tokens_por_segundo
+        self.tokens_por_trozo = max(1, tokens_por_trozo)
+        self.latencia = latencia
+        self.tasa_errores = tasa_errores
+        self.tasa_cortes = tasa_cortes
+        self.azar = random.Random(semilla)
+        self.lock = threading.Lock()
+        self.peticiones = 0
+
+    def tirar(self, tasa):
+        with self.lock:
+            return tasa > 0 and self.azar.random() < tasa
+
+class ManejadorFalso(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, formato, *args):
+        pass
+
+    @property
+    def config(self):
+        return self.server.config
+
+    def _json(self, estado, datos, cabeceras=None):
+        cuerpo = json.dumps(datos).encode("utf-8")
+        self.send_response(estado)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(cuerpo)))
+        for clave, valor in (cabeceras or {}).items():
+            self.send_header(clave, valor)
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def do_GET(self):
+        self._json(200, {"object": "list", "data": [{"id": "falso", "object": "model", "owned_by": "bench"}]})
+
+    def do_POST(self):
+        cuerpo = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        config = self.config
+        with config.lock:
+            config.peticiones += 1
+        if config.latencia:
+            time.sleep(config.latencia)
+        if config.tirar(config.tasa_errores):
+            estado = config.azar.choice((429, 500))
+            self._json(estado, {"error": {"message": "error inyectado", "type": "server_error"}},
+                       {"Retry-After": "0"} if estado == 429 else None)
+            return
+        tokens = min(config.tokens, cuerpo.get("max_tokens") or config.tokens)
+        palabras = [f"tok{i} " for i in range(tokens)]
+        prompt_tokens = sum(len(str(m.get("content", "")).split()) for m in cuerpo.get("messages", []))
+        uso = {"prompt_tokens": prompt_tokens, "completion_tokens": tokens, "total_tokens": prompt_tokens + tokens}
+        base = {"id": "chatcmpl-falso", "created": int(time.time()), "model": cuerpo.get("model", "falso")}
+        if not cuerpo.get("stream"):
+            self._json(200, {**base, "object": "chat.completion", "usage": uso, "choices": [
+                {"index": 0, "message": {"role": "assistant", "content": "".join(palabras)}, "finish_reason": "stop"}
+            ]})
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        cortar_en = len(palabras) // 2 if config.tirar(config.tasa_cortes) else None
+        pausa = config.tokens_por_trozo / config.tokens_por_segundo if config.tokens_por_segundo else 0
+        base["object"] = "chat.completion.chunk"
+        try:
+            for i in range(0, len(palabras), config.tokens_por_trozo):
+                if cortar_en is not None and i >= cortar_en:
+                    # Conexión cortada a mitad de la respuesta
+                    return
+                texto = "".join(palabras[i:i + config.tokens_por_trozo])
+                self._evento({**base, "choices": [{"index": 0, "delta": {"content": texto}, "finish_reason": None}]})
+                if pausa:
+                    time.sleep(pausa)
+            self._evento({**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+            if cuerpo.get("stream_options", {}).get("include_usage"):
+                self._evento({**base, "choices": [], "usage": uso})
+            self._evento("[DONE]")
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def _evento(self, datos):
+        linea = "data: " + (datos if isinstance(datos, str) else json.dumps(datos)) + "\n\n"
+        self.wfile.write(linea.encode("utf-8"))
+        self.wfile.flush()
+
+class ServidorFalso(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, config=None, host="127.0.0.1", puerto=0):
+        super().__init__((host, puerto), ManejadorFalso)
+        self.config = config or ConfigFalsa()
+
+    @property
+    def base_url(self):
+        host, puerto = self.server_address[:2]
+        return f"http://{host}:{puerto}/v1"
+
+    def arrancar(self):
+        """Atiende peticiones en un hilo en segundo plano; devuelve la URL base."""
+        threading.Thread(target=self.serve_forever, name="servidor-falso", daemon=True).start()
+        return self.base_url
+
+    def parar(self):
+        self.shutdown()
+        self.server_close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--puerto", type=int, default=8001)
+    parser.add_argument("--tokens", type=int, default=300)
+    parser.add_argument("--tokens-por-segundo", type=float, default=0)
+    parser.add_argument("--tokens-por-trozo", type=int, default=1)
+    parser.add_argument("--latencia", type=float, default=0.0, help="segundos hasta el primer byte")
+    parser.add_argument("--tasa-errores", type=float, default=0.0)
+    parser.add_argument("--tasa-cortes", type=float, default=0.0)
+    args = parser.parse_args(argv)
+    config = ConfigFalsa(args.tokens, args.tokens_por_segundo, args.tokens_por_trozo, args.latencia,
+                         args.tasa_errores, args.tasa_cortes)
+    servidor = ServidorFalso(config, args.host, args.puerto)
+    print(f"Servidor falso en {servidor.base_url}", file=sys.stderr)
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,17 @@
+"""Núcleo de DeepSeek Chat sin dependencias de Qt.
+
+Motor de chat, proveedores, almacenes de conversaciones, búsqueda y ajustes
+se pueden usar desde scripts, servidores o pruebas sin cargar la interfaz
+gráfica. Deepseek_local.py es la interfaz construida sobre este paquete y
+`python -m deepseek_core` la línea de comandos.
+"""
+from .ajustes import SETTINGS_PATH, get_settings, save_settings
+from .almacen import AlmacenJSONL, AlmacenSQLite, crear_almacen
+from .busqueda import IndiceBusqueda
+from .cache import CacheRespuestas, obtener_cache
+from .chat import ChunkBuffer, DeepSeekChat, crear_bot
+from .contexto import GestorContexto
+from .metricas import REGISTRO_METRICAS, MetricasPeticion, RegistroMetricas
+from .proveedores import (PROVEEDORES, Proveedor, ProveedorDeepSeek, ProveedorLocal, ProveedorOpenAI,
+                          obtener_proveedor)
+from .red import CONTADORES_RED, cerrar_clientes, obtener_nucleo, obtener_planificador
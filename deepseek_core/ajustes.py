@@ -0,0 +1,210 @@
+"""Lectura y escritura de settings.json y comprobación de dependencias."""
+import os
+import sys
+import copy
+import json
+import atexit
+import threading
+import importlib.util
+
+# settings.json vive junto a la aplicación, no dentro del paquete; DEEPSEEK_CHAT_SETTINGS
+# permite usar otro (por ejemplo, uno temporal en los benchmarks)
+SETTINGS_PATH = os.environ.get("DEEPSEEK_CHAT_SETTINGS") or os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "settings.json"
+)
+
+class Ajustes:
+    """settings.json en memoria.
+
+    Se lee una sola vez; las lecturas salen de memoria y los cambios se
+    escriben de forma diferida (varios cambios seguidos son una sola
+    escritura) y atómica (archivo temporal y rename), de modo que un cierre a
+    mitad de escritura no deja el archivo truncado. Si otro proceso modifica
+    el archivo, comprobar_cambios() lo recarga y avisa a los observadores;
+    al guardar, los cambios propios se aplican sobre lo que haya en disco en
+    lugar de sobrescribir las claves que haya cambiado otro.
+    """
+    RETARDO_ESCRITURA = 0.5
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self._lock = threading.RLock()
+        self._datos = None
+        self._firma = None
+        # Claves cambiadas en memoria y aún no escritas
+        self._cambiadas = set()
+        self._temporizador = None
+        # observador(datos) tras recargar un archivo modificado desde fuera
+        self.observadores = []
+        atexit.register(self.guardar_ahora)
+
+    def _firma_archivo(self):
+        try:
+            estado = os.stat(self.ruta)
+        except OSError:
+            return None
+        return estado.st_mtime_ns, estado.st_size
+
+    def _leer_archivo(self):
+        try:
+            with open(self.ruta, "r", encoding="utf-8") as f:
+                datos = json.load(f)
+            return datos if isinstance(datos, dict) else {}
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            print(f"No se pudo leer {self.ruta}: {e}")
+            return {}
+
+    def _cargados(self):
+        if self._datos is None:
+            self._firma = self._firma_archivo()
+            self._datos = self._leer_archivo()
+        return self._datos
+
+    def copia(self):
+        """Copia independiente de todos los ajustes (se puede modificar sin efecto)."""
+        with self._lock:
+            return copy.deepcopy(self._cargados())
+
+    def obtener(self, clave, defecto=None):
+        with self._lock:
+            return copy.deepcopy(self._cargados().get(clave, defecto))
+
+    def _tipado(self, clave, defecto, tipos):
+        valor = self.obtener(clave, defecto)
+        return valor if isinstance(valor, tipos) else defecto
+
+    def obtener_bool(self, clave, defecto=False):
+        return self._tipado(clave, defecto, bool)
+
+    def obtener_int(self, clave, defecto=0):
+        valor = self._tipado(clave, defecto, (int, float))
+        return defecto if isinstance(valor, bool) else int(valor)
+
+    def obtener_texto(self, clave, defecto=None):
+        return self._tipado(clave, defecto, str)
+
+    def obtener_dict(self, clave):
+        return self._tipado(clave, {}, dict)
+
+    def actualizar(self, cambios):
+        """Cambia las claves dadas (las demás se conservan) y programa la escritura."""
+        with self._lock:
+            datos = self._cargados()
+            for clave, valor in cambios.items():
+                if datos.get(clave) != valor or clave not in datos:
+                    datos[clave] = copy.deepcopy(valor)
+                    self._cambiadas.add(clave)
+            if self._cambiadas:
+                self._programar_guardado()
+
+    def establecer(self, clave, valor):
+        self.actualizar({clave: valor})
+
+    def _programar_guardado(self):
+        if self._temporizador is not None:
+            self._temporizador.cancel()
+        self._temporizador = threading.Timer(self.RETARDO_ESCRITURA, self.guardar_ahora)
+        self._temporizador.daemon = True
+        self._temporizador.start()
+
+    def guardar_ahora(self):
+        """Escribe los cambios pendientes (si los hay) de inmediato."""
+        with self._lock:
+            if self._temporizador is not None:
+                self._temporizador.cancel()
+                self._temporizador = None
+            if not self._cambiadas:
+                return
+            datos = self._cargados()
+            if self._firma_archivo() != self._firma:
+                # Otro proceso escribió entretanto: se parte de su versión
+                en_disco = self._leer_archivo()
+                en_disco.update({clave: datos[clave] for clave in self._cambiadas})
+                datos = self._datos = en_disco
+            temporal = f"{self.ruta}.{os.getpid()}.tmp"
+            try:
+                with open(temporal, "w", encoding="utf-8") as f:
+                    json.dump(datos, f, ensure_ascii=False, indent=2)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(temporal, self.ruta)
+            except Exception as e:
+                print(f"No se pudieron guardar los ajustes: {e}")
+                try:
+                    os.remove(temporal)
+                except OSError:
+                    pass
+                return
+            self._firma = self._firma_archivo()
+            self._cambiadas.clear()
+
+    def comprobar_cambios(self):
+        """Recarga el archivo si cambió fuera de esta instancia; devuelve True si lo hizo."""
+        with self._lock:
+            if self._datos is None or self._firma_archivo() == self._firma:
+                return False
+            self._firma = self._firma_archivo()
+            en_disco = self._leer_archivo()
+            # Lo pendiente de escribir prevalece sobre lo leído
+            en_disco.update({clave: self._datos[clave] for clave in self._cambiadas})
+            self._datos = en_disco
+            datos = copy.deepcopy(en_disco)
+        for observador in list(self.observadores):
+            try:
+                observador(datos)
+            except Exception as e:
+                print(f"Error notificando el cambio de ajustes: {e}")
+        return True
+
+AJUSTES = Ajustes(SETTINGS_PATH)
+
+# Dependencias opcionales: módulo importable → paquete de pip
+DEPENDENCIAS = {"openai": "openai", "fpdf": "fpdf"}
+
+def dependencias_faltantes():
+    """Módulos de DEPENDENCIAS que no están instalados.
+
+    Usa find_spec, que solo busca el módulo: ni lo importa ni lanza pip.
+    """
+    return [modulo for modulo in DEPENDENCIAS if importlib.util.find_spec(modulo) is None]
+
+# Instalación automática de dependencias
+def instalar_dependencias(faltantes=None):
+    import subprocess
+    faltantes = dependencias_faltantes() if faltantes is None else faltantes
+    for modulo in faltantes:
+        subprocess.check_call([sys.executable, "-m", "pip", "install", DEPENDENCIAS[modulo]])
+    importlib.invalidate_caches()
+
+def check_dependencias():
+    """Instala las dependencias que falten; devuelve las que se instalaron.
+
+    Con todo instalado no se lanza ningún proceso, así que se puede llamar
+    en cada arranque (y no depende de una marca en settings.json que se
+    pierde con un archivo nuevo o queda mintiendo si se desinstala algo).
+    """
+    faltantes = dependencias_faltantes()
+    if faltantes:
+        instalar_dependencias(faltantes)
+    return faltantes
+
+def get_settings():
+    """Copia de los ajustes (de memoria: settings.json solo se lee la primera vez)."""
+    return AJUSTES.copia()
+
+# Variables de entorno que sustituyen a la key guardada en settings.json
+VARIABLES_KEY = {"Deepseek": "DEEPSEEK_API_KEY", "ChatGPT": "OPENAI_API_KEY"}
+
+def obtener_api_keys(settings):
+    """Keys de settings.json, con prioridad para las variables de entorno."""
+    api_keys = dict(settings.get("api_keys", {}))
+    for ia, variable in VARIABLES_KEY.items():
+        if os.environ.get(variable):
+            api_keys[ia] = os.environ[variable]
+    return api_keys
+
+def save_settings(settings):
+    """Guarda las claves de settings (las que no aparezcan no se tocan) de forma diferida."""
+    AJUSTES.actualizar(settings)
@@ -0,0 +1,650 @@
+"""Almacenes de conversaciones: JSON Lines (por defecto) y SQLite."""
+import os
+import re
+import json
+import threading
+from datetime import datetime
+
+from .ajustes import get_settings
+from .indice_lineas import IndiceLineas
+
+try:
+    # Parser más rápido si está instalado; el resultado es el mismo que con json
+    import orjson
+except ImportError:
+    orjson = None
+
+def cargar_json(texto):
+    """json.loads, con orjson cuando está disponible.
+
+    orjson es más estricto (NaN, enteros enormes): lo que rechace se vuelve a
+    intentar con json para no dar por corrupta una línea que antes se leía.
+    """
+    if orjson is not None:
+        try:
+            return orjson.loads(texto)
+        except ValueError:
+            pass
+    return json.loads(texto)
+
+_TITULO_RE = re.compile(r'"titulo"\s*:\s*("(?:[^"\\]|\\.)*"|null)')
+
+def leer_titulo_historial(historial_path, max_bytes=4096):
+    """Lee solo el título de un historial .json antiguo mirando su cabecera.
+
+    Ese formato guardaba "titulo" como primera clave, así que basta con los
+    primeros bytes; no se parsean los mensajes.
+    """
+    try:
+        with open(historial_path, "r", encoding="utf-8", errors="ignore") as f:
+            cabecera = f.read(max_bytes)
+        m = _TITULO_RE.search(cabecera)
+        if m:
+            return json.loads(m.group(1))
+    except Exception:
+        pass
+    return None
+
+def _fsync_directorio(directorio):
+    """Sincroniza la entrada de directorio tras un rename (no disponible en Windows)."""
+    try:
+        fd = os.open(directorio, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+class AlmacenJSONL:
+    """Conversaciones en JSON Lines: un archivo .jsonl por conversación.
+
+    La primera línea es una cabecera {"tipo": "cabecera", "titulo": ...} y
+    cada mensaje ocupa una línea. Los mensajes nuevos se añaden al final y se
+    sincronizan con fsync, así que un cierre inesperado no pierde lo ya
+    escrito y guardar no cuesta O(historial). Las reescrituras completas
+    (cambio de título, compactación) se hacen sobre un temporal que luego se
+    renombra de forma atómica. Los historiales .json antiguos, con formato
+    {"titulo", "mensajes"} o lista, se migran la primera vez que se abren.
+    
+    cargar_ultimos() y leer_mensajes() leen solo una página de mensajes a
+    través del índice de desplazamientos que se guarda junto a cada archivo
+    (ver IndiceLineas), así que abrir una conversación larga cuesta lo mismo
+    que una corta.
+    
+    Los callables de `observadores` reciben (evento, nombre, dato) tras cada
+    escritura: "mensaje" (dato = mensaje), "titulo", "renombrar" (dato =
+    nombre nuevo) y "eliminar".
+    """
+    EXT = ".jsonl"
+    LEGACY_EXT = ".json"
+    INDICE_EXT = ".idx"
+    VERSION = 1
+    
+    def __init__(self, directorio):
+        self.directorio = directorio
+        self.observadores = []
+        # Los índices de desplazamientos se leen y actualizan desde varios hilos
+        self._lock_indices = threading.Lock()
+    
+    def _notificar(self, evento, nombre, dato=None):
+        for observador in self.observadores:
+            try:
+                observador(evento, nombre, dato)
+            except Exception as e:
+                print(f"Error notificando '{evento}' de {nombre}: {e}")
+    
+    def ruta(self, nombre):
+        return os.path.join(self.directorio, nombre + self.EXT)
+    
+    def _ruta_legacy(self, nombre):
+        return os.path.join(self.directorio, nombre + self.LEGACY_EXT)
+    
+    def _ruta_indice(self, nombre):
+        return os.path.join(self.directorio, nombre + self.INDICE_EXT)
+    
+    def listar(self):
+        """Nombres de todas las conversaciones, incluidas las .json aún sin migrar."""
+        nombres = []
+        vistos = set()
+        for archivo in sorted(os.listdir(self.directorio)):
+            for ext in (self.EXT, self.LEGACY_EXT):
+                if archivo.endswith(ext):
+                    nombre = archivo[:-len(ext)]
+                    if nombre not in vistos:
+                        vistos.add(nombre)
+                        nombres.append(nombre)
+                    break
+        return nombres
+    
+    def listar_titulos(self):
+        """Lista (nombre, titulo) leyendo solo la cabecera de cada archivo."""
+        return [(nombre, self.leer_titulo(nombre)) for nombre in self.listar()]
+    
+    def existe(self, nombre):
+        return os.path.exists(self.ruta(nombre)) or os.path.exists(self._ruta_legacy(nombre))
+    
+    def version(self, nombre):
+        """Identifica el contenido actual (tamaño y fecha de modificación) sin leerlo."""
+        for ruta in (self.ruta(nombre), self._ruta_legacy(nombre)):
+            try:
+                st = os.stat(ruta)
+                return (st.st_size, st.st_mtime_ns)
+            except OSError:
+                continue
+        return None
+    
+    def nombre_libre(self, base):
+        """Devuelve base, o base_1, base_2... si ya existe."""
+        nombre = base
+        sufijo = 1
+        while self.existe(nombre):
+            nombre = f"{base}_{sufijo}"
+            sufijo += 1
+        return nombre
+    
+    def leer_titulo(self, nombre):
+        """Lee solo la cabecera (primera línea) sin cargar los mensajes."""
+        ruta = self.ruta(nombre)
+        if not os.path.exists(ruta):
+            return leer_titulo_historial(self._ruta_legacy(nombre))
+        try:
+            with open(ruta, "r", encoding="utf-8") as f:
+                cabecera = json.loads(f.readline())
+            if isinstance(cabecera, dict) and cabecera.get("tipo") == "cabecera":
+                return cabecera.get("titulo")
+        except Exception:
+            pass
+        return None
+    
+    def crear(self, nombre, titulo=None):
+        self._escribir_atomico(self.ruta(nombre), titulo, [])
+    
+    def leer(self, nombre):
+        """Lee (titulo, mensajes) sin modificar nada en disco.
+
+        A diferencia de cargar() no migra ni repara, así que es seguro usarlo
+        desde otro hilo mientras la interfaz sigue escribiendo.
+        """
+        ruta = self.ruta(nombre)
+        if not os.path.exists(ruta):
+            if os.path.exists(self._ruta_legacy(nombre)):
+                return self._leer_legacy(nombre)
+            return None, []
+        return self._leer_jsonl(ruta)[:2]
+    
+    def _leer_jsonl(self, ruta):
+        titulo = None
+        mensajes = []
+        corrupto = False
+        with open(ruta, "r", encoding="utf-8") as f:
+            for linea in f:
+                linea = linea.strip()
+                if not linea:
+                    continue
+                try:
+                    registro = cargar_json(linea)
+                except ValueError:
+                    corrupto = True
+                    continue
+                if not isinstance(registro, dict):
+                    corrupto = True
+                elif registro.get("tipo") == "cabecera":
+                    titulo = registro.get("titulo")
+                elif "author" in registro and "text" in registro:
+                    mensajes.append(registro)
+        return titulo, mensajes, corrupto
+    
+    def _leer_legacy(self, nombre):
+        with open(self._ruta_legacy(nombre), "r", encoding="utf-8") as f:
+            loaded = json.load(f)
+        titulo = None
+        if isinstance(loaded, dict):
+            titulo = loaded.get("titulo")
+            mensajes = loaded.get("mensajes", [])
+        elif isinstance(loaded, list):
+            mensajes = loaded
+        else:
+            mensajes = []
+        mensajes = [m for m in mensajes if isinstance(m, dict) and "author" in m and "text" in m]
+        return titulo, mensajes
+    
+    def cargar(self, nombre):
+        """Devuelve (titulo, mensajes) y migra el formato .json antiguo si hace falta."""
+        ruta = self.ruta(nombre)
+        if not os.path.exists(ruta):
+            if os.path.exists(self._ruta_legacy(nombre)):
+                return self._migrar(nombre)
+            self.crear(nombre)
+            return None, []
+        
+        titulo, mensajes, corrupto = self._leer_jsonl(ruta)
+        if corrupto:
+            # Una línea a medio escribir (cierre inesperado): se compacta sin ella
+            self._escribir_atomico(ruta, titulo, mensajes)
+        return titulo, mensajes
+    
+    def cargar_ultimos(self, nombre, cantidad):
+        """Devuelve (titulo, inicio, mensajes) con solo los últimos `cantidad` mensajes.
+
+        `inicio` es la posición del primero de ellos en la conversación. Como
+        cargar(), migra el formato antiguo y repara un final de archivo a
+        medio escribir; el resto se lee a través del índice.
+        """
+        ruta = self.ruta(nombre)
+        if not os.path.exists(ruta):
+            self.cargar(nombre)
+        elif not self._termina_en_linea(ruta):
+            self.cargar(nombre)
+            with self._lock_indices:
+                if not self._termina_en_linea(ruta):
+                    # La última línea es un mensaje completo que perdió su salto
+                    # de línea: cargar() no la da por corrupta, pero el índice
+                    # la saltaría mientras leer() y la búsqueda sí la cuentan
+                    with open(ruta, "a", encoding="utf-8") as f:
+                        f.write("\n")
+                        f.flush()
+                        os.fsync(f.fileno())
+        with self._lock_indices:
+            indice = IndiceLineas(ruta, self._es_mensaje)
+            total = indice.actualizar()
+            inicio = max(0, total - cantidad)
+            mensajes = self._parsear_lineas(indice.leer(inicio, total))
+        return self.leer_titulo(nombre), inicio, mensajes
+    
+    def leer_mensajes(self, nombre, inicio, fin):
+        """Mensajes en las posiciones [inicio, fin) de la conversación, sin leer el resto."""
+        ruta = self.ruta(nombre)
+        if not os.path.exists(ruta):
+            return self.leer(nombre)[1][inicio:fin]
+        with self._lock_indices:
+            indice = IndiceLineas(ruta, self._es_mensaje)
+            indice.actualizar()
+            return self._parsear_lineas(indice.leer(inicio, fin))
+    
+    def iterar_hacia_atras(self, nombre, antes_de, pagina=200):
+        """Mensajes anteriores a la posición `antes_de`, del más reciente al más antiguo."""
+        while antes_de > 0:
+            inicio = max(0, antes_de - pagina)
+            yield from reversed(self.leer_mensajes(nombre, inicio, antes_de))
+            antes_de = inicio
+    
+    @staticmethod
+    def _termina_en_linea(ruta):
+        """False si la última línea quedó a medio escribir (cierre inesperado)."""
+        with open(ruta, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell() == 0:
+                return True
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+    
+    @staticmethod
+    def _registro_mensaje(linea):
+        """El mensaje de una línea, o None si no es un registro de mensaje válido."""
+        try:
+            registro = cargar_json(linea)
+        except ValueError:
+            return None
+        if isinstance(registro, dict) and "author" in registro and "text" in registro:
+            return registro
+        return None
+    
+    @classmethod
+    def _es_mensaje(cls, linea):
+        return cls._registro_mensaje(linea) is not None
+    
+    @classmethod
+    def _parsear_lineas(cls, lineas):
+        mensajes = []
+        for linea in lineas:
+            registro = cls._registro_mensaje(linea)
+            if registro is not None:
+                mensajes.append(registro)
+        return mensajes
+    
+    def _migrar(self, nombre):
+        titulo, mensajes = self._leer_legacy(nombre)
+        self._escribir_atomico(self.ruta(nombre), titulo, mensajes)
+        os.remove(self._ruta_legacy(nombre))
+        return titulo, mensajes
+    
+    def agregar_mensaje(self, nombre, msg):
+        """Añade un mensaje al final del archivo y lo sincroniza a disco."""
+        linea = json.dumps(msg, ensure_ascii=False) + "\n"
+        ruta = self.ruta(nombre)
+        if os.path.exists(ruta) and not self._termina_en_linea(ruta):
+            # Tras una línea a medio escribir: se empieza en una línea nueva para
+            # que el mensaje no quede pegado a ella y se pierda al leer
+            linea = "\n" + linea
+        with open(ruta, "a", encoding="utf-8") as f:
+            f.write(linea)
+            f.flush()
+            os.fsync(f.fileno())
+        self._notificar("mensaje", nombre, msg)
+    
+    def actualizar_titulo(self, nombre, titulo):
+        """Reescribe la cabecera con el nuevo título (compacta el archivo)."""
+        _, mensajes = self.cargar(nombre)
+        self._escribir_atomico(self.ruta(nombre), titulo, mensajes)
+        self._notificar("titulo", nombre, titulo)
+    
+    def compactar(self, nombre):
+        """Reescribe la conversación de forma atómica, sin líneas dañadas."""
+        titulo, mensajes = self.cargar(nombre)
+        self._escribir_atomico(self.ruta(nombre), titulo, mensajes)
+    
+    def renombrar(self, nombre, nuevo):
+        if not os.path.exists(self.ruta(nombre)) and os.path.exists(self._ruta_legacy(nombre)):
+            self._migrar(nombre)
+        with self._lock_indices:
+            os.replace(self.ruta(nombre), self.ruta(nuevo))
+            if os.path.exists(self._ruta_indice(nombre)):
+                os.replace(self._ruta_indice(nombre), self._ruta_indice(nuevo))
+        _fsync_directorio(self.directorio)
+        self._notificar("renombrar", nombre, nuevo)
+    
+    def eliminar(self, nombre):
+        for ruta in (self.ruta(nombre), self._ruta_legacy(nombre), self._ruta_indice(nombre)):
+            if os.path.exists(ruta):
+                os.remove(ruta)
+        self._notificar("eliminar", nombre)
+    
+    def _escribir_atomico(self, ruta, titulo, mensajes):
+        tmp = ruta + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            cabecera = {"tipo": "cabecera", "version": self.VERSION, "titulo": titulo}
+            f.write(json.dumps(cabecera, ensure_ascii=False) + "\n")
+            for msg in mensajes:
+                f.write(json.dumps(msg, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        indice = os.path.splitext(ruta)[0] + self.INDICE_EXT
+        with self._lock_indices:
+            os.replace(tmp, ruta)
+            # Las posiciones han cambiado: el índice se rehace en la próxima lectura
+            if os.path.exists(indice):
+                os.remove(indice)
+        _fsync_directorio(os.path.dirname(ruta))
+
+class AlmacenSQLite:
+    """Conversaciones en un único archivo SQLite con índice de texto completo.
+
+    Mismo interfaz que AlmacenJSONL, pero listar, buscar nombres libres y
+    leer títulos son consultas indexadas en lugar de recorrer el directorio,
+    y buscar() usa un índice FTS5 sobre el texto de los mensajes (o LIKE si
+    la versión de SQLite no incluye FTS5). Se activa con
+    "almacenamiento": "sqlite" en settings.json.
+    """
+    NOMBRE_DB = "conversaciones.db"
+    # Claves de mensaje con columna propia; el resto se guarda en "extra" como JSON
+    COLUMNAS = ("author", "text", "fecha_hora")
+    
+    def __init__(self, ruta_db):
+        import sqlite3
+        self.ruta_db = ruta_db
+        self._lock = threading.RLock()
+        self.conn = sqlite3.connect(ruta_db, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA foreign_keys=ON")
+        self.fts = True
+        self._crear_esquema()
+    
+    def _crear_esquema(self):
+        import sqlite3
+        with self._lock, self.conn:
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS conversaciones (
+                    id INTEGER PRIMARY KEY,
+                    nombre TEXT NOT NULL UNIQUE,
+                    titulo TEXT,
+                    creado TEXT NOT NULL,
+                    actualizado TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_conversaciones_actualizado ON conversaciones(actualizado);
+                CREATE INDEX IF NOT EXISTS idx_conversaciones_titulo ON conversaciones(titulo);
+                CREATE TABLE IF NOT EXISTS mensajes (
+                    id INTEGER PRIMARY KEY,
+                    conversacion_id INTEGER NOT NULL REFERENCES conversaciones(id) ON DELETE CASCADE,
+                    author TEXT NOT NULL,
+                    text TEXT NOT NULL,
+                    fecha_hora TEXT,
+                    extra TEXT
+                );
+                CREATE INDEX IF NOT EXISTS idx_mensajes_conversacion ON mensajes(conversacion_id, id);
+            """)
+            try:
+                self.conn.executescript("""
+                    CREATE VIRTUAL TABLE IF NOT EXISTS mensajes_fts
+                        USING fts5(text, content='mensajes', content_rowid='id');
+                    CREATE TRIGGER IF NOT EXISTS mensajes_ai AFTER INSERT ON mensajes BEGIN
+                        INSERT INTO mensajes_fts(rowid, text) VALUES (new.id, new.text);
+                    END;
+                    CREATE TRIGGER IF NOT EXISTS mensajes_ad AFTER DELETE ON mensajes BEGIN
+                        INSERT INTO mensajes_fts(mensajes_fts, rowid, text) VALUES ('delete', old.id, old.text);
+                    END;
+                """)
+            except sqlite3.OperationalError:
+                # SQLite compilado sin FTS5: la búsqueda cae a LIKE
+                self.fts = False
+    
+    @staticmethod
+    def _ahora():
+        return datetime.now().isoformat(timespec="seconds")
+    
+    def _id(self, nombre):
+        fila = self.conn.execute("SELECT id FROM conversaciones WHERE nombre = ?", (nombre,)).fetchone()
+        return fila["id"] if fila else None
+    
+    def listar(self):
+        with self._lock:
+            return [f["nombre"] for f in self.conn.execute("SELECT nombre FROM conversaciones ORDER BY nombre")]
+    
+    def listar_titulos(self):
+        """Lista (nombre, titulo) de todas las conversaciones con una sola consulta."""
+        with self._lock:
+            filas = self.conn.execute("SELECT nombre, titulo FROM conversaciones ORDER BY nombre")
+            return [(f["nombre"], f["titulo"]) for f in filas]
+    
+    def existe(self, nombre):
+        with self._lock:
+            return self._id(nombre) is not None
+    
+    def nombre_libre(self, base):
+        """Devuelve base, o base_1, base_2... consultando el índice de nombres una sola vez."""
+        with self._lock:
+            filas = self.conn.execute(
+                "SELECT nombre FROM conversaciones WHERE nombre = ? OR nombre GLOB ?",
+                (base, base.replace("[", "[[]").replace("*", "[*]").replace("?", "[?]") + "_*"))
+            usados = {f["nombre"] for f in filas}
+        nombre = base
+        sufijo = 1
+        while nombre in usados:
+            nombre = f"{base}_{sufijo}"
+            sufijo += 1
+        return nombre
+    
+    def leer_titulo(self, nombre):
+        with self._lock:
+            fila = self.conn.execute("SELECT titulo FROM conversaciones WHERE nombre = ?", (nombre,)).fetchone()
+        return fila["titulo"] if fila else None
+    
+    def crear(self, nombre, titulo=None):
+        ahora = self._ahora()
+        with self._lock, self.conn:
+            self.conn.execute(
+                "INSERT OR IGNORE INTO conversaciones (nombre, titulo, creado, actualizado) VALUES (?, ?, ?, ?)",
+                (nombre, titulo, ahora, ahora))
+    
+    def _fila_a_mensaje(self, fila):
+        msg = {"author": fila["author"], "text": fila["text"], "fecha_hora": fila["fecha_hora"]}
+        if fila["extra"]:
+            msg.update(cargar_json(fila["extra"]))
+        return msg
+    
+    def cargar(self, nombre):
+        with self._lock:
+            fila = self.conn.execute("SELECT id, titulo FROM conversaciones WHERE nombre = ?", (nombre,)).fetchone()
+            if fila is None:
+                self.crear(nombre)
+                return None, []
+            filas = self.conn.execute(
+                "SELECT author, text, fecha_hora, extra FROM mensajes WHERE conversacion_id = ? ORDER BY id",
+                (fila["id"],)).fetchall()
+        return fila["titulo"], [self._fila_a_mensaje(f) for f in filas]
+    
+    def cargar_ultimos(self, nombre, cantidad):
+        """Devuelve (titulo, inicio, mensajes) con solo los últimos `cantidad` mensajes."""
+        with self._lock:
+            fila = self.conn.execute("SELECT id, titulo FROM conversaciones WHERE nombre = ?", (nombre,)).fetchone()
+            if fila is None:
+                self.crear(nombre)
+                return None, 0, []
+            total = self.conn.execute("SELECT COUNT(*) FROM mensajes WHERE conversacion_id = ?",
+                                      (fila["id"],)).fetchone()[0]
+            filas = self.conn.execute(
+                "SELECT author, text, fecha_hora, extra FROM mensajes WHERE conversacion_id = ? "
+                "ORDER BY id DESC LIMIT ?", (fila["id"], cantidad)).fetchall()
+        filas.reverse()
+        return fila["titulo"], total - len(filas), [self._fila_a_mensaje(f) for f in filas]
+    
+    def leer_mensajes(self, nombre, inicio, fin):
+        """Mensajes en las posiciones [inicio, fin) de la conversación."""
+        inicio = max(0, inicio)
+        if fin <= inicio:
+            return []
+        with self._lock:
+            filas = self.conn.execute(
+                "SELECT author, text, fecha_hora, extra FROM mensajes "
+                "WHERE conversacion_id = (SELECT id FROM conversaciones WHERE nombre = ?) "
+                "ORDER BY id LIMIT ? OFFSET ?", (nombre, fin - inicio, inicio)).fetchall()
+        return [self._fila_a_mensaje(f) for f in filas]
+    
+    def iterar_hacia_atras(self, nombre, antes_de, pagina=200):
+        """Mensajes anteriores a la posición `antes_de`, del más reciente al más antiguo."""
+        while antes_de > 0:
+            inicio = max(0, antes_de - pagina)
+            yield from reversed(self.leer_mensajes(nombre, inicio, antes_de))
+            antes_de = inicio
+    
+    def _insertar_mensajes(self, conv_id, mensajes):
+        filas = []
+        for msg in mensajes:
+            extra = {k: v for k, v in msg.items() if k not in self.COLUMNAS}
+            filas.append((conv_id, msg["author"], msg["text"], msg.get("fecha_hora"),
+                          json.dumps(extra, ensure_ascii=False) if extra else None))
+        self.conn.executemany(
+            "INSERT INTO mensajes (conversacion_id, author, text, fecha_hora, extra) VALUES (?, ?, ?, ?, ?)", filas)
+    
+    def agregar_mensaje(self, nombre, msg):
+        with self._lock, self.conn:
+            conv_id = self._id(nombre)
+            if conv_id is None:
+                self.crear(nombre)
+                conv_id = self._id(nombre)
+            self._insertar_mensajes(conv_id, [msg])
+            self.conn.execute("UPDATE conversaciones SET actualizado = ? WHERE id = ?", (self._ahora(), conv_id))
+    
+    def actualizar_titulo(self, nombre, titulo):
+        with self._lock, self.conn:
+            self.conn.execute("UPDATE conversaciones SET titulo = ?, actualizado = ? WHERE nombre = ?",
+                              (titulo, self._ahora(), nombre))
+    
+    def compactar(self, nombre=None):
+        """Optimiza el índice de texto completo (cada escritura ya es una transacción)."""
+        if self.fts:
+            with self._lock, self.conn:
+                self.conn.execute("INSERT INTO mensajes_fts(mensajes_fts) VALUES ('optimize')")
+    
+    def renombrar(self, nombre, nuevo):
+        with self._lock, self.conn:
+            self.conn.execute("UPDATE conversaciones SET nombre = ? WHERE nombre = ?", (nuevo, nombre))
+    
+    def eliminar(self, nombre):
+        with self._lock, self.conn:
+            self.conn.execute("DELETE FROM conversaciones WHERE nombre = ?", (nombre,))
+    
+    def buscar(self, consulta, limite=50):
+        """Busca mensajes que contengan todos los términos de la consulta.
+
+        Devuelve diccionarios con nombre, titulo, indice (posición del mensaje
+        en la conversación), author y fragmento, ordenados por relevancia.
+        """
+        terminos = consulta.split()
+        if not terminos:
+            return []
+        posicion = ("(SELECT COUNT(*) FROM mensajes m2 "
+                    "WHERE m2.conversacion_id = m.conversacion_id AND m2.id < m.id)")
+        with self._lock:
+            if self.fts:
+                expresion = " ".join('"' + t.replace('"', '""') + '"' for t in terminos)
+                filas = self.conn.execute(f"""
+                    SELECT c.nombre, c.titulo, m.author, {posicion} AS indice,
+                           snippet(mensajes_fts, 0, '[', ']', '…', 12) AS fragmento
+                    FROM mensajes_fts
+                    JOIN mensajes m ON m.id = mensajes_fts.rowid
+                    JOIN conversaciones c ON c.id = m.conversacion_id
+                    WHERE mensajes_fts MATCH ?
+                    ORDER BY rank LIMIT ?""", (expresion, limite)).fetchall()
+            else:
+                condiciones = " AND ".join("m.text LIKE ?" for _ in terminos)
+                filas = self.conn.execute(f"""
+                    SELECT c.nombre, c.titulo, m.author, {posicion} AS indice,
+                           substr(m.text, 1, 120) AS fragmento
+                    FROM mensajes m JOIN conversaciones c ON c.id = m.conversacion_id
+                    WHERE {condiciones}
+                    ORDER BY m.id DESC LIMIT ?""", [f"%{t}%" for t in terminos] + [limite]).fetchall()
+        return [dict(f) for f in filas]
+    
+    def importar_json(self, directorio):
+        """Importa las conversaciones .json/.jsonl de un directorio; devuelve cuántas.
+
+        Los archivos de origen solo se leen: no se migran ni se reparan.
+        """
+        origen = AlmacenJSONL(directorio)
+        importadas = 0
+        for nombre in origen.listar():
+            titulo, mensajes = origen.leer(nombre)
+            destino = self.nombre_libre(nombre)
+            with self._lock, self.conn:
+                ahora = self._ahora()
+                cursor = self.conn.execute(
+                    "INSERT INTO conversaciones (nombre, titulo, creado, actualizado) VALUES (?, ?, ?, ?)",
+                    (destino, titulo, ahora, ahora))
+                self._insertar_mensajes(cursor.lastrowid, mensajes)
+            importadas += 1
+        return importadas
+    
+    def exportar_json(self, directorio):
+        """Exporta todas las conversaciones como archivos de AlmacenJSONL; devuelve cuántas."""
+        destino = AlmacenJSONL(directorio)
+        nombres = self.listar()
+        for nombre in nombres:
+            titulo, mensajes = self.cargar(nombre)
+            destino._escribir_atomico(destino.ruta(nombre), titulo, mensajes)
+        return len(nombres)
+    
+    def cerrar(self):
+        with self._lock:
+            self.conn.close()
+
+def crear_almacen(conversaciones_dir, settings=None):
+    """Crea el almacén de conversaciones configurado en settings.json.
+
+    Con "almacenamiento": "sqlite" usa AlmacenSQLite en conversaciones.db
+    dentro del directorio; la primera vez importa los archivos existentes.
+    """
+    if settings is None:
+        settings = get_settings()
+    if settings.get("almacenamiento") == "sqlite":
+        ruta_db = os.path.join(conversaciones_dir, AlmacenSQLite.NOMBRE_DB)
+        nueva = not os.path.exists(ruta_db)
+        almacen = AlmacenSQLite(ruta_db)
+        if nueva:
+            almacen.importar_json(conversaciones_dir)
+        return almacen
+    return AlmacenJSONL(conversaciones_dir)
@@ -0,0 +1,141 @@
+"""Índice invertido BM25 en memoria para la búsqueda global."""
+import re
+import math
+import heapq
+import threading
+
+# Tabla para quitar acentos sin cambiar la longitud del texto (así las
+# posiciones en el texto normalizado sirven para recortar el fragmento original)
+_SIN_ACENTOS = str.maketrans(
+    "áàâäãåéèêëíìîïóòôöõúùûüñçý",
+    "aaaaaaeeeeiiiiooooouuuuncy")
+_PALABRA_RE = re.compile(r"\w+")
+
+def _normalizar(texto):
+    return texto.lower().translate(_SIN_ACENTOS)
+
+class IndiceBusqueda:
+    """Índice invertido en memoria sobre los mensajes de todas las conversaciones.
+
+    Cada mensaje es un documento identificado por (nombre, indice). Se puede
+    actualizar conversación a conversación o mensaje a mensaje, y buscar()
+    ordena los resultados con BM25. Todas las operaciones están protegidas por
+    un lock porque el índice se construye desde un hilo y se consulta desde la
+    interfaz.
+    """
+    K1 = 1.2
+    B = 0.75
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._postings = {}       # termino -> {doc_id: frecuencia}
+        self._docs = {}           # doc_id -> (longitud, author, texto)
+        self._conversaciones = {} # nombre -> número de mensajes indexados
+        self._titulos = {}
+        self._versiones = {}
+        self._longitud_total = 0
+    
+    def version(self, nombre):
+        with self._lock:
+            return self._versiones.get(nombre)
+    
+    def _quitar_conversacion(self, nombre):
+        for indice in range(self._conversaciones.pop(nombre, 0)):
+            doc_id = (nombre, indice)
+            longitud, _, texto = self._docs.pop(doc_id)
+            self._longitud_total -= longitud
+            for termino in set(_PALABRA_RE.findall(_normalizar(texto))):
+                docs = self._postings.get(termino)
+                if docs is not None:
+                    docs.pop(doc_id, None)
+                    if not docs:
+                        del self._postings[termino]
+        self._titulos.pop(nombre, None)
+        self._versiones.pop(nombre, None)
+    
+    def _agregar(self, nombre, msg):
+        indice = self._conversaciones.get(nombre, 0)
+        doc_id = (nombre, indice)
+        texto = msg.get("text", "")
+        terminos = _PALABRA_RE.findall(_normalizar(texto))
+        for termino in terminos:
+            docs = self._postings.setdefault(termino, {})
+            docs[doc_id] = docs.get(doc_id, 0) + 1
+        self._docs[doc_id] = (len(terminos), msg.get("author", ""), texto)
+        self._longitud_total += len(terminos)
+        self._conversaciones[nombre] = indice + 1
+    
+    def indexar_conversacion(self, nombre, titulo, mensajes, version=None):
+        """(Re)indexa una conversación completa."""
+        with self._lock:
+            self._quitar_conversacion(nombre)
+            self._conversaciones[nombre] = 0
+            for msg in mensajes:
+                self._agregar(nombre, msg)
+            self._titulos[nombre] = titulo
+            self._versiones[nombre] = version
+    
+    def agregar_mensaje(self, nombre, msg):
+        """Añade al índice un mensaje nuevo al final de una conversación."""
+        with self._lock:
+            self._agregar(nombre, msg)
+            # La versión en disco ya no coincide; el próximo escaneo no debe saltarla
+            self._versiones[nombre] = None
+    
+    def actualizar_titulo(self, nombre, titulo):
+        with self._lock:
+            self._titulos[nombre] = titulo
+    
+    def eliminar(self, nombre):
+        with self._lock:
+            self._quitar_conversacion(nombre)
+    
+    def nombres(self):
+        with self._lock:
+            return list(self._conversaciones)
+    
+    def buscar(self, consulta, limite=50):
+        """Devuelve los mensajes más relevantes para la consulta.
+
+        Mismo formato que AlmacenSQLite.buscar(): diccionarios con nombre,
+        titulo, indice, author y fragmento.
+        """
+        terminos = _PALABRA_RE.findall(_normalizar(consulta))
+        if not terminos:
+            return []
+        with self._lock:
+            total = len(self._docs)
+            if not total:
+                return []
+            media = self._longitud_total / total or 1
+            puntuaciones = {}
+            for termino in set(terminos):
+                docs = self._postings.get(termino)
+                if not docs:
+                    continue
+                idf = math.log(1 + (total - len(docs) + 0.5) / (len(docs) + 0.5))
+                for doc_id, tf in docs.items():
+                    longitud = self._docs[doc_id][0]
+                    norma = tf + self.K1 * (1 - self.B + self.B * longitud / media)
+                    puntuaciones[doc_id] = puntuaciones.get(doc_id, 0.0) + idf * tf * (self.K1 + 1) / norma
+            mejores = heapq.nlargest(limite, puntuaciones.items(), key=lambda item: item[1])
+            resultados = []
+            for (nombre, indice), puntuacion in mejores:
+                _, author, texto = self._docs[(nombre, indice)]
+                resultados.append({
+                    "nombre": nombre, "titulo": self._titulos.get(nombre), "indice": indice,
+                    "author": author, "fragmento": self._fragmento(texto, terminos),
+                    "puntuacion": puntuacion,
+                })
+        return resultados
+    
+    @staticmethod
+    def _fragmento(texto, terminos, contexto=60):
+        normalizado = _normalizar(texto)
+        posiciones = [normalizado.find(t) for t in terminos]
+        posiciones = [p for p in posiciones if p >= 0]
+        inicio = min(posiciones) if posiciones else 0
+        desde = max(0, inicio - contexto)
+        hasta = min(len(texto), inicio + contexto)
+        fragmento = " ".join(texto[desde:hasta].split())
+        return ("…" if desde > 0 else "") + fragmento + ("…" if hasta < len(texto) else "")
@@ -0,0 +1,167 @@
+"""Caché en disco de respuestas para peticiones idénticas."""
+import os
+import json
+import time
+import asyncio
+import threading
+
+from .ajustes import SETTINGS_PATH, get_settings
+
+class CacheRespuestas:
+    """Caché en disco (SQLite) de respuestas para peticiones idénticas.
+
+    La clave es un hash de (proveedor, URL, modelo, mensajes normalizados,
+    parámetros), así que repetir una pregunta con el mismo contexto no vuelve
+    a la red. Las entradas caducan a las "ttl_horas" y, si se superan
+    "max_entradas" o "max_mb", se descartan las usadas hace más tiempo (LRU).
+    Se activa con "cache": {"activa": true} en settings.json.
+    """
+    NOMBRE_DB = "cache_respuestas.db"
+
+    def __init__(self, ruta_db, max_entradas=1000, max_mb=50, ttl_horas=24 * 7):
+        import sqlite3
+        self.ruta_db = ruta_db
+        self.max_entradas = max_entradas
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.ttl = ttl_horas * 3600
+        self.aciertos = 0
+        self.fallos = 0
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(ruta_db, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS respuestas (
+                    clave TEXT PRIMARY KEY,
+                    respuesta TEXT NOT NULL,
+                    bytes INTEGER NOT NULL,
+                    creado REAL NOT NULL,
+                    usado REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_respuestas_usado ON respuestas(usado);
+            """)
+
+    @staticmethod
+    def clave(proveedor, mensajes, **parametros):
+        """Hash estable de la petición.
+
+        Solo se normalizan los saltos de línea y los espacios de los extremos:
+        los de dentro (la sangría de un código, por ejemplo) cambian la clave.
+        """
+        import hashlib
+        datos = {
+            "proveedor": proveedor.nombre,
+            "base_url": proveedor.base_url,
+            "modelo": proveedor.modelo,
+            "mensajes": [[m["role"], m["content"].replace("\r\n", "\n").strip()] for m in mensajes],
+            "parametros": parametros,
+        }
+        serializado = json.dumps(datos, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(serializado.encode("utf-8")).hexdigest()
+
+    def obtener(self, clave):
+        """Devuelve la respuesta guardada (y la marca como usada) o None."""
+        ahora = time.time()
+        with self._lock, self.conn:
+            fila = self.conn.execute("SELECT respuesta, creado FROM respuestas WHERE clave = ?", (clave,)).fetchone()
+            if fila is not None and ahora - fila[1] > self.ttl:
+                self.conn.execute("DELETE FROM respuestas WHERE clave = ?", (clave,))
+                fila = None
+            if fila is None:
+                self.fallos += 1
+                return None
+            self.conn.execute("UPDATE respuestas SET usado = ? WHERE clave = ?", (ahora, clave))
+            self.aciertos += 1
+            return fila[0]
+
+    def guardar(self, clave, respuesta):
+        ahora = time.time()
+        tamano = len(respuesta.encode("utf-8"))
+        if tamano > self.max_bytes:
+            return
+        with self._lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO respuestas (clave, respuesta, bytes, creado, usado) VALUES (?, ?, ?, ?, ?)",
+                (clave, respuesta, tamano, ahora, ahora)
+            )
+            self._desalojar(ahora)
+
+    def _desalojar(self, ahora):
+        """Quita lo caducado y, si aún sobra, lo menos usado recientemente."""
+        self.conn.execute("DELETE FROM respuestas WHERE creado < ?", (ahora - self.ttl,))
+        entradas, total = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM respuestas").fetchone()
+        if entradas <= self.max_entradas and total <= self.max_bytes:
+            return
+        sobrantes = max(0, entradas - self.max_entradas)
+        exceso = total - self.max_bytes
+        for clave, tamano in self.conn.execute("SELECT clave, bytes FROM respuestas ORDER BY usado").fetchall():
+            if sobrantes <= 0 and exceso <= 0:
+                break
+            self.conn.execute("DELETE FROM respuestas WHERE clave = ?", (clave,))
+            sobrantes -= 1
+            exceso -= tamano
+
+    def estadisticas(self):
+        with self._lock:
+            entradas, total = self.conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM respuestas"
+            ).fetchone()
+        consultas = self.aciertos + self.fallos
+        return {
+            "aciertos": self.aciertos,
+            "fallos": self.fallos,
+            "tasa_aciertos": self.aciertos / consultas if consultas else 0.0,
+            "entradas": entradas,
+            "bytes": total,
+        }
+
+    def vaciar(self):
+        with self._lock, self.conn:
+            self.conn.execute("DELETE FROM respuestas")
+
+    def cerrar(self):
+        with self._lock:
+            self.conn.close()
+
+_CACHE = None
+_CACHE_LOCK = threading.Lock()
+
+def obtener_cache(settings=None):
+    """Devuelve la caché de respuestas del proceso, o None si no está activada."""
+    global _CACHE
+    settings = settings if settings is not None else get_settings()
+    conf = settings.get("cache", {})
+    if not conf.get("activa"):
+        return None
+    with _CACHE_LOCK:
+        if _CACHE is None:
+            ruta = conf.get("ruta") or os.path.join(os.path.dirname(SETTINGS_PATH), CacheRespuestas.NOMBRE_DB)
+            try:
+                _CACHE = CacheRespuestas(ruta, conf.get("max_entradas", 1000), conf.get("max_mb", 50),
+                                         conf.get("ttl_horas", 24 * 7))
+            except Exception as e:
+                print(f"No se pudo abrir la caché de respuestas: {e}")
+                return None
+        return _CACHE
+
+def cerrar_cache():
+    global _CACHE
+    with _CACHE_LOCK:
+        cache, _CACHE = _CACHE, None
+    if cache is not None:
+        cache.cerrar()
+
+async def reproducir_respuesta(texto, callback, instantaneo=True, tamano=32, intervalo=0.01):
+    """Pasa una respuesta guardada por el mismo callback que un stream real.
+
+    Con instantaneo=False se reparte en trozos con una pausa breve, para que
+    la interfaz la muestre como si llegara del modelo.
+    """
+    if instantaneo:
+        if texto:
+            callback(texto)
+        return
+    for i in range(0, len(texto), tamano):
+        callback(texto[i:i + tamano])
+        await asyncio.sleep(intervalo)
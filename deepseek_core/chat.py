@@ -0,0 +1,282 @@
+"""Contexto de una conversación con el modelo y envío en streaming."""
+import asyncio
+import threading
+import itertools
+
+from .ajustes import get_settings
+from .cache import obtener_cache, reproducir_respuesta
+from .contexto import GestorContexto
+from .metricas import REGISTRO_METRICAS, MetricasPeticion, metricas_actual
+from .proveedores import obtener_proveedor
+from .red import CONTADORES_RED, RespuestaIncompleta
+
+class DeepSeekChat:
+    """Contexto de una conversación con cualquier proveedor compatible con OpenAI.
+
+    Las peticiones son corrutinas que se ejecutan en el bucle del núcleo
+    asíncrono (ver red.PlanificadorPeticiones).
+    """
+    def __init__(self, proveedor, contexto=None, cache=None, reproducir_instantaneo=True):
+        self.proveedor = proveedor
+        self.model = proveedor.modelo
+        # Caché de respuestas opcional (ver CacheRespuestas)
+        self.cache = cache
+        self.reproducir_instantaneo = reproducir_instantaneo
+        self.messages = [{"role": "system", "content": "Eres un asistente útil y expresivo."}]
+        self.contexto = contexto if contexto is not None else GestorContexto()
+        # Estadísticas de tokens de la última petición (las muestra la interfaz)
+        self.ultimas_estadisticas = {}
+        # Tiempos de la última petición (ver metricas.MetricasPeticion)
+        self.ultimas_metricas = {}
+        self.id_metricas = None
+        # Historial que falta cargar en el contexto (ver programar_historial)
+        self._historial_pendiente = None
+    
+    def cargar_historial(self, history, anteriores=()):
+        """Reconstruye el contexto del modelo a partir del historial guardado de un chat.
+
+        Solo se recuperan los mensajes más recientes que caben en el presupuesto
+        de tokens (el doble con la estrategia "resumen", para que haya algo que
+        resumir), así que reabrir un chat muy largo no infla cada petición.
+        Si `history` es solo el final de la conversación, `anteriores` da los
+        mensajes previos del más reciente al más antiguo (por ejemplo
+        almacen.iterar_hacia_atras); solo se consumen hasta llenar el presupuesto.
+        """
+        self._historial_pendiente = None
+        self._aplicar_historial(self._recuperar_historial(history, anteriores))
+    
+    def programar_historial(self, history, leer_anteriores=tuple):
+        """Como cargar_historial, pero el contexto se reconstruye al empezar la próxima petición.
+
+        La lectura de los mensajes anteriores se hace en un hilo aparte, así que
+        la interfaz puede llamarlo sin bloquearse. `leer_anteriores` es una
+        función sin argumentos que devuelve esos mensajes (se llama en ese hilo).
+        """
+        self._historial_pendiente = (list(history), leer_anteriores)
+    
+    async def _rehidratar_pendiente(self):
+        pendiente = self._historial_pendiente
+        if pendiente is None:
+            return
+        history, leer_anteriores = pendiente
+        recuperados = await asyncio.to_thread(lambda: self._recuperar_historial(history, leer_anteriores()))
+        # Si se canceló a medias otra petición pudo aplicarlo ya
+        if self._historial_pendiente is pendiente:
+            self._historial_pendiente = None
+            self._aplicar_historial(recuperados)
+    
+    def _recuperar_historial(self, history, anteriores):
+        """Mensajes del historial que caben en el presupuesto, en orden cronológico."""
+        limite = self.contexto.presupuesto_tokens - self.contexto.reserva_respuesta
+        if self.contexto.estrategia == "resumen":
+            limite *= 2
+        recuperados = []
+        total = 0
+        for msg in itertools.chain(reversed(history), anteriores):
+            author = msg.get("author")
+            if author == "Error":
+                continue
+            mensaje = {"role": "user" if author == "Tú" else "assistant", "content": msg.get("text", "")}
+            total += self.contexto.tokens_mensaje(mensaje)
+            if total > limite and recuperados:
+                break
+            recuperados.append(mensaje)
+        recuperados.reverse()
+        return recuperados
+    
+    def _aplicar_historial(self, recuperados):
+        self.messages = self.messages[:1] + recuperados
+        self.contexto.resumen = None
+        self.contexto.resumidos = 0
+    
+    async def _preparar_mensajes(self):
+        """Aplica el presupuesto de tokens; resume lo que queda fuera si la estrategia lo pide."""
+        enviar, estadisticas = self.contexto.preparar(self.messages)
+        pendientes = self.contexto.pendientes_de_resumir(self.messages, estadisticas["omitidos"])
+        if pendientes:
+            try:
+                self.contexto.resumen = await self._resumir(pendientes)
+                self.contexto.resumidos = estadisticas["omitidos"]
+                enviar, estadisticas = self.contexto.preparar(self.messages)
+            except Exception as e:
+                # Sin resumen se sigue con la ventana deslizante
+                print(f"No se pudo resumir el contexto: {e}")
+        return enviar, estadisticas
+    
+    async def _resumir(self, mensajes):
+        """Pide al modelo un resumen breve del resumen anterior más los mensajes dados."""
+        transcripcion = "\n".join(f"{m['role']}: {m['content']}" for m in mensajes)
+        if self.contexto.resumen:
+            transcripcion = f"Resumen previo: {self.contexto.resumen}\n{transcripcion}"
+        return await self.proveedor.completar(
+            [
+                {"role": "system", "content": "Resume la conversación en pocas frases, conservando datos, "
+                                              "decisiones y preferencias del usuario."},
+                {"role": "user", "content": transcripcion},
+            ],
+            max_tokens=512,
+        )
+    
+    async def stream_chat(self, user_text, callback, **parametros):
+        """Envía mensaje y recibe respuesta en streaming, llamando a callback con cada chunk.
+
+        Los `parametros` de la API (max_tokens, temperature...) se envían al
+        proveedor y forman parte de la clave de caché. Deja las métricas de la
+        petición (cola, conexión, primer token, tokens/s...) en
+        ultimas_metricas y en REGISTRO_METRICAS.
+        """
+        metricas = metricas_actual() or MetricasPeticion(self.proveedor.nombre, self.proveedor.modelo)
+        
+        def emitir(texto):
+            metricas.marcar_trozo()
+            callback(texto)
+        
+        try:
+            await self._rehidratar_pendiente()
+            self.messages.append({"role": "user", "content": user_text})
+            reply_accum, estadisticas = await self._recibir(emitir, metricas, parametros)
+        except BaseException as e:
+            # CancelledError no hereda de Exception: las peticiones detenidas también se registran
+            if isinstance(e, Exception):
+                metricas.marcar_fin(e)
+            else:
+                metricas.marcar_fin(cancelada=True)
+            self._registrar_metricas(metricas)
+            raise
+        metricas.marcar_fin()
+        metricas.prompt_tokens = estadisticas.get("prompt_tokens")
+        metricas.completion_tokens = estadisticas.get("completion_tokens")
+        if metricas.completion_tokens is None:
+            metricas.tokens_estimados = self.contexto.contar_tokens(reply_accum)
+        self._registrar_metricas(metricas)
+        self.ultimas_estadisticas = estadisticas
+        return reply_accum
+    
+    def _registrar_metricas(self, metricas):
+        registro = REGISTRO_METRICAS.registrar(metricas)
+        # El id solo sirve para completar el registro después (ver RegistroMetricas.anotar)
+        self.id_metricas = registro.pop("id")
+        self.ultimas_metricas = registro
+    
+    async def _recibir(self, callback, metricas, parametros):
+        """Obtiene la respuesta (de la caché o del proveedor, con reintentos); devuelve (texto, estadísticas)."""
+        enviar, estadisticas = await self._preparar_mensajes()
+        
+        clave = None
+        if self.cache is not None:
+            clave = self.cache.clave(self.proveedor, enviar, **parametros)
+            guardada = self.cache.obtener(clave)
+            if guardada is not None:
+                CONTADORES_RED.incrementar("cache_aciertos")
+                metricas.cache = True
+                await reproducir_respuesta(guardada, callback, self.reproducir_instantaneo)
+                self.messages.append({"role": "assistant", "content": guardada})
+                estadisticas["cache"] = True
+                return guardada, estadisticas
+            CONTADORES_RED.incrementar("cache_fallos")
+        
+        reply_accum = ""
+        politica = self.proveedor.reintentos
+        intento = 0
+        while True:
+            try:
+                stream = await self.proveedor.stream(enviar, prefijo=reply_accum or None, **parametros)
+                finish_reason = None
+                try:
+                    async for chunk in stream:
+                        # El último chunk solo trae el uso de tokens, sin choices
+                        if getattr(chunk, "usage", None):
+                            estadisticas["prompt_tokens"] = chunk.usage.prompt_tokens
+                            estadisticas["completion_tokens"] = chunk.usage.completion_tokens
+                        if not chunk.choices:
+                            continue
+                        delta = chunk.choices[0].delta
+                        if delta and delta.content:
+                            reply_accum += delta.content
+                            callback(delta.content)
+                        if chunk.choices[0].finish_reason:
+                            finish_reason = chunk.choices[0].finish_reason
+                    if finish_reason is None:
+                        # Cierre limpio a mitad de respuesta: se trata como un corte, no
+                        # como una respuesta completa (ni se guarda en caché)
+                        raise RespuestaIncompleta(f"La respuesta se cortó tras {len(reply_accum)} caracteres")
+                    estadisticas["finish_reason"] = finish_reason
+                finally:
+                    # Si la petición se cancela, cerrar la respuesta corta la conexión
+                    # en el momento en lugar de seguir recibiendo (y pagando) tokens
+                    if hasattr(stream, "close"):
+                        await stream.close()
+                break
+            except Exception as e:
+                # Con parte de la respuesta ya mostrada solo se reintenta si se puede continuar el prefijo
+                reanudable = not reply_accum or self.proveedor.soporta_prefijo
+                if not reanudable or intento >= politica.maximo or not politica.reintentable(e):
+                    CONTADORES_RED.incrementar("errores")
+                    raise
+                CONTADORES_RED.incrementar("reintentos")
+                metricas.reintentos += 1
+                if reply_accum:
+                    CONTADORES_RED.incrementar("reanudadas")
+                await asyncio.sleep(politica.espera(intento, e))
+                intento += 1
+        self.messages.append({"role": "assistant", "content": reply_accum})
+        if clave is not None and reply_accum:
+            try:
+                self.cache.guardar(clave, reply_accum)
+            except Exception as e:
+                print(f"No se pudo guardar la respuesta en caché: {e}")
+        
+        if "prompt_tokens" in estadisticas:
+            self.contexto.calibrar(estadisticas["tokens_estimados"], estadisticas["prompt_tokens"])
+        return reply_accum, estadisticas
+    
+    def describir_estadisticas(self):
+        """Texto corto con el uso de tokens de la última petición."""
+        est = self.ultimas_estadisticas
+        if not est:
+            return ""
+        if est.get("cache"):
+            return f"Respuesta desde caché · {est['mensajes_enviados']} mensajes"
+        prompt = est.get("prompt_tokens", est["tokens_estimados"])
+        texto = f"Tokens: {prompt}/{est['presupuesto']} de contexto"
+        if "completion_tokens" in est:
+            texto += f", {est['completion_tokens']} de respuesta"
+        texto += f" · {est['mensajes_enviados']} mensajes enviados"
+        if est["omitidos"]:
+            texto += f", {est['omitidos']} fuera de contexto"
+            if est["resumidos"]:
+                texto += " (resumidos)"
+        return texto
+
+def crear_bot(ia, api_keys):
+    """Crea el contexto de modelo para una conversación según el proveedor elegido.
+
+    Todos los proveedores hablan la API de OpenAI, así que comparten
+    DeepSeekChat (streaming, historial y presupuesto de contexto).
+    """
+    settings = get_settings()
+    return DeepSeekChat(obtener_proveedor(ia, api_keys, settings), GestorContexto.desde_ajustes(settings),
+                        obtener_cache(settings), settings.get("cache", {}).get("reproducir_instantaneo", True))
+
+class ChunkBuffer:
+    """Acumula los fragmentos del stream de forma segura entre hilos.
+
+    El hilo de trabajo añade fragmentos con push() y la interfaz los recoge
+    todos juntos con drain() a una frecuencia acotada, en lugar de recibir
+    una señal por cada token.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._parts = []
+
+    def push(self, text):
+        with self._lock:
+            self._parts.append(text)
+
+    def drain(self):
+        """Devuelve y vacía todo el texto pendiente ("" si no hay nada)."""
+        with self._lock:
+            if not self._parts:
+                return ""
+            parts, self._parts = self._parts, []
+        return "".join(parts)
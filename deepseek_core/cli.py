@@ -0,0 +1,212 @@
+"""Línea de comandos sin interfaz gráfica: python -m deepseek_core chat|ask|batch|serve."""
+import sys
+import argparse
+from datetime import datetime
+
+from .ajustes import VARIABLES_KEY, get_settings, obtener_api_keys
+from .almacen import crear_almacen
+from .cache import cerrar_cache
+from .chat import crear_bot
+from .lotes import EjecutorLotes, ids_completados, leer_peticiones
+from .proveedores import PROVEEDORES
+from .red import cerrar_clientes, obtener_planificador
+
+def _fecha_hora():
+    return datetime.now().strftime("%d/%m/%y %H:%M:%S")
+
+def _crear_bot(args, settings):
+    """Crea el bot de la IA pedida (o la seleccionada en settings.json)."""
+    ia = args.ia or settings.get("ia_seleccionada") or "Deepseek"
+    if ia not in PROVEEDORES:
+        raise SystemExit(f"IA desconocida: {ia} (disponibles: {', '.join(PROVEEDORES)})")
+    api_keys = obtener_api_keys(settings)
+    if PROVEEDORES[ia].requiere_key and not api_keys.get(ia):
+        variable = VARIABLES_KEY.get(ia)
+        pista = f" o en la variable {variable}" if variable else ""
+        raise SystemExit(f"Falta la API Key de {ia}: guárdela en settings.json{pista}.")
+    bot = crear_bot(ia, api_keys)
+    if args.modelo:
+        bot.proveedor.modelo = bot.model = args.modelo
+    return bot
+
+def _escribir(fragmento):
+    sys.stdout.write(fragmento)
+    sys.stdout.flush()
+
+def enviar(bot, texto, callback=None):
+    """Envía texto por el núcleo asíncrono y espera la respuesta completa.
+
+    Ctrl+C cancela la petición (y corta el stream) antes de propagarse.
+    """
+    futuro = obtener_planificador().enviar(bot.proveedor, bot.stream_chat(texto, callback or (lambda _: None)))
+    try:
+        return futuro.result()
+    except KeyboardInterrupt:
+        futuro.cancel()
+        raise
+
+def cmd_ask(args, settings):
+    texto = " ".join(args.texto) if args.texto else sys.stdin.read()
+    if not texto.strip():
+        print("No hay nada que preguntar.", file=sys.stderr)
+        return 1
+    bot = _crear_bot(args, settings)
+    enviar(bot, texto.strip(), _escribir)
+    print()
+    return 0
+
+def cmd_chat(args, settings):
+    bot = _crear_bot(args, settings)
+    almacen = None
+    if args.conversacion:
+        directorio = args.dir or settings.get("conversaciones_dir")
+        if not directorio:
+            print("No hay carpeta de conversaciones: indíquela con --dir.", file=sys.stderr)
+            return 1
+        almacen = crear_almacen(directorio, settings)
+        if almacen.existe(args.conversacion):
+            # Solo se lee lo que cabe en el contexto, no la conversación entera
+            _, inicio, mensajes = almacen.cargar_ultimos(args.conversacion, 200)
+            bot.cargar_historial(mensajes, almacen.iterar_hacia_atras(args.conversacion, inicio))
+            print(f"Conversación {args.conversacion}: {inicio + len(mensajes)} mensajes.")
+        else:
+            almacen.crear(args.conversacion)
+    print("Escriba /salir o pulse Ctrl+D para terminar; Ctrl+C detiene una respuesta.")
+    try:
+        while True:
+            try:
+                texto = input("Tú> ").strip()
+            except EOFError:
+                print()
+                break
+            if not texto:
+                continue
+            if texto == "/salir":
+                break
+            if almacen is not None:
+                almacen.agregar_mensaje(args.conversacion, {"author": "Tú", "text": texto, "fecha_hora": _fecha_hora()})
+            recibido = []
+            mensaje = {"author": bot.proveedor.autor, "fecha_hora": None}
+            sys.stdout.write(f"{bot.proveedor.autor}> ")
+            try:
+                mensaje["text"] = enviar(bot, texto, lambda c: (recibido.append(c), _escribir(c)))
+            except KeyboardInterrupt:
+                # Igual que el botón Detener: se guarda lo recibido como respuesta truncada
+                print(" [interrumpida]")
+                mensaje["text"] = "".join(recibido)
+                mensaje["truncado"] = True
+                if almacen is not None:
+                    _, inicio, mensajes = almacen.cargar_ultimos(args.conversacion, 200)
+                    bot.cargar_historial(mensajes + ([mensaje] if mensaje["text"] else []),
+                                         almacen.iterar_hacia_atras(args.conversacion, inicio))
+            except Exception as e:
+                print(f"\nError: {e}", file=sys.stderr)
+                continue
+            else:
+                print()
+                mensaje["metricas"] = bot.ultimas_metricas
+            mensaje["fecha_hora"] = _fecha_hora()
+            if almacen is not None and mensaje["text"]:
+                almacen.agregar_mensaje(args.conversacion, mensaje)
+    finally:
+        if almacen is not None and hasattr(almacen, "cerrar"):
+            almacen.cerrar()
+    return 0
+
+def cmd_batch(args, settings):
+    sistema = args.sistema
+    if sistema and sistema.startswith("@"):
+        with open(sistema[1:], "r", encoding="utf-8") as f:
+            sistema = f.read()
+    
+    def nuevo_bot():
+        bot = _crear_bot(args, settings)
+        if args.concurrencia:
+            bot.proveedor.concurrencia = args.concurrencia
+        if args.por_minuto:
+            bot.proveedor.peticiones_por_minuto = args.por_minuto
+        return bot
+    
+    concurrencia = args.concurrencia or nuevo_bot().proveedor.concurrencia
+    omitir = set()
+    if args.reanudar and args.salida not in (None, "-"):
+        omitir = ids_completados(args.salida)
+    
+    def progreso(resumen):
+        hechas = resumen["completadas"] + resumen["errores"]
+        sys.stderr.write(f"\r{hechas} hechas, {resumen['errores']} con error")
+        sys.stderr.flush()
+    
+    ejecutor = EjecutorLotes(nuevo_bot, concurrencia, sistema, progreso if sys.stderr.isatty() else None)
+    if args.salida in (None, "-"):
+        salida = sys.stdout
+    else:
+        salida = open(args.salida, "a" if args.reanudar else "w", encoding="utf-8")
+    try:
+        if args.entrada == "-":
+            peticiones = leer_peticiones("-", sys.stdin)
+        else:
+            peticiones = leer_peticiones(args.entrada)
+        resumen = ejecutor.ejecutar(peticiones, salida, omitir)
+    finally:
+        if salida is not sys.stdout:
+            salida.close()
+        if ejecutor.resumen:
+            r = ejecutor.resumen
+            print(file=sys.stderr)
+            print(f"Completadas: {r['completadas']} · Errores: {r['errores']} · Omitidas: {r['omitidas']} · "
+                  f"{r['segundos']} s · {r['peticiones_por_segundo']} peticiones/s", file=sys.stderr)
+            print(f"Tokens: {r['prompt_tokens']} de prompt, {r['completion_tokens']} de respuesta "
+                  f"({r['tokens_por_segundo']} tokens/s)", file=sys.stderr)
+    return 1 if resumen["errores"] else 0
+
+def cmd_serve(args, settings):
+    from .servidor import servir
+    servir(args.host, args.puerto, settings, args.dir)
+    return 0
+
+def crear_parser():
+    parser = argparse.ArgumentParser(prog="python -m deepseek_core", description="DeepSeek Chat sin interfaz gráfica.")
+    comun = argparse.ArgumentParser(add_help=False)
+    comun.add_argument("--ia", help=f"proveedor ({', '.join(PROVEEDORES)}); por defecto el de settings.json")
+    comun.add_argument("--modelo", help="modelo a usar en lugar del configurado")
+    sub = parser.add_subparsers(dest="comando", required=True)
+    
+    ask = sub.add_parser("ask", parents=[comun], help="una pregunta suelta (o la entrada estándar)")
+    ask.add_argument("texto", nargs="*")
+    ask.set_defaults(funcion=cmd_ask)
+    
+    chat = sub.add_parser("chat", parents=[comun], help="conversación interactiva")
+    chat.add_argument("--conversacion", help="nombre de la conversación guardada que se continúa o crea")
+    chat.add_argument("--dir", help="carpeta de conversaciones (por defecto la de settings.json)")
+    chat.set_defaults(funcion=cmd_chat)
+    
+    batch = sub.add_parser("batch", parents=[comun], help="procesa un archivo de peticiones en paralelo")
+    batch.add_argument("entrada", help="JSON Lines con \"prompt\" (e \"id\"), CSV con columnas id,prompt "
+                                       "o una petición por línea (- = stdin)")
+    batch.add_argument("--salida", help="archivo JSON Lines de resultados (por defecto stdout)")
+    batch.add_argument("--concurrencia", type=int, help="peticiones simultáneas (por defecto la del proveedor)")
+    batch.add_argument("--por-minuto", type=int, help="límite de peticiones por minuto")
+    batch.add_argument("--sistema", help="mensaje de sistema para todas las peticiones (@archivo para leerlo)")
+    batch.add_argument("--reanudar", action="store_true",
+                       help="añade a --salida saltando los ids que ya tienen respuesta")
+    batch.set_defaults(funcion=cmd_batch)
+    
+    serve = sub.add_parser("serve", help="pasarela HTTP local compatible con la API de OpenAI")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--puerto", type=int, default=8000)
+    serve.add_argument("--dir", help="carpeta de conversaciones (por defecto la de settings.json)")
+    serve.set_defaults(funcion=cmd_serve)
+    return parser
+
+def main(argv=None):
+    args = crear_parser().parse_args(argv)
+    settings = get_settings()
+    try:
+        return args.funcion(args, settings)
+    except KeyboardInterrupt:
+        print(file=sys.stderr)
+        return 130
+    finally:
+        cerrar_clientes()
+        cerrar_cache()
@@ -0,0 +1,121 @@
+"""Presupuesto de tokens del prompt y estrategias de recorte."""
+
+class GestorContexto:
+    """Mantiene el prompt enviado al modelo dentro de un presupuesto de tokens.
+
+    El mensaje de sistema siempre se envía. Del resto se elige según la
+    estrategia:
+      - "ventana": los mensajes más recientes que quepan en el presupuesto.
+      - "ultimos_turnos": como mucho los últimos N turnos (pregunta + respuesta),
+        y además dentro del presupuesto.
+      - "resumen": como "ventana", pero lo que queda fuera se sustituye por un
+        resumen que genera DeepSeekChat con el propio modelo.
+    Los tokens se cuentan con tiktoken si está instalado y, si no, con una
+    estimación por caracteres que se calibra con el uso real que devuelve la API.
+    """
+    ESTRATEGIAS = ("ventana", "ultimos_turnos", "resumen")
+    # Tokens extra por mensaje (rol y separadores del formato de chat)
+    TOKENS_POR_MENSAJE = 4
+    
+    def __init__(self, presupuesto_tokens=24000, estrategia="ventana", ultimos_turnos=10, reserva_respuesta=4096):
+        self.presupuesto_tokens = presupuesto_tokens
+        self.estrategia = estrategia if estrategia in self.ESTRATEGIAS else "ventana"
+        self.ultimos_turnos = ultimos_turnos
+        self.reserva_respuesta = reserva_respuesta
+        # Estado de la estrategia "resumen": texto y cuántos mensajes cubre
+        self.resumen = None
+        self.resumidos = 0
+        # Factor de calibración de la estimación frente a los tokens reales
+        self.factor = 1.0
+        self._cache_tokens = {}
+        self._codificador = None
+        try:
+            import tiktoken
+            self._codificador = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            pass
+    
+    @classmethod
+    def desde_ajustes(cls, settings):
+        """Crea el gestor con la sección "contexto" de settings.json."""
+        conf = settings.get("contexto", {})
+        return cls(
+            presupuesto_tokens=conf.get("presupuesto_tokens", 24000),
+            estrategia=conf.get("estrategia", "ventana"),
+            ultimos_turnos=conf.get("ultimos_turnos", 10),
+            reserva_respuesta=conf.get("reserva_respuesta", 4096),
+        )
+    
+    def _tokens_brutos(self, texto):
+        if self._codificador is not None:
+            return len(self._codificador.encode(texto, disallowed_special=()))
+        # Estimación: ~4 caracteres por token en texto latino, ~1 por carácter en CJK
+        no_ascii = sum(1 for c in texto if ord(c) > 0x2E7F)
+        return int((len(texto) - no_ascii) / 4 + no_ascii) + 1
+    
+    def contar_tokens(self, texto):
+        tokens = self._cache_tokens.get(texto)
+        if tokens is None:
+            if len(self._cache_tokens) > 5000:
+                self._cache_tokens.clear()
+            tokens = self._tokens_brutos(texto)
+            self._cache_tokens[texto] = tokens
+        return int(tokens * self.factor) + 1
+    
+    def tokens_mensaje(self, msg):
+        return self.contar_tokens(msg.get("content") or "") + self.TOKENS_POR_MENSAJE
+    
+    def calibrar(self, estimados, reales):
+        """Ajusta la estimación con los prompt_tokens reales de una petición."""
+        if self._codificador is None and estimados > 0 and reales:
+            # Media móvil para no oscilar con una sola petición atípica
+            self.factor = max(0.3, min(3.0, 0.7 * self.factor + 0.3 * self.factor * reales / estimados))
+    
+    def _mensaje_resumen(self):
+        return {"role": "system", "content": f"Resumen de la conversación anterior: {self.resumen}"}
+    
+    def preparar(self, mensajes):
+        """Devuelve (mensajes a enviar, estadísticas) respetando el presupuesto.
+
+        En las estadísticas, "omitidos" es el número de mensajes (sin contar el
+        de sistema) que no se envían literalmente.
+        """
+        sistema = mensajes[:1] if mensajes and mensajes[0].get("role") == "system" else []
+        resto = mensajes[len(sistema):]
+        prefijo = []
+        inicio_min = 0
+        if self.estrategia == "ultimos_turnos":
+            inicio_min = max(0, len(resto) - 2 * self.ultimos_turnos)
+        elif self.estrategia == "resumen" and self.resumen:
+            inicio_min = min(self.resumidos, len(resto))
+            prefijo = [self._mensaje_resumen()]
+        
+        usados = sum(self.tokens_mensaje(m) for m in sistema + prefijo)
+        disponible = self.presupuesto_tokens - self.reserva_respuesta - usados
+        # Ventana deslizante desde el final; el último mensaje siempre se envía
+        total = 0
+        inicio = len(resto)
+        while inicio > inicio_min:
+            tokens = self.tokens_mensaje(resto[inicio - 1])
+            if total + tokens > disponible and inicio < len(resto):
+                break
+            total += tokens
+            inicio -= 1
+        
+        enviar = sistema + prefijo + resto[inicio:]
+        estadisticas = {
+            "estrategia": self.estrategia,
+            "presupuesto": self.presupuesto_tokens,
+            "tokens_estimados": usados + total,
+            "mensajes_enviados": len(enviar),
+            "omitidos": inicio,
+            "resumidos": self.resumidos if prefijo else 0,
+        }
+        return enviar, estadisticas
+    
+    def pendientes_de_resumir(self, mensajes, omitidos):
+        """Mensajes que han quedado fuera y aún no están en el resumen."""
+        if self.estrategia != "resumen" or omitidos <= self.resumidos:
+            return []
+        inicio = 1 if mensajes and mensajes[0].get("role") == "system" else 0
+        return mensajes[inicio + self.resumidos:inicio + omitidos]
@@ -0,0 +1,109 @@
+"""Índice de desplazamientos de los mensajes de una conversación JSON Lines.
+
+Junto a cada conversacion.jsonl se guarda conversacion.idx con la posición
+en bytes donde empieza cada mensaje. Con él se pueden leer los últimos N
+mensajes, o una página anterior, sin recorrer el archivo entero.
+"""
+import os
+import struct
+from array import array
+
+class IndiceLineas:
+    """Índice (.idx) de las líneas de mensaje de un archivo JSON Lines.
+    
+    Formato: una cabecera con firma, inodo del .jsonl y bytes ya indexados,
+    seguida de un entero de 8 bytes por mensaje. Los mensajes solo se añaden
+    al final del .jsonl, así que al abrir basta con indexar lo que haya
+    crecido desde la última vez; si el archivo se ha reescrito (otro inodo,
+    más corto que lo indexado) el índice se rehace entero. Solo se indexan
+    las líneas que `es_mensaje` acepta, el mismo filtro con el que el almacén
+    lee los mensajes, para que las posiciones coincidan con las de cargar();
+    una última línea a medio escribir tampoco se indexa.
+    
+    No es seguro para varios hilos: AlmacenJSONL lo usa bajo su propio lock.
+    """
+    FIRMA = b"DSIDX002"
+    CABECERA = struct.Struct("<8sQQ")
+    ENTRADA = 8
+    _CABECERA_JSONL = b'{"tipo": "cabecera"'
+    
+    def __init__(self, ruta_jsonl, es_mensaje):
+        self.ruta = ruta_jsonl
+        self.es_mensaje = es_mensaje
+        self.ruta_idx = os.path.splitext(ruta_jsonl)[0] + ".idx"
+        self.total = 0
+        self.indexado = 0
+    
+    def actualizar(self):
+        """Pone el índice al día con el .jsonl y devuelve el número de mensajes."""
+        estado = os.stat(self.ruta)
+        if not self._leer_cabecera(estado):
+            self.total = self.indexado = 0
+            with open(self.ruta_idx, "wb") as f:
+                f.write(self.CABECERA.pack(self.FIRMA, estado.st_ino, 0))
+        if self.indexado < estado.st_size:
+            nuevos, self.indexado = self._escanear(self.indexado)
+            with open(self.ruta_idx, "r+b") as f:
+                # Primero las entradas y después la cabecera: si se corta a
+                # medias, las entradas sobrantes invalidan el índice
+                f.seek(self.CABECERA.size + self.total * self.ENTRADA)
+                nuevos.tofile(f)
+                f.truncate()
+                f.seek(0)
+                f.write(self.CABECERA.pack(self.FIRMA, estado.st_ino, self.indexado))
+            self.total += len(nuevos)
+        return self.total
+    
+    def _leer_cabecera(self, estado):
+        try:
+            with open(self.ruta_idx, "rb") as f:
+                firma, inodo, indexado = self.CABECERA.unpack(f.read(self.CABECERA.size))
+                tamano_idx = os.fstat(f.fileno()).st_size
+        except (OSError, struct.error):
+            return False
+        total, resto = divmod(tamano_idx - self.CABECERA.size, self.ENTRADA)
+        if firma != self.FIRMA or resto or inodo != estado.st_ino or indexado > estado.st_size:
+            return False
+        if indexado:
+            # Lo indexado termina siempre en un salto de línea
+            with open(self.ruta, "rb") as f:
+                f.seek(indexado - 1)
+                if f.read(1) != b"\n":
+                    return False
+        self.total, self.indexado = total, indexado
+        return True
+    
+    def _escanear(self, desde):
+        """Desplazamientos de los mensajes completos a partir de `desde`."""
+        desplazamientos = array("Q")
+        posicion = desde
+        with open(self.ruta, "rb") as f:
+            f.seek(desde)
+            for linea in f:
+                if not linea.endswith(b"\n"):
+                    break
+                contenido = linea.strip()
+                if (contenido and not contenido.startswith(self._CABECERA_JSONL)
+                        and self.es_mensaje(contenido)):
+                    desplazamientos.append(posicion)
+                posicion += len(linea)
+        return desplazamientos, posicion
+    
+    def leer(self, inicio, fin):
+        """Bytes de las líneas de los mensajes [inicio, fin) ya indexados."""
+        inicio, fin = max(0, inicio), min(fin, self.total)
+        if inicio >= fin:
+            return []
+        # Una entrada más para saber dónde acaba el último mensaje pedido
+        desplazamientos = array("Q")
+        with open(self.ruta_idx, "rb") as f:
+            f.seek(self.CABECERA.size + inicio * self.ENTRADA)
+            desplazamientos.fromfile(f, min(fin + 1, self.total) - inicio)
+        if len(desplazamientos) == fin - inicio:
+            desplazamientos.append(self.indexado)
+        base = desplazamientos[0]
+        with open(self.ruta, "rb") as f:
+            f.seek(base)
+            bloque = f.read(desplazamientos[-1] - base)
+        return [bloque[a - base:b - base].split(b"\n", 1)[0]
+                for a, b in zip(desplazamientos, desplazamientos[1:])]
@@ -0,0 +1,173 @@
+"""Lotes de peticiones en paralelo, con resultados en JSON Lines y reanudación."""
+import os
+import sys
+import csv
+import json
+import time
+import concurrent.futures
+
+from .red import obtener_planificador
+
+def _id_peticion(valor, numero):
+    """Id indicado en la petición o, si falta o está vacío, el número de línea (0 es un id válido)."""
+    return numero if valor is None or valor == "" else valor
+
+def leer_peticiones(ruta, f=None):
+    """Genera (id, prompt) desde JSON Lines, CSV o texto con una petición por línea.
+
+    En JSON Lines cada objeto trae "prompt" y opcionalmente "id"; en CSV se
+    usan las columnas "id" y "prompt" (o la primera columna). Sin id se usa
+    el número de línea, que es estable mientras no cambie el archivo. Las
+    líneas que no son una petición válida se saltan con un aviso para que
+    no detengan el resto del lote.
+    """
+    if f is None:
+        with open(ruta, "r", encoding="utf-8", newline="") as f:
+            yield from leer_peticiones(ruta, f)
+        return
+    if ruta.lower().endswith(".csv"):
+        lector = csv.reader(f)
+        cabecera = next(lector, None)
+        if cabecera is None:
+            return
+        columnas = [c.strip().lower() for c in cabecera]
+        if "prompt" not in columnas:
+            # Sin cabecera reconocible: la primera fila también es una petición
+            columnas = []
+            if cabecera and cabecera[0].strip():
+                yield 1, cabecera[0]
+        for numero, fila in enumerate(lector, 2):
+            if not fila:
+                continue
+            if columnas:
+                dato = dict(zip(columnas, fila))
+                if dato.get("prompt", "").strip():
+                    yield _id_peticion(dato.get("id"), numero), dato["prompt"]
+            elif fila[0].strip():
+                yield numero, fila[0]
+        return
+    for numero, linea in enumerate(f, 1):
+        linea = linea.strip()
+        if not linea:
+            continue
+        if linea.startswith("{"):
+            try:
+                dato = json.loads(linea)
+            except ValueError as e:
+                print(f"Línea {numero} omitida: JSON no válido ({e})", file=sys.stderr)
+                continue
+            if not isinstance(dato, dict) or not isinstance(dato.get("prompt"), str) or not dato["prompt"].strip():
+                print(f"Línea {numero} omitida: falta \"prompt\"", file=sys.stderr)
+                continue
+            yield _id_peticion(dato.get("id"), numero), dato["prompt"]
+        else:
+            yield numero, linea
+
+def ids_completados(ruta_salida):
+    """Ids que ya tienen respuesta en una salida previa (las líneas con error se repiten)."""
+    completados = set()
+    if not ruta_salida or not os.path.exists(ruta_salida):
+        return completados
+    with open(ruta_salida, "r", encoding="utf-8") as f:
+        for linea in f:
+            try:
+                dato = json.loads(linea)
+            except ValueError:
+                # Última línea a medio escribir si el lote se cortó
+                continue
+            if "respuesta" in dato:
+                completados.add(str(dato.get("id")))
+    return completados
+
+class EjecutorLotes:
+    """Ejecuta un lote de peticiones independientes sobre DeepSeekChat.
+
+    Cada petición usa un bot nuevo (sin historial, con el mensaje de sistema
+    opcional) y pasa por el planificador del núcleo, así que la concurrencia
+    y el ritmo los marcan el límite y la cubeta del proveedor. Los
+    resultados se escriben en cuanto terminan, fuera de orden y con su id,
+    y solo se mantienen en vuelo unas pocas peticiones más que la
+    concurrencia, sea cual sea el tamaño del lote.
+    """
+    def __init__(self, crear_bot, concurrencia=4, sistema=None, progreso=None):
+        self.crear_bot = crear_bot
+        self.concurrencia = max(1, concurrencia)
+        self.sistema = sistema
+        # progreso(resumen) se llama tras cada resultado
+        self.progreso = progreso
+        self.resumen = {}
+
+    @staticmethod
+    async def _ejecutar(bot, prompt):
+        inicio = time.monotonic()
+        respuesta = await bot.stream_chat(prompt, lambda _: None)
+        return respuesta, bot.ultimas_estadisticas, bot.ultimas_metricas, time.monotonic() - inicio
+
+    def _lanzar(self, id_, prompt):
+        bot = self.crear_bot()
+        if self.sistema:
+            bot.messages[0]["content"] = self.sistema
+        return obtener_planificador().enviar(bot.proveedor, self._ejecutar(bot, prompt))
+
+    def _registrar(self, salida, id_, prompt, futuro):
+        resultado = {"id": id_, "prompt": prompt}
+        try:
+            respuesta, estadisticas, metricas, segundos = futuro.result()
+        except Exception as e:
+            resultado["error"] = str(e)
+            self.resumen["errores"] += 1
+        else:
+            resultado["respuesta"] = respuesta
+            resultado["segundos"] = round(segundos, 3)
+            uso = {k: estadisticas[k] for k in ("prompt_tokens", "completion_tokens") if k in estadisticas}
+            if uso:
+                resultado["uso"] = uso
+            if estadisticas.get("cache"):
+                resultado["cache"] = True
+            resultado["metricas"] = metricas
+            self.resumen["completadas"] += 1
+            self.resumen["prompt_tokens"] += uso.get("prompt_tokens", 0)
+            self.resumen["completion_tokens"] += uso.get("completion_tokens", 0)
+        salida.write(json.dumps(resultado, ensure_ascii=False) + "\n")
+        salida.flush()
+
+    def ejecutar(self, peticiones, salida, omitir=()):
+        """Procesa (id, prompt) escribiendo cada resultado en salida; devuelve el resumen.
+
+        Las peticiones cuyo id (como texto) esté en omitir se saltan, para
+        reanudar un lote interrumpido.
+        """
+        self.resumen = {"completadas": 0, "errores": 0, "omitidas": 0,
+                        "prompt_tokens": 0, "completion_tokens": 0}
+        inicio = time.monotonic()
+        en_vuelo = {}
+        try:
+            for id_, prompt in peticiones:
+                if str(id_) in omitir:
+                    self.resumen["omitidas"] += 1
+                    continue
+                while len(en_vuelo) >= self.concurrencia * 2:
+                    self._esperar(en_vuelo, salida)
+                en_vuelo[self._lanzar(id_, prompt)] = (id_, prompt)
+            while en_vuelo:
+                self._esperar(en_vuelo, salida)
+        finally:
+            # Interrupción: lo no terminado se cancela y se repetirá al reanudar
+            for futuro in en_vuelo:
+                futuro.cancel()
+            self._cerrar_resumen(time.monotonic() - inicio)
+        return self.resumen
+
+    def _esperar(self, en_vuelo, salida):
+        hechos, _ = concurrent.futures.wait(list(en_vuelo), return_when=concurrent.futures.FIRST_COMPLETED)
+        for futuro in hechos:
+            id_, prompt = en_vuelo.pop(futuro)
+            self._registrar(salida, id_, prompt, futuro)
+            if self.progreso is not None:
+                self.progreso(self.resumen)
+
+    def _cerrar_resumen(self, segundos):
+        r = self.resumen
+        r["segundos"] = round(segundos, 3)
+        r["peticiones_por_segundo"] = round(r["completadas"] / segundos, 3) if segundos else 0.0
+        r["tokens_por_segundo"] = round(r["completion_tokens"] / segundos, 1) if segundos else 0.0
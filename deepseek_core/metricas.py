@@ -0,0 +1,310 @@
+"""Métricas de latencia y rendimiento de cada petición, y su exportación."""
+import os
+import json
+import time
+import threading
+import contextvars
+from collections import deque
+
+from .ajustes import get_settings
+
+_ACTUAL = contextvars.ContextVar("metricas_peticion", default=None)
+
+def metricas_actual():
+    """Métricas de la petición que se está ejecutando en esta tarea del bucle (o None)."""
+    return _ACTUAL.get()
+
+def _ms(segundos):
+    return None if segundos is None else round(segundos * 1000, 1)
+
+class MetricasPeticion:
+    """Marcas de tiempo de una petición, desde que entra en la cola hasta el último token.
+
+    Se asocia a la tarea del bucle con una ContextVar: el planificador, el
+    proveedor, los ganchos de httpx y el stream anotan en el mismo objeto
+    sin tener que pasárselo de mano en mano.
+    """
+    def __init__(self, proveedor=None, modelo=None):
+        self.proveedor = proveedor
+        self.modelo = modelo
+        self.creada = time.monotonic()
+        # Sale de la cola del planificador (sin planificador, al crearse)
+        self.iniciada = self.creada
+        self.primer_token = None
+        self.fin = None
+        self.espera_limite = 0.0
+        # TCP + TLS de la última conexión abierta; None si se reutilizó una del pool
+        self.conexion = None
+        # Desde que se lanza la petición HTTP hasta tener las cabeceras de respuesta
+        self.cabeceras = None
+        self.trozos = 0
+        self.reintentos = 0
+        self.cache = False
+        self.prompt_tokens = None
+        self.completion_tokens = None
+        self.tokens_estimados = None
+        self.error = None
+        # Detenida por el usuario (botón Detener, Ctrl+C) antes de terminar
+        self.cancelada = False
+        self._conectando = None
+
+    def activar(self):
+        """La asocia a la tarea actual; devuelve el token para desactivarla."""
+        return _ACTUAL.set(self)
+
+    @staticmethod
+    def desactivar(token):
+        _ACTUAL.reset(token)
+
+    def marcar_inicio(self):
+        self.iniciada = time.monotonic()
+
+    def marcar_trozo(self):
+        if self.primer_token is None:
+            self.primer_token = time.monotonic()
+        self.trozos += 1
+
+    def marcar_fin(self, error=None, cancelada=False):
+        self.fin = time.monotonic()
+        self.cancelada = cancelada
+        if error is not None:
+            self.error = str(error) or type(error).__name__
+
+    async def traza(self, evento, info):
+        """Extensión "trace" de httpcore: mide la apertura de conexiones nuevas."""
+        if evento == "connection.connect_tcp.started":
+            self._conectando = time.monotonic()
+        elif evento in ("connection.connect_tcp.complete", "connection.start_tls.complete"):
+            if self._conectando is not None:
+                self.conexion = time.monotonic() - self._conectando
+
+    def a_dict(self):
+        """Resumen serializable (tiempos en ms, relativos al inicio de la petición)."""
+        fin = self.fin if self.fin is not None else time.monotonic()
+        datos = {
+            "proveedor": self.proveedor,
+            "modelo": self.modelo,
+            "cola_ms": _ms(self.iniciada - self.creada),
+            "espera_limite_ms": _ms(self.espera_limite),
+            "conexion_ms": _ms(self.conexion),
+            "cabeceras_ms": _ms(self.cabeceras),
+            "ttft_ms": _ms(self.primer_token - self.iniciada) if self.primer_token is not None else None,
+            "total_ms": _ms(fin - self.iniciada),
+            "trozos": self.trozos,
+            "reintentos": self.reintentos,
+        }
+        tokens = self.completion_tokens if self.completion_tokens is not None else self.tokens_estimados
+        if tokens and self.primer_token is not None and fin > self.primer_token:
+            datos["tokens_por_segundo"] = round(tokens / (fin - self.primer_token), 1)
+        if self.prompt_tokens is not None:
+            datos["prompt_tokens"] = self.prompt_tokens
+            datos["completion_tokens"] = self.completion_tokens
+        elif self.tokens_estimados is not None:
+            datos["completion_tokens_estimados"] = self.tokens_estimados
+        if self.cache:
+            datos["cache"] = True
+        if self.error:
+            datos["error"] = self.error
+        if self.cancelada:
+            datos["cancelada"] = True
+        return {k: v for k, v in datos.items() if v is not None}
+
+def _resultado(registro):
+    if "error" in registro:
+        return "error"
+    if registro.get("cancelada"):
+        return "cancelada"
+    return "cache" if registro.get("cache") else "ok"
+
+def _percentil(valores, p):
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(round(p * (len(ordenados) - 1))))]
+
+class RegistroMetricas:
+    """Últimas peticiones medidas del proceso, con totales para exportar.
+
+    Guarda una ventana de las peticiones más recientes (para percentiles y el
+    panel de estadísticas) y sumas acumuladas por proveedor (para Prometheus).
+    Con la sección "metricas" de settings.json cada petición se añade además
+    a un archivo JSON Lines ("jsonl") y se reescribe un archivo de texto de
+    Prometheus ("prometheus", para el textfile collector de node_exporter).
+    Los observadores reciben cada registro, en el hilo que lo registra.
+    """
+    # Tiempos que se exportan como resumen de Prometheus: clave del registro → (métrica, ayuda)
+    TIEMPOS = {
+        "cola_ms": ("cola", "Espera en la cola del planificador."),
+        "conexion_ms": ("conexion", "Apertura de conexiones nuevas (TCP y TLS)."),
+        "cabeceras_ms": ("cabeceras", "Desde el envío hasta las cabeceras de respuesta."),
+        "ttft_ms": ("primer_token", "Desde la salida de la cola hasta el primer token."),
+        "total_ms": ("duracion", "Duración total de la petición sin la cola."),
+        "sobrecarga_ui_ms": ("sobrecarga_ui", "Tiempo añadido por la interfaz hasta el primer render."),
+    }
+
+    def __init__(self, maximo=1000):
+        self._lock = threading.Lock()
+        self._recientes = deque(maxlen=maximo)
+        self._totales = {}
+        self._siguiente = 1
+        self._config = None
+        self.observadores = []
+
+    def _configuracion(self):
+        if self._config is None:
+            self._config = get_settings().get("metricas", {})
+        return self._config
+
+    def _sumar(self, registro, claves):
+        totales = self._totales.setdefault(registro.get("proveedor") or "?", {})
+        for clave in claves:
+            valor = registro.get(clave)
+            if isinstance(valor, (int, float)) and not isinstance(valor, bool):
+                suma, cuenta = totales.get(clave, (0.0, 0))
+                totales[clave] = (suma + valor, cuenta + 1)
+
+    def registrar(self, metricas):
+        """Añade una petición terminada; devuelve su registro (con "id")."""
+        registro = metricas.a_dict()
+        with self._lock:
+            registro["id"] = self._siguiente
+            self._siguiente += 1
+            registro["fecha"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+            self._recientes.append(registro)
+            totales = self._totales.setdefault(registro.get("proveedor") or "?", {})
+            resultado = _resultado(registro)
+            totales[resultado] = totales.get(resultado, 0) + 1
+            self._sumar(registro, list(self.TIEMPOS) + ["prompt_tokens", "completion_tokens"])
+        self._escribir(registro)
+        self._notificar(registro)
+        return dict(registro)
+
+    def anotar(self, id_, **campos):
+        """Completa un registro con datos medidos fuera del núcleo (p. ej. la interfaz)."""
+        with self._lock:
+            registro = next((r for r in self._recientes if r["id"] == id_), None)
+            if registro is None:
+                return
+            registro.update(campos)
+            self._sumar(registro, campos)
+            copia = dict(registro)
+        self._escribir(copia, jsonl=False)
+        self._notificar(copia)
+
+    def _notificar(self, registro):
+        for observador in list(self.observadores):
+            try:
+                observador(dict(registro))
+            except Exception as e:
+                print(f"Error notificando métricas: {e}")
+
+    def _escribir(self, registro, jsonl=True):
+        config = self._configuracion()
+        try:
+            if jsonl and config.get("jsonl"):
+                with open(config["jsonl"], "a", encoding="utf-8") as f:
+                    f.write(json.dumps(registro, ensure_ascii=False) + "\n")
+            if config.get("prometheus"):
+                self.exportar_prometheus(config["prometheus"])
+        except Exception as e:
+            print(f"No se pudieron escribir las métricas: {e}")
+
+    def recientes(self):
+        with self._lock:
+            return [dict(r) for r in self._recientes]
+
+    def resumen(self):
+        """Por proveedor: peticiones, errores y medianas/p95 de la ventana reciente."""
+        por_proveedor = {}
+        for registro in self.recientes():
+            por_proveedor.setdefault(registro.get("proveedor") or "?", []).append(registro)
+        resumen = {}
+        for proveedor, registros in por_proveedor.items():
+            datos = {"peticiones": len(registros), "errores": sum(1 for r in registros if "error" in r),
+                     "canceladas": sum(1 for r in registros if r.get("cancelada"))}
+            for clave in list(self.TIEMPOS) + ["tokens_por_segundo"]:
+                # Las fallidas y las detenidas a medias no cuentan para los tiempos
+                valores = [r[clave] for r in registros if clave in r and _resultado(r) in ("ok", "cache")]
+                if valores:
+                    datos[clave] = {"p50": _percentil(valores, 0.5), "p95": _percentil(valores, 0.95)}
+            resumen[proveedor] = datos
+        return resumen
+
+    def texto_prometheus(self):
+        """Exposición en formato de texto de Prometheus."""
+        # Import local: red importa este módulo
+        from .red import CONTADORES_RED
+
+        def etiqueta(proveedor, **extra):
+            pares = [("proveedor", proveedor)] + list(extra.items())
+            return "{" + ",".join(f'{k}="{v}"' for k, v in pares) + "}"
+
+        recientes = self.recientes()
+        with self._lock:
+            totales = {p: dict(t) for p, t in self._totales.items()}
+        lineas = [
+            "# HELP deepseek_chat_peticiones_total Peticiones terminadas por proveedor y resultado.",
+            "# TYPE deepseek_chat_peticiones_total counter",
+        ]
+        for proveedor, t in sorted(totales.items()):
+            for resultado in ("ok", "cache", "error", "cancelada"):
+                lineas.append(f"deepseek_chat_peticiones_total{etiqueta(proveedor, resultado=resultado)} "
+                              f"{t.get(resultado, 0)}")
+        for clave in ("prompt_tokens", "completion_tokens"):
+            nombre = f"deepseek_chat_{clave}_total"
+            lineas += [f"# HELP {nombre} Tokens de uso informados por el proveedor.", f"# TYPE {nombre} counter"]
+            for proveedor, t in sorted(totales.items()):
+                lineas.append(f"{nombre}{etiqueta(proveedor)} {int(t.get(clave, (0, 0))[0])}")
+        for clave, (metrica, ayuda) in self.TIEMPOS.items():
+            nombre = f"deepseek_chat_{metrica}_segundos"
+            lineas += [f"# HELP {nombre} {ayuda}", f"# TYPE {nombre} summary"]
+            for proveedor, t in sorted(totales.items()):
+                if clave not in t:
+                    continue
+                valores = [r[clave] for r in recientes if r.get("proveedor") == proveedor and clave in r]
+                for cuantil in (0.5, 0.95):
+                    if valores:
+                        lineas.append(f"{nombre}{etiqueta(proveedor, quantile=cuantil)} "
+                                      f"{_percentil(valores, cuantil) / 1000:.4f}")
+                suma, cuenta = t[clave]
+                lineas.append(f"{nombre}_sum{etiqueta(proveedor)} {suma / 1000:.4f}")
+                lineas.append(f"{nombre}_count{etiqueta(proveedor)} {cuenta}")
+        lineas += ["# HELP deepseek_chat_red_total Eventos de red del proceso.",
+                   "# TYPE deepseek_chat_red_total counter"]
+        for evento, valor in sorted(CONTADORES_RED.instantanea().items()):
+            lineas.append(f'deepseek_chat_red_total{{evento="{evento}"}} {valor}')
+        return "\n".join(lineas) + "\n"
+
+    def exportar_prometheus(self, ruta):
+        """Escribe el texto de Prometheus de forma atómica (para el textfile collector)."""
+        temporal = ruta + ".tmp"
+        with open(temporal, "w", encoding="utf-8") as f:
+            f.write(self.texto_prometheus())
+        os.replace(temporal, ruta)
+
+    def exportar_jsonl(self, ruta):
+        """Escribe las peticiones recientes, una por línea."""
+        with open(ruta, "w", encoding="utf-8") as f:
+            for registro in self.recientes():
+                f.write(json.dumps(registro, ensure_ascii=False) + "\n")
+
+REGISTRO_METRICAS = RegistroMetricas()
+
+def describir_metricas(metricas):
+    """Texto corto con los tiempos de una petición (para la barra de estado o un tooltip)."""
+    if not metricas:
+        return ""
+    partes = []
+    if "ttft_ms" in metricas:
+        partes.append(f"1er token {metricas['ttft_ms']:.0f} ms")
+    if "tokens_por_segundo" in metricas:
+        partes.append(f"{metricas['tokens_por_segundo']:.0f} tok/s")
+    if "total_ms" in metricas:
+        partes.append(f"total {metricas['total_ms'] / 1000:.1f} s")
+    if metricas.get("cola_ms"):
+        partes.append(f"cola {metricas['cola_ms']:.0f} ms")
+    if "conexion_ms" in metricas:
+        partes.append(f"conexión {metricas['conexion_ms']:.0f} ms")
+    if "sobrecarga_ui_ms" in metricas:
+        partes.append(f"interfaz {metricas['sobrecarga_ui_ms']:.0f} ms")
+    if metricas.get("reintentos"):
+        partes.append(f"{metricas['reintentos']} reintentos")
+    return " · ".join(partes)
@@ -0,0 +1,145 @@
+"""Proveedores de modelos compatibles con la API de OpenAI."""
+import time
+import inspect
+
+from .ajustes import get_settings
+from .metricas import metricas_actual
+from .red import CONTADORES_RED, PoliticaReintentos, obtener_cliente, obtener_limitador
+
+BASE_URL = "https://api.deepseek.com"
+DEFAULT_MODEL = "deepseek-chat"
+OPENAI_BASE_URL = "https://api.openai.com/v1"
+OPENAI_DEFAULT_MODEL = "gpt-4"
+LOCAL_BASE_URL = "http://localhost:11434/v1"
+LOCAL_DEFAULT_MODEL = "llama3"
+
+class Proveedor:
+    """Proveedor de modelos con API compatible con OpenAI.
+
+    Cada subclase fija su URL base, su modelo por defecto y el autor con el
+    que firma las respuestas. La sección "proveedores" de settings.json
+    permite cambiar la URL y el modelo de cualquiera de ellos, por ejemplo
+    para apuntar "Local" a llama.cpp, Ollama o vLLM.
+    """
+    nombre = ""
+    autor = ""
+    base_url = ""
+    modelo = ""
+    requiere_key = True
+    # Si el servidor admite stream_options={"include_usage": True}
+    soporta_uso = True
+    # Peticiones simultáneas como máximo (el resto espera en la cola)
+    concurrencia = 4
+    # Ritmo máximo de envío en el cliente (0 = solo lo que marque el servidor)
+    peticiones_por_minuto = 0
+    # URL que admite continuar una respuesta cortada a partir de su prefijo
+    base_url_prefijo = None
+
+    def __init__(self, api_key=None, base_url=None, modelo=None, concurrencia=None,
+                 peticiones_por_minuto=None, reintentos=None):
+        self.api_key = api_key
+        self.base_url = base_url or self.base_url
+        self.modelo = modelo or self.modelo
+        self.concurrencia = concurrencia or self.concurrencia
+        if peticiones_por_minuto is not None:
+            self.peticiones_por_minuto = peticiones_por_minuto
+        self.reintentos = reintentos if reintentos is not None else PoliticaReintentos()
+
+    @classmethod
+    def desde_ajustes(cls, api_keys, settings):
+        conf = settings.get("proveedores", {}).get(cls.nombre, {})
+        modelo = conf.get("modelo") or settings.get("modelos", {}).get(cls.nombre)
+        return cls((api_keys or {}).get(cls.nombre), conf.get("base_url"), modelo, conf.get("concurrencia"),
+                   conf.get("peticiones_por_minuto"), PoliticaReintentos.desde_ajustes(settings))
+
+    @property
+    def soporta_prefijo(self):
+        return self.base_url_prefijo is not None
+
+    def cliente(self, base_url=None):
+        """Cliente asíncrono compartido; solo se usa desde el bucle del núcleo."""
+        # El SDK exige una key aunque el servidor local no la compruebe
+        return obtener_cliente(self.nombre, base_url or self.base_url, self.api_key or "sin-key")
+
+    async def _crear(self, base_url=None, **kwargs):
+        """Lanza la petición pasando por el limitador y le pasa las cabeceras de límite."""
+        limitador = obtener_limitador(self)
+        metricas = metricas_actual()
+        esperado = await limitador.adquirir()
+        if esperado:
+            CONTADORES_RED.incrementar("esperas_limite")
+            if metricas is not None:
+                metricas.espera_limite += esperado
+        CONTADORES_RED.incrementar("peticiones")
+        inicio = time.monotonic()
+        try:
+            crudo = await self.cliente(base_url).chat.completions.with_raw_response.create(model=self.modelo, **kwargs)
+        except Exception as e:
+            respuesta = getattr(e, "response", None)
+            estado = getattr(e, "status_code", None)
+            if estado == 429:
+                CONTADORES_RED.incrementar("limitadas")
+            if respuesta is not None:
+                limitador.actualizar(respuesta.headers, estado, e)
+            raise
+        limitador.actualizar(crudo.headers)
+        if metricas is not None:
+            # Con stream la llamada vuelve al recibir las cabeceras, antes del primer token
+            metricas.cabeceras = time.monotonic() - inicio
+        resultado = crudo.parse()
+        if inspect.isawaitable(resultado):
+            resultado = await resultado
+        return resultado
+
+    async def completar(self, mensajes, **kwargs):
+        """Petición sin streaming (con reintentos); devuelve el texto de la respuesta."""
+        respuesta = await self.reintentos.ejecutar(lambda: self._crear(messages=mensajes, **kwargs))
+        return respuesta.choices[0].message.content
+
+    async def stream(self, mensajes, prefijo=None, **parametros):
+        """Abre el stream de la respuesta (iterable con async for).
+
+        Con prefijo se pide al modelo que continúe ese texto como respuesta,
+        para reanudar un stream cortado sin repetir lo ya recibido. Los
+        `parametros` (max_tokens, temperature...) se pasan tal cual a la API.
+        """
+        kwargs = {"stream_options": {"include_usage": True}} if self.soporta_uso else {}
+        base_url = None
+        if prefijo:
+            mensajes = mensajes + [{"role": "assistant", "content": prefijo, "prefix": True}]
+            base_url = self.base_url_prefijo
+        return await self._crear(base_url, messages=mensajes, stream=True, **kwargs, **parametros)
+
+class ProveedorDeepSeek(Proveedor):
+    nombre = "Deepseek"
+    autor = "DeepSeek"
+    base_url = BASE_URL
+    modelo = DEFAULT_MODEL
+    base_url_prefijo = BASE_URL + "/beta"
+
+class ProveedorOpenAI(Proveedor):
+    nombre = "ChatGPT"
+    autor = "ChatGPT"
+    base_url = OPENAI_BASE_URL
+    modelo = OPENAI_DEFAULT_MODEL
+
+class ProveedorLocal(Proveedor):
+    """Servidor local compatible con OpenAI (llama.cpp, Ollama, vLLM...)."""
+    nombre = "Local"
+    autor = "Local"
+    base_url = LOCAL_BASE_URL
+    modelo = LOCAL_DEFAULT_MODEL
+    requiere_key = False
+    soporta_uso = False
+    # Un servidor local suele atender una petición cada vez
+    concurrencia = 1
+
+PROVEEDORES = {cls.nombre: cls for cls in (ProveedorDeepSeek, ProveedorOpenAI, ProveedorLocal)}
+# Autores con los que se guardan las respuestas de los modelos en el historial
+# (los historiales antiguos firmaban con el nombre del proveedor)
+AUTORES_IA = {cls.autor for cls in PROVEEDORES.values()} | set(PROVEEDORES)
+
+def obtener_proveedor(nombre, api_keys, settings=None):
+    """Instancia el proveedor registrado con ese nombre (DeepSeek si no existe)."""
+    cls = PROVEEDORES.get(nombre, ProveedorDeepSeek)
+    return cls.desde_ajustes(api_keys, settings if settings is not None else get_settings())
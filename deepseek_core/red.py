@@ -0,0 +1,399 @@
+"""Núcleo asíncrono, clientes HTTP compartidos, cola de peticiones, límites y reintentos."""
+import re
+import time
+import random
+import asyncio
+import threading
+
+from .ajustes import get_settings
+from .metricas import REGISTRO_METRICAS, MetricasPeticion, metricas_actual
+
+class ContadoresRed:
+    """Contadores de red del proceso (peticiones, reintentos, 429...) para monitorizar."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._valores = {}
+
+    def incrementar(self, clave, cantidad=1):
+        with self._lock:
+            self._valores[clave] = self._valores.get(clave, 0) + cantidad
+
+    def instantanea(self):
+        with self._lock:
+            return dict(self._valores)
+
+CONTADORES_RED = ContadoresRed()
+
+_DURACION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_UNIDADES = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+def _segundos_cabecera(valor):
+    """Convierte una cabecera de espera a segundos.
+
+    Acepta segundos ("2", "0.5"), duraciones como las de x-ratelimit-reset-*
+    ("20ms", "6m0s") y fechas HTTP de Retry-After. Devuelve None si no la entiende.
+    """
+    if not valor:
+        return None
+    valor = valor.strip()
+    try:
+        return max(0.0, float(valor))
+    except ValueError:
+        pass
+    partes = _DURACION_RE.findall(valor)
+    if partes:
+        return sum(float(n) * _UNIDADES[u] for n, u in partes)
+    try:
+        from email.utils import parsedate_to_datetime
+        return max(0.0, parsedate_to_datetime(valor).timestamp() - time.time())
+    except Exception:
+        return None
+
+def segundos_reintento(error):
+    """Espera que pide el servidor en la respuesta de error (Retry-After), si la hay."""
+    respuesta = getattr(error, "response", None)
+    if respuesta is None:
+        return None
+    cabeceras = respuesta.headers
+    ms = cabeceras.get("retry-after-ms")
+    if ms:
+        try:
+            return float(ms) / 1000
+        except ValueError:
+            pass
+    return _segundos_cabecera(cabeceras.get("retry-after"))
+
+class LimitadorTokens:
+    """Cubeta de tokens por proveedor y key.
+
+    Con "peticiones_por_minuto" se limita el ritmo de envío en el propio
+    cliente; además se adapta a lo que diga el servidor: un 429 o una
+    cabecera x-ratelimit-remaining-requests a cero bloquean la cubeta hasta
+    el momento indicado por Retry-After o x-ratelimit-reset-requests. Solo se
+    usa desde el bucle del núcleo.
+    """
+    def __init__(self, por_minuto=0):
+        self.capacidad = 0
+        self.tokens = 0.0
+        self.ultimo = time.monotonic()
+        self.bloqueado_hasta = 0.0
+        self.ajustar(por_minuto)
+
+    def ajustar(self, por_minuto):
+        """Aplica un ritmo nuevo conservando el bloqueo que haya pedido el servidor."""
+        anterior = self.capacidad
+        self.por_minuto = por_minuto
+        self.capacidad = max(1, por_minuto) if por_minuto else 0
+        self.tasa = por_minuto / 60 if por_minuto else 0
+        # Sin límite previo la cubeta estaba vacía: se empieza llena, como al crearla
+        self.tokens = float(self.capacidad) if not anterior else min(self.tokens, self.capacidad)
+
+    async def adquirir(self):
+        """Espera a que haya un token libre; devuelve los segundos esperados."""
+        esperado = 0.0
+        while True:
+            ahora = time.monotonic()
+            if self.bloqueado_hasta > ahora:
+                pausa = self.bloqueado_hasta - ahora
+            elif not self.capacidad:
+                return esperado
+            else:
+                self.tokens = min(self.capacidad, self.tokens + (ahora - self.ultimo) * self.tasa)
+                self.ultimo = ahora
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return esperado
+                pausa = (1 - self.tokens) / self.tasa
+            esperado += pausa
+            await asyncio.sleep(pausa)
+
+    def bloquear(self, segundos):
+        self.bloqueado_hasta = max(self.bloqueado_hasta, time.monotonic() + segundos)
+
+    def actualizar(self, cabeceras, estado=None, error=None):
+        """Ajusta la cubeta con las cabeceras de límite de una respuesta."""
+        if estado == 429:
+            espera = segundos_reintento(error)
+            self.bloquear(espera if espera is not None else 1.0)
+            return
+        restantes = cabeceras.get("x-ratelimit-remaining-requests")
+        if restantes is not None and restantes.strip() == "0":
+            reinicio = _segundos_cabecera(cabeceras.get("x-ratelimit-reset-requests"))
+            self.bloquear(reinicio if reinicio is not None else 1.0)
+
+_LIMITADORES = {}
+
+def obtener_limitador(proveedor):
+    """Limitador compartido por todas las peticiones de ese proveedor y key."""
+    clave = (proveedor.nombre, proveedor.api_key)
+    limitador = _LIMITADORES.get(clave)
+    if limitador is None:
+        limitador = LimitadorTokens(proveedor.peticiones_por_minuto)
+        _LIMITADORES[clave] = limitador
+    elif limitador.por_minuto != proveedor.peticiones_por_minuto:
+        # settings.json recargado o un lote con --por-minuto: vale el ritmo actual
+        limitador.ajustar(proveedor.peticiones_por_minuto)
+    return limitador
+
+class RespuestaIncompleta(Exception):
+    """El stream terminó sin finish_reason: el servidor cerró la conexión a mitad de la respuesta."""
+
+class PoliticaReintentos:
+    """Reintentos con espera exponencial con jitter para errores transitorios.
+
+    Se reintentan los 408, 409, 429, los 5xx, las conexiones caídas y los
+    streams que terminan sin finish_reason (RespuestaIncompleta). La
+    espera es aleatoria entre 0 y base * 2^intento (hasta "max_segundos"),
+    pero nunca menor que lo que pida el servidor con Retry-After.
+    """
+    def __init__(self, maximo=4, base=1.0, tope=30.0):
+        self.maximo = maximo
+        self.base = base
+        self.tope = tope
+
+    @classmethod
+    def desde_ajustes(cls, settings):
+        conf = settings.get("reintentos", {})
+        return cls(conf.get("maximo", 4), conf.get("base_segundos", 1.0), conf.get("max_segundos", 30.0))
+
+    @staticmethod
+    def reintentable(error):
+        if isinstance(error, RespuestaIncompleta):
+            return True
+        import httpx
+        import openai
+        if isinstance(error, openai.APIStatusError):
+            return error.status_code in (408, 409, 429) or error.status_code >= 500
+        return isinstance(error, (openai.APIConnectionError, httpx.TransportError))
+
+    def espera(self, intento, error=None):
+        espera = random.uniform(0, min(self.tope, self.base * 2 ** intento))
+        pedida = segundos_reintento(error)
+        if pedida is not None:
+            espera = max(espera, min(pedida, self.tope * 4))
+        return espera
+
+    async def ejecutar(self, funcion):
+        """Llama a la corrutina que devuelve funcion() reintentando si falla."""
+        intento = 0
+        while True:
+            try:
+                return await funcion()
+            except Exception as e:
+                if intento >= self.maximo or not self.reintentable(e):
+                    CONTADORES_RED.incrementar("errores")
+                    raise
+                CONTADORES_RED.incrementar("reintentos")
+                await asyncio.sleep(self.espera(intento, e))
+                intento += 1
+
+class PlanificadorPeticiones:
+    """Cola de peticiones del núcleo con un límite de concurrencia por proveedor.
+
+    Cada proveedor tiene un semáforo del bucle con su límite ("concurrencia"),
+    así que por muchas pestañas que estén chateando solo hay ese número de
+    streams abiertos; el resto espera en la cola sin ocupar hilos ni
+    conexiones. Los observadores reciben (en_cola, activas) en el hilo del
+    núcleo cada vez que cambian.
+    """
+    def __init__(self, nucleo):
+        self.nucleo = nucleo
+        self._semaforos = {}
+        self.en_cola = 0
+        self.activas = 0
+        self.observadores = []
+
+    def _notificar(self):
+        for observador in list(self.observadores):
+            try:
+                observador(self.en_cola, self.activas)
+            except Exception as e:
+                print(f"Error notificando el estado de la cola: {e}")
+
+    def _semaforo(self, proveedor):
+        # Solo se llama desde el bucle, así que no hace falta lock. La clave
+        # incluye el límite: si cambia (settings.json recargado, un lote con
+        # --concurrencia) las peticiones nuevas usan un semáforo de ese tamaño
+        # y el anterior se vacía con las que ya tenía
+        clave = (proveedor.nombre, max(1, proveedor.concurrencia))
+        semaforo = self._semaforos.get(clave)
+        if semaforo is None:
+            semaforo = asyncio.Semaphore(clave[1])
+            self._semaforos[clave] = semaforo
+        return semaforo
+
+    async def _ejecutar(self, proveedor, corrutina):
+        iniciada = False
+        # Las métricas de la petición miden desde aquí, incluida la espera en la cola
+        metricas = MetricasPeticion(proveedor.nombre, proveedor.modelo)
+        token = metricas.activar()
+        self.en_cola += 1
+        self._notificar()
+        try:
+            async with self._semaforo(proveedor):
+                self.en_cola -= 1
+                self.activas += 1
+                iniciada = True
+                metricas.marcar_inicio()
+                self._notificar()
+                return await corrutina
+        finally:
+            metricas.desactivar(token)
+            if iniciada:
+                self.activas -= 1
+            else:
+                self.en_cola -= 1
+                corrutina.close()
+                # Detenida antes de salir de la cola: stream_chat no llegó a
+                # correr, así que se registra aquí con toda la espera como cola
+                metricas.marcar_inicio()
+                metricas.marcar_fin(cancelada=True)
+                REGISTRO_METRICAS.registrar(metricas)
+            self._notificar()
+
+    def enviar(self, proveedor, corrutina):
+        """Encola la corrutina para ese proveedor; devuelve un concurrent.futures.Future."""
+        return self.nucleo.enviar(self._ejecutar(proveedor, corrutina))
+
+class NucleoAsync:
+    """Bucle asyncio en un hilo propio que comparten todas las peticiones.
+
+    Los streams de todas las pestañas son corrutinas en este único bucle, así
+    que comparten también los clientes y su pool de conexiones en lugar de
+    ocupar un hilo y un cliente cada uno.
+    """
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.planificador = PlanificadorPeticiones(self)
+        self._hilo = threading.Thread(target=self._ejecutar, name="nucleo-async", daemon=True)
+        self._hilo.start()
+
+    def _ejecutar(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def enviar(self, corrutina):
+        """Programa la corrutina en el bucle; devuelve un concurrent.futures.Future."""
+        return asyncio.run_coroutine_threadsafe(corrutina, self.loop)
+
+    def ejecutar(self, corrutina, timeout=None):
+        """Ejecuta la corrutina en el bucle y espera su resultado desde otro hilo."""
+        return self.enviar(corrutina).result(timeout)
+
+    async def _cancelar_tareas(self):
+        actual = asyncio.current_task()
+        tareas = [t for t in asyncio.all_tasks() if t is not actual]
+        for tarea in tareas:
+            tarea.cancel()
+        await asyncio.gather(*tareas, return_exceptions=True)
+
+    def cancelar_pendientes(self, timeout=5):
+        """Cancela las peticiones en curso o en cola y espera a que terminen."""
+        try:
+            self.ejecutar(self._cancelar_tareas(), timeout)
+        except Exception as e:
+            print(f"No se pudieron cancelar las peticiones pendientes: {e}")
+
+    def detener(self, timeout=5):
+        """Cancela lo pendiente, cierra los generadores asíncronos y cierra el bucle.
+
+        Sin esto las tareas y los streams a medias se destruyen con el bucle
+        ("Task was destroyed but it is pending!").
+        """
+        self.cancelar_pendientes(timeout)
+        try:
+            self.ejecutar(self.loop.shutdown_asyncgens(), timeout)
+        except Exception as e:
+            print(f"No se pudieron cerrar los generadores asíncronos: {e}")
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._hilo.join(timeout)
+        if not self._hilo.is_alive():
+            self.loop.close()
+
+_NUCLEO = None
+_NUCLEO_LOCK = threading.Lock()
+
+def obtener_nucleo():
+    """Devuelve el núcleo asíncrono del proceso, arrancándolo la primera vez."""
+    global _NUCLEO
+    with _NUCLEO_LOCK:
+        if _NUCLEO is None:
+            _NUCLEO = NucleoAsync()
+        return _NUCLEO
+
+def obtener_planificador():
+    """Devuelve el planificador de peticiones del núcleo asíncrono."""
+    return obtener_nucleo().planificador
+
+# Registro de clientes HTTP compartidos por todo el proceso, por (proveedor, base_url, key)
+_CLIENTES = {}
+_CLIENTES_LOCK = threading.Lock()
+
+async def _trazar_peticion(peticion):
+    """Gancho de httpx: mide la conexión de la petición en curso si tiene métricas."""
+    metricas = metricas_actual()
+    if metricas is not None:
+        peticion.extensions["trace"] = metricas.traza
+
+def _crear_http_client(settings):
+    """Cliente httpx asíncrono con keep-alive, límites, timeouts y HTTP/2 si hay soporte."""
+    import importlib.util
+    import httpx
+    red = settings.get("red", {})
+    return httpx.AsyncClient(
+        http2=importlib.util.find_spec("h2") is not None,
+        event_hooks={"request": [_trazar_peticion]},
+        limits=httpx.Limits(
+            max_connections=red.get("max_conexiones", 20),
+            max_keepalive_connections=red.get("max_keepalive", 10),
+            keepalive_expiry=red.get("keepalive_segundos", 60),
+        ),
+        timeout=httpx.Timeout(
+            red.get("timeout_lectura", 120),
+            connect=red.get("timeout_conexion", 10),
+        ),
+    )
+
+def obtener_cliente(proveedor, base_url, api_key):
+    """Devuelve el cliente AsyncOpenAI compartido para (proveedor, base_url, key).
+
+    Todas las pestañas reutilizan el mismo cliente y, con él, su pool de
+    conexiones, así que no se repite el handshake TLS en cada mensaje ni en
+    cada pestaña nueva. Los parámetros de red salen de la sección "red" de
+    settings.json. Los clientes pertenecen al bucle del núcleo asíncrono.
+    """
+    clave = (proveedor, base_url, api_key)
+    with _CLIENTES_LOCK:
+        cliente = _CLIENTES.get(clave)
+        if cliente is None:
+            from openai import AsyncOpenAI
+            # Los reintentos los gestiona PoliticaReintentos, no el SDK
+            cliente = AsyncOpenAI(api_key=api_key, base_url=base_url, max_retries=0,
+                                  http_client=_crear_http_client(get_settings()))
+            _CLIENTES[clave] = cliente
+        return cliente
+
+async def _cerrar_clientes():
+    with _CLIENTES_LOCK:
+        clientes = list(_CLIENTES.values())
+        _CLIENTES.clear()
+    for cliente in clientes:
+        try:
+            await cliente.close()
+        except Exception:
+            pass
+
+def cerrar_clientes():
+    """Cierra los pools de conexiones de todos los clientes y detiene el núcleo."""
+    global _NUCLEO
+    with _NUCLEO_LOCK:
+        nucleo, _NUCLEO = _NUCLEO, None
+    if nucleo is None:
+        return
+    # Primero las peticiones, que aún usan los clientes para cerrar sus streams
+    nucleo.cancelar_pendientes()
+    try:
+        nucleo.ejecutar(_cerrar_clientes(), timeout=5)
+    except Exception as e:
+        print(f"No se pudieron cerrar los clientes: {e}")
+    nucleo.detener()
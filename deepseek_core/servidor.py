@@ -0,0 +1,370 @@
+"""Pasarela HTTP local compatible con la API de OpenAI (/v1/chat/completions).
+
+Varias herramientas pueden compartir un único proceso, con sus claves, su
+pool de conexiones, su caché y sus límites de ritmo, apuntando su cliente
+OpenAI a http://127.0.0.1:8000/v1.
+"""
+import sys
+import json
+import time
+import uuid
+import queue
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .ajustes import get_settings, obtener_api_keys
+from .almacen import crear_almacen
+from .chat import crear_bot
+from .proveedores import PROVEEDORES
+from .red import obtener_planificador
+
+_FIN = object()
+# Parámetros de la API de OpenAI que se reenvían al proveedor
+PARAMETROS_REENVIADOS = ("max_tokens", "temperature", "top_p", "stop", "presence_penalty",
+                         "frequency_penalty", "seed")
+# Campos que la pasarela entiende por sí misma; cualquier otro se rechaza
+CAMPOS_PROPIOS = {"model", "messages", "stream", "stream_options", "conversacion", "user", "n"}
+
+class ErrorPasarela(Exception):
+    def __init__(self, estado, mensaje, tipo="invalid_request_error"):
+        super().__init__(mensaje)
+        self.estado = estado
+        self.tipo = tipo
+
+class Pasarela:
+    """Estado compartido por todas las peticiones HTTP del servidor.
+
+    "model" puede ser el nombre de un proveedor ("Deepseek"), "proveedor/modelo"
+    o solo un modelo, que se envía al proveedor por defecto. Con el campo
+    opcional "conversacion" la petición continúa esa conversación guardada:
+    se usa su historial, solo se toma el último mensaje del usuario y tanto
+    ese mensaje como la respuesta se guardan en el almacén.
+    """
+    def __init__(self, settings=None, conversaciones_dir=None):
+        self.settings = settings if settings is not None else get_settings()
+        self.api_keys = obtener_api_keys(self.settings)
+        self.ia_defecto = self.settings.get("ia_seleccionada") or "Deepseek"
+        directorio = conversaciones_dir or self.settings.get("conversaciones_dir")
+        self.almacen = crear_almacen(directorio, self.settings) if directorio else None
+        # Bot por conversación guardada; cada una atiende una petición a la vez
+        self._sesiones = {}
+        self._sesiones_lock = threading.Lock()
+        # Token que deben enviar los clientes (Authorization: Bearer ...), opcional
+        self.token = self.settings.get("servidor", {}).get("token")
+
+    def modelos(self):
+        datos = []
+        for nombre, cls in PROVEEDORES.items():
+            proveedor = cls.desde_ajustes(self.api_keys, self.settings)
+            datos.append({"id": f"{nombre}/{proveedor.modelo}", "object": "model", "owned_by": nombre})
+        return {"object": "list", "data": datos}
+
+    def _resolver_modelo(self, modelo):
+        """Devuelve (proveedor, modelo o None para el configurado)."""
+        if modelo is not None and not isinstance(modelo, str):
+            raise ErrorPasarela(400, "'model' debe ser texto")
+        if not modelo or modelo in PROVEEDORES:
+            return modelo or self.ia_defecto, None
+        proveedor, _, nombre = modelo.partition("/")
+        if nombre and proveedor in PROVEEDORES:
+            return proveedor, nombre
+        return self.ia_defecto, modelo
+
+    def _nuevo_bot(self, modelo):
+        ia, nombre_modelo = self._resolver_modelo(modelo)
+        if ia not in PROVEEDORES:
+            raise ErrorPasarela(400, f"Proveedor desconocido: {ia}")
+        if PROVEEDORES[ia].requiere_key and not self.api_keys.get(ia):
+            raise ErrorPasarela(401, f"No hay API Key configurada para {ia}", "authentication_error")
+        bot = crear_bot(ia, self.api_keys)
+        if nombre_modelo:
+            bot.proveedor.modelo = bot.model = nombre_modelo
+        return bot
+
+    def _sesion(self, conversacion, modelo):
+        if self.almacen is None:
+            raise ErrorPasarela(400, "El servidor no tiene carpeta de conversaciones")
+        with self._sesiones_lock:
+            sesion = self._sesiones.get(conversacion)
+            if sesion is not None:
+                return sesion
+            # Crear el archivo vacío es inmediato y, hecho bajo el lock, dos
+            # peticiones simultáneas no pueden vaciar lo que la otra ya guardó
+            existe = self.almacen.existe(conversacion)
+            if not existe:
+                self.almacen.crear(conversacion)
+        # El historial se lee sin el lock: abrir una conversación larga no
+        # retrasa las sesiones de las demás
+        bot = self._nuevo_bot(modelo)
+        if existe:
+            _, inicio, mensajes = self.almacen.cargar_ultimos(conversacion, 200)
+            bot.cargar_historial(mensajes, self.almacen.iterar_hacia_atras(conversacion, inicio))
+        with self._sesiones_lock:
+            # Si otra petición la creó mientras tanto, se usa la suya
+            return self._sesiones.setdefault(conversacion, (bot, threading.Lock()))
+
+    @staticmethod
+    def _normalizar_mensaje(mensaje):
+        """{"role", "content"} con el contenido como texto; une las partes de texto de una lista."""
+        if not isinstance(mensaje, dict) or not isinstance(mensaje.get("role"), str):
+            raise ErrorPasarela(400, "Cada mensaje debe ser un objeto con 'role' de texto")
+        contenido = mensaje.get("content")
+        if contenido is None:
+            contenido = ""
+        elif isinstance(contenido, list):
+            partes = []
+            for parte in contenido:
+                if isinstance(parte, str):
+                    partes.append(parte)
+                elif isinstance(parte, dict) and parte.get("type") == "text" and isinstance(parte.get("text"), str):
+                    partes.append(parte["text"])
+                else:
+                    raise ErrorPasarela(400, "Solo se admiten partes de contenido de tipo texto")
+            contenido = "".join(partes)
+        elif not isinstance(contenido, str):
+            raise ErrorPasarela(400, "'content' debe ser texto o una lista de partes de texto")
+        return {"role": mensaje["role"], "content": contenido}
+
+    @staticmethod
+    def _parametros(cuerpo):
+        """Parámetros que se reenvían al proveedor; 400 si piden algo que no se admite."""
+        desconocidos = sorted(set(cuerpo) - CAMPOS_PROPIOS - set(PARAMETROS_REENVIADOS))
+        if desconocidos:
+            raise ErrorPasarela(400, f"Parámetros no admitidos: {', '.join(desconocidos)}")
+        if cuerpo.get("n") not in (None, 1):
+            raise ErrorPasarela(400, "Solo se admite 'n' = 1")
+        parametros = {k: cuerpo[k] for k in PARAMETROS_REENVIADOS if cuerpo.get(k) is not None}
+        for nombre, valor in parametros.items():
+            if nombre == "stop":
+                valido = isinstance(valor, str) or (isinstance(valor, list) and all(isinstance(v, str) for v in valor))
+            elif nombre in ("max_tokens", "seed"):
+                valido = isinstance(valor, int) and not isinstance(valor, bool) and (nombre == "seed" or valor > 0)
+            else:
+                valido = isinstance(valor, (int, float)) and not isinstance(valor, bool)
+            if not valido:
+                raise ErrorPasarela(400, f"Valor no válido para '{nombre}'")
+        return parametros
+
+    def preparar(self, cuerpo):
+        """Valida la petición y devuelve (bot, texto del usuario, conversación, lock, parámetros)."""
+        if not isinstance(cuerpo, dict):
+            raise ErrorPasarela(400, "El cuerpo debe ser un objeto JSON")
+        parametros = self._parametros(cuerpo)
+        mensajes = cuerpo.get("messages")
+        if not isinstance(mensajes, list) or not mensajes:
+            raise ErrorPasarela(400, "'messages' debe ser una lista no vacía")
+        mensajes = [self._normalizar_mensaje(m) for m in mensajes]
+        ultimo = mensajes[-1]
+        if ultimo["role"] != "user":
+            raise ErrorPasarela(400, "El último mensaje debe ser del usuario")
+        conversacion = cuerpo.get("conversacion")
+        if conversacion is not None and not isinstance(conversacion, str):
+            raise ErrorPasarela(400, "'conversacion' debe ser texto")
+        if conversacion:
+            bot, lock = self._sesion(conversacion, cuerpo.get("model"))
+            return bot, ultimo["content"], conversacion, lock, parametros
+        bot = self._nuevo_bot(cuerpo.get("model"))
+        anteriores = mensajes[:-1]
+        if anteriores and anteriores[0]["role"] == "system":
+            bot.messages[0] = anteriores[0]
+            anteriores = anteriores[1:]
+        bot.messages.extend(anteriores)
+        return bot, ultimo["content"], None, None, parametros
+
+    def descartar_sesion(self, conversacion):
+        with self._sesiones_lock:
+            self._sesiones.pop(conversacion, None)
+
+    def guardar(self, conversacion, bot, texto, respuesta):
+        fecha_hora = time.strftime("%d/%m/%y %H:%M:%S")
+        self.almacen.agregar_mensaje(conversacion, {"author": "Tú", "text": texto, "fecha_hora": fecha_hora})
+        self.almacen.agregar_mensaje(conversacion, {"author": bot.proveedor.autor, "text": respuesta,
+                                                    "fecha_hora": fecha_hora, "metricas": bot.ultimas_metricas})
+
+    def cerrar(self):
+        if self.almacen is not None and hasattr(self.almacen, "cerrar"):
+            self.almacen.cerrar()
+
+class ManejadorPasarela(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "DeepSeekChat"
+
+    @property
+    def pasarela(self):
+        return self.server.pasarela
+
+    def log_message(self, formato, *args):
+        sys.stderr.write(f"{self.address_string()} - {formato % args}\n")
+
+    def _json(self, estado, datos):
+        cuerpo = json.dumps(datos, ensure_ascii=False).encode("utf-8")
+        self.send_response(estado)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def _error(self, estado, mensaje, tipo="invalid_request_error"):
+        self._json(estado, {"error": {"message": mensaje, "type": tipo}})
+
+    def _autorizado(self):
+        if not self.pasarela.token:
+            return True
+        if self.headers.get("Authorization", "") == f"Bearer {self.pasarela.token}":
+            return True
+        self._error(401, "Token no válido", "authentication_error")
+        return False
+
+    def do_GET(self):
+        if not self._autorizado():
+            return
+        if self.path.rstrip("/") == "/v1/models":
+            self._json(200, self.pasarela.modelos())
+        else:
+            self._error(404, f"Ruta desconocida: {self.path}")
+
+    def do_POST(self):
+        if not self._autorizado():
+            return
+        if self.path.rstrip("/") != "/v1/chat/completions":
+            self._error(404, f"Ruta desconocida: {self.path}")
+            return
+        try:
+            longitud = int(self.headers.get("Content-Length", 0))
+            cuerpo = json.loads(self.rfile.read(longitud) or b"{}")
+            bot, texto, conversacion, lock, parametros = self.pasarela.preparar(cuerpo)
+        except ErrorPasarela as e:
+            self._error(e.estado, str(e), e.tipo)
+            return
+        except ValueError:
+            self._error(400, "El cuerpo no es JSON válido")
+            return
+        except Exception as e:
+            # Que el cliente reciba siempre una respuesta en lugar de un corte de conexión
+            self._error(500, f"Error interno: {e}", "server_error")
+            return
+        if lock is not None:
+            with lock:
+                self._completar(cuerpo, bot, texto, conversacion, parametros)
+        else:
+            self._completar(cuerpo, bot, texto, conversacion, parametros)
+
+    def _completar(self, cuerpo, bot, texto, conversacion, parametros):
+        id_ = f"chatcmpl-{uuid.uuid4().hex}"
+        creado = int(time.time())
+        
+        def al_terminar(respuesta):
+            # Se guarda antes de contestar, así el cliente ya ve la conversación actualizada
+            if conversacion:
+                try:
+                    self.pasarela.guardar(conversacion, bot, texto, respuesta)
+                except Exception as e:
+                    print(f"No se pudo guardar la conversación {conversacion}: {e}", file=sys.stderr)
+        
+        if cuerpo.get("stream"):
+            respuesta = self._stream(bot, texto, id_, creado, cuerpo, parametros, al_terminar)
+        else:
+            respuesta = self._sin_stream(bot, texto, id_, creado, parametros, al_terminar)
+        if respuesta is None and conversacion:
+            # El contexto del bot quedó con una pregunta sin respuesta: se recarga la próxima vez
+            self.pasarela.descartar_sesion(conversacion)
+
+    @staticmethod
+    def _uso(bot):
+        est = bot.ultimas_estadisticas
+        if "prompt_tokens" not in est:
+            return None
+        return {"prompt_tokens": est["prompt_tokens"], "completion_tokens": est["completion_tokens"],
+                "total_tokens": est["prompt_tokens"] + est["completion_tokens"]}
+
+    @staticmethod
+    def _finish_reason(bot):
+        # "length" si la cortó max_tokens; una respuesta desde caché se da por completa
+        return bot.ultimas_estadisticas.get("finish_reason") or "stop"
+
+    def _error_proveedor(self, error):
+        estado = getattr(error, "status_code", None) or 502
+        return estado, {"error": {"message": str(error), "type": "provider_error"}}
+
+    def _sin_stream(self, bot, texto, id_, creado, parametros, al_terminar):
+        futuro = obtener_planificador().enviar(bot.proveedor, bot.stream_chat(texto, lambda _: None, **parametros))
+        try:
+            respuesta = futuro.result()
+        except Exception as e:
+            self._json(*self._error_proveedor(e))
+            return None
+        al_terminar(respuesta)
+        datos = {
+            "id": id_, "object": "chat.completion", "created": creado, "model": bot.model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": respuesta},
+                         "finish_reason": self._finish_reason(bot)}],
+        }
+        uso = self._uso(bot)
+        if uso:
+            datos["usage"] = uso
+        self._json(200, datos)
+        return respuesta
+
+    def _evento(self, datos):
+        linea = "data: " + (datos if isinstance(datos, str) else json.dumps(datos, ensure_ascii=False)) + "\n\n"
+        self.wfile.write(linea.encode("utf-8"))
+        self.wfile.flush()
+
+    def _stream(self, bot, texto, id_, creado, cuerpo, parametros, al_terminar):
+        """Reenvía los fragmentos como Server-Sent Events en cuanto llegan."""
+        cola = queue.Queue()
+        futuro = obtener_planificador().enviar(bot.proveedor, bot.stream_chat(texto, cola.put, **parametros))
+        futuro.add_done_callback(lambda _: cola.put(_FIN))
+        base = {"id": id_, "object": "chat.completion.chunk", "created": creado, "model": bot.model}
+        try:
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            # Sin longitud conocida: la conexión se cierra al terminar el stream
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.close_connection = True
+            self._evento({**base, "choices": [{"index": 0, "delta": {"role": "assistant", "content": ""},
+                                                "finish_reason": None}]})
+            while True:
+                fragmento = cola.get()
+                if fragmento is _FIN:
+                    break
+                self._evento({**base, "choices": [{"index": 0, "delta": {"content": fragmento},
+                                                    "finish_reason": None}]})
+            try:
+                respuesta = futuro.result()
+            except Exception as e:
+                self._evento(self._error_proveedor(e)[1])
+                self._evento("[DONE]")
+                return None
+            al_terminar(respuesta)
+            self._evento({**base, "choices": [{"index": 0, "delta": {}, "finish_reason": self._finish_reason(bot)}]})
+            uso = self._uso(bot)
+            opciones = cuerpo.get("stream_options")
+            if uso and isinstance(opciones, dict) and opciones.get("include_usage"):
+                self._evento({**base, "choices": [], "usage": uso})
+            self._evento("[DONE]")
+            return respuesta
+        except (BrokenPipeError, ConnectionResetError):
+            # El cliente se fue: se cancela la petición al proveedor
+            futuro.cancel()
+            return None
+
+class ServidorPasarela(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, direccion, pasarela):
+        super().__init__(direccion, ManejadorPasarela)
+        self.pasarela = pasarela
+
+def servir(host="127.0.0.1", puerto=8000, settings=None, conversaciones_dir=None):
+    """Arranca la pasarela y atiende peticiones hasta Ctrl+C."""
+    pasarela = Pasarela(settings, conversaciones_dir)
+    servidor = ServidorPasarela((host, puerto), pasarela)
+    print(f"Pasarela compatible con OpenAI en http://{host}:{puerto}/v1", file=sys.stderr)
+    try:
+        servidor.serve_forever()
+    finally:
+        servidor.server_close()
+        pasarela.cerrar()